@@ -0,0 +1,228 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains the reader and writer for unaligned BAM, the format current basecallers save
+reads in. A BAM file is BGZF (so it's decompressed like any gzipped file) holding a header and then
+one binary record per read: https://samtools.github.io/hts-specs/SAMv1.pdf
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import struct
+import sys
+from .gzip_reader import open_gzipped_file
+from .gzip_writer import BgzfWriter
+from .version import __version__
+
+BAM_MAGIC = b'BAM\x01'
+
+# The fixed-size fields at the start of each record, after its block_size.
+RECORD_FIELDS = struct.Struct('<iiBBHHHiiii')
+
+# Bases are stored two to a byte, as four-bit codes into this alphabet.
+BASE_CODES = '=ACMGRSVTWYHKDBN'
+HIGH_NIBBLE_BASES = bytes(ord(BASE_CODES[i >> 4]) for i in range(256))
+LOW_NIBBLE_BASES = bytes(ord(BASE_CODES[i & 15]) for i in range(256))
+BASES_TO_CODES = bytes(BASE_CODES.find(chr(i).upper()) if chr(i).upper() in BASE_CODES else 15
+                       for i in range(256))
+SHIFT_LEFT_FOUR = bytes((i << 4) & 0xff for i in range(256))
+
+# Qualities are stored as plain Phred scores, not offset by 33 like in FASTQ.
+PHRED_TO_FASTQ = bytes(min(i + 33, 126) for i in range(256))
+FASTQ_TO_PHRED = bytes(max(i - 33, 0) for i in range(256))
+
+COMPLEMENT = str.maketrans('ACGTMRWSYKVHDBNacgtmrwsykvhdbn', 'TGCAKYWSRMBDHVNtgcakywsrmbdhvn')
+
+# The sizes of the tag value types which aren't strings or arrays.
+TAG_VALUE_SIZES = {b'A': 1, b'c': 1, b'C': 1, b's': 2, b'S': 2, b'i': 4, b'I': 4, b'f': 4}
+
+# Secondary and supplementary records repeat a read which has its own primary record.
+NOT_PRIMARY = 0x100 | 0x800
+REVERSE_STRAND = 0x10
+UNMAPPED = 0x4
+
+# Porechop's tag on each trimmed read: the start and end (as slice positions) of the part of the
+# input read which was kept.
+TRIM_TAG = b'tr'
+
+# Tags with a value for each base (or which count bases) of the read as it was basecalled: base
+# modifications (and their older lowercase names) and the move table. They no longer fit a read
+# which has been trimmed, split or reverse complemented, so they are dropped from those reads.
+PER_BASE_TAGS = {b'MM', b'ML', b'MN', b'Mm', b'Ml', b'mv'}
+
+
+def iterate_bam(bam_filename):
+    """
+    Yields a tuple (name, seq, quals, tags) for each read in the BAM file. The tags are left in
+    their binary form, so they can be written back out unchanged.
+    """
+    with open_gzipped_file(bam_filename) as bam_file:
+        read_bam_header(bam_file)
+        yield from iterate_bam_records(bam_file)
+
+
+def load_bam_header(bam_filename):
+    with open_gzipped_file(bam_filename) as bam_file:
+        return read_bam_header(bam_file)
+
+
+def read_bam_header(bam_file):
+    """
+    Reads the header from a decompressed BAM file and returns its SAM header text, leaving the file
+    at the first read.
+    """
+    if bam_file.read(4) != BAM_MAGIC:
+        raise IndexError('not a BAM file')
+    text_length = read_int(bam_file)
+    header_text = read_exactly(bam_file, text_length).rstrip(b'\x00').decode()
+    for _ in range(read_int(bam_file)):  # reference sequences (unaligned BAM shouldn't have any)
+        name_length = read_int(bam_file)
+        read_exactly(bam_file, name_length + 4)
+    return header_text
+
+
+def iterate_bam_records(bam_file):
+    """
+    Yields the reads from a decompressed BAM file which is past its header. Secondary and
+    supplementary records are skipped, so each read comes out once, as it was sequenced.
+    """
+    while True:
+        size_bytes = bam_file.read(4)
+        if not size_bytes:
+            return
+        if len(size_bytes) < 4:
+            raise IndexError('truncated BAM record')
+        record = read_exactly(bam_file, struct.unpack('<i', size_bytes)[0])
+        _, _, name_length, _, _, cigar_length, flag, seq_length, _, _, _ = \
+            RECORD_FIELDS.unpack_from(record)
+        if flag & NOT_PRIMARY or seq_length == 0:
+            continue
+        name = record[32:32 + name_length - 1].decode()
+        seq_start = 32 + name_length + 4 * cigar_length
+        quals_start = seq_start + (seq_length + 1) // 2
+        tags_start = quals_start + seq_length
+        seq = unpack_sequence(record[seq_start:quals_start], seq_length)
+        quals = record[quals_start:tags_start]
+        quals = '' if quals[0] == 0xff else quals.translate(PHRED_TO_FASTQ).decode()
+        tags = record[tags_start:]
+        if flag & REVERSE_STRAND:
+            seq = seq.translate(COMPLEMENT)[::-1]
+            quals = quals[::-1]
+            tags = remove_tags(tags, PER_BASE_TAGS)
+        yield name, seq, quals, tags
+
+
+def read_int(bam_file):
+    return struct.unpack('<i', read_exactly(bam_file, 4))[0]
+
+
+def read_exactly(bam_file, size):
+    data = bam_file.read(size)
+    if len(data) < size:
+        raise IndexError('truncated BAM file')
+    return data
+
+
+def unpack_sequence(packed, seq_length):
+    seq = bytearray(2 * len(packed))
+    seq[0::2] = packed.translate(HIGH_NIBBLE_BASES)
+    seq[1::2] = packed.translate(LOW_NIBBLE_BASES)
+    return seq[:seq_length].decode()
+
+
+def pack_sequence(seq):
+    """
+    Packs the bases two to a byte. Python's big integers do the packing for the whole sequence at
+    once: the high nibbles' number shifted left four bits, plus the low nibbles' number.
+    """
+    codes = seq.encode().translate(BASES_TO_CODES)
+    if len(codes) % 2:
+        codes += b'\x00'
+    high_nibbles = codes[0::2].translate(SHIFT_LEFT_FOUR)
+    packed = int.from_bytes(high_nibbles, 'big') + int.from_bytes(codes[1::2], 'big')
+    return packed.to_bytes(len(high_nibbles), 'big')
+
+
+def bam_record(read_name, seq, quals, tags, trim_start, trim_end):
+    """
+    Returns the binary record for an unaligned read. The trim tag is added to the tags (replacing
+    one from an earlier run of Porechop).
+    """
+    read_name = read_name.encode()
+    if len(read_name) > 254:  # the name's length (with its null) has to fit in one byte
+        sys.exit('Error: read name too long for BAM (over 254 characters): ' +
+                 read_name[:40].decode(errors='replace') + '...')
+    read_name += b'\x00'
+    if quals:
+        quals = quals.encode().translate(FASTQ_TO_PHRED)
+    else:
+        quals = b'\xff' * len(seq)
+    if TRIM_TAG in tags:
+        tags = remove_tags(tags, {TRIM_TAG})
+    record = b''.join([RECORD_FIELDS.pack(-1, -1, len(read_name), 255, 4680, 0, UNMAPPED,
+                                          len(seq), -1, -1, 0),
+                       read_name, pack_sequence(seq), quals, tags,
+                       TRIM_TAG + b'BI' + struct.pack('<iII', 2, trim_start, trim_end)])
+    return struct.pack('<i', len(record)) + record
+
+
+def remove_tags(tags, tag_names):
+    kept_tags = []
+    position = 0
+    while position < len(tags):
+        tag_start = position
+        value_type = tags[position + 2:position + 3]
+        position += 3
+        if value_type in TAG_VALUE_SIZES:
+            position += TAG_VALUE_SIZES[value_type]
+        elif value_type in (b'Z', b'H'):
+            position = tags.index(b'\x00', position) + 1
+        elif value_type == b'B':
+            element_type = tags[position:position + 1]
+            element_count = struct.unpack_from('<i', tags, position + 1)[0]
+            position += 5 + element_count * TAG_VALUE_SIZES[element_type]
+        else:
+            return tags  # an unknown type, so the tags are left as they are
+        if tags[tag_start:tag_start + 2] not in tag_names:
+            kept_tags.append(tags[tag_start:position])
+    return b''.join(kept_tags)
+
+
+def sam_header(input_header_text):
+    """
+    The output's header is the input BAM's header (if there was one) with its reference sequences
+    removed, since the output is unaligned, and a line for this run of Porechop added.
+    """
+    lines = [line for line in input_header_text.split('\n')
+             if line and not line.startswith('@SQ\t')]
+    if not lines or not lines[0].startswith('@HD\t'):
+        lines.insert(0, '@HD\tVN:1.6\tSO:unknown')
+    program_ids = [field[3:] for line in lines if line.startswith('@PG\t')
+                   for field in line.split('\t') if field.startswith('ID:')]
+    program_id, i = 'porechop', 1
+    while program_id in program_ids:
+        program_id, i = 'porechop.' + str(i), i + 1
+    program_line = '@PG\tID:' + program_id + '\tPN:porechop'
+    if program_ids:
+        program_line += '\tPP:' + program_ids[-1]
+    program_line += '\tVN:' + __version__ + '\tCL:' + ' '.join(sys.argv)
+    return '\n'.join(lines + [program_line]) + '\n'
+
+
+class BamWriter(BgzfWriter):
+    """
+    Writes an unaligned BAM file: the header (with no reference sequences) and then the records
+    given to write_bytes.
+    """
+    def __init__(self, file, compressor, index_filename, header_text):
+        super().__init__(file, compressor, index_filename)
+        header_text = header_text.encode()
+        self.write_bytes(BAM_MAGIC + struct.pack('<i', len(header_text)) + header_text +
+                         struct.pack('<i', 0))
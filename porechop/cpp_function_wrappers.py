@@ -16,7 +16,10 @@ not, see <http://www.gnu.org/licenses/>.
 
 import os
 import sys
-from ctypes import CDLL, cast, c_char_p, c_int, c_void_p
+import threading
+from functools import lru_cache
+from ctypes import CDLL, Structure, POINTER, byref, pointer, cast, pythonapi, py_object, \
+    c_char_p, c_void_p, c_int, c_double, c_ssize_t
 
 SO_FILE = 'cpp_functions.so'
 SO_FILE_FULL = os.path.join(os.path.dirname(os.path.realpath(__file__)), SO_FILE)
@@ -24,40 +27,488 @@ if not os.path.isfile(SO_FILE_FULL):
     sys.exit('could not find ' + SO_FILE + ' - please reinstall')
 C_LIB = CDLL(SO_FILE_FULL)
 
-C_LIB.adapterAlignment.argtypes = [c_char_p,  # Read sequence
-                                   c_char_p,  # Adapter sequence
-                                   c_int,     # Match score
-                                   c_int,     # Mismatch score
-                                   c_int,     # Gap open score
-                                   c_int]     # Gap extension score
-C_LIB.adapterAlignment.restype = c_void_p     # String describing alignment
 
+class AlignmentResult(Structure):
+    """
+    Mirrors the AlignmentResult struct in alignment.h. The C++ functions fill this in directly, so
+    no strings need to be formatted, allocated or parsed for each alignment.
+    """
+    _fields_ = [('read_start', c_int),
+                ('read_end', c_int),
+                ('adapter_start', c_int),
+                ('adapter_end', c_int),
+                ('raw_score', c_int),
+                ('aligned_region_percent_identity', c_double),
+                ('full_adapter_percent_identity', c_double)]
+
+
+class AlignmentThreshold(Structure):
+    """
+    Mirrors the AlignmentThreshold struct in alignment.h. Alignments which can't reach either of
+    these identities are only scored, skipping the traceback.
+    """
+    _fields_ = [('full_adapter_percent_identity', c_double),
+                ('aligned_region_percent_identity', c_double),
+                ('min_aligned_region_length', c_int)]
+
+
+class MiddleAdapterHit(Structure):
+    """
+    Mirrors the MiddleAdapterHit struct in adapter_align.h: one adapter hit in the middle of a read.
+    """
+    _fields_ = [('adapter_index', c_int),
+                ('read_start', c_int),
+                ('read_end', c_int),
+                ('full_adapter_percent_identity', c_double)]
+
+
+class ReadEndSettings(Structure):
+    """
+    Mirrors the ReadEndSettings struct in read_batch.h.
+    """
+    _fields_ = [('scoring_scheme_id', c_int),
+                ('end_size', c_int),
+                ('extra_trim_size', c_int),
+                ('end_threshold', c_double),
+                ('min_trim_size', c_int),
+                ('barcode_search_threshold', c_double),
+                ('end_band', c_int)]
+
+
+class ReadEndAdapter(Structure):
+    """
+    Mirrors the ReadEndAdapter struct in read_batch.h: one adapter set to look for at the read
+    ends. The end adapter ID and barcode index are -1 when not used.
+    """
+    _fields_ = [('start_adapter_id', c_int),
+                ('end_adapter_id', c_int),
+                ('barcode_index', c_int)]
+
+
+class ReadEndResult(Structure):
+    """
+    Mirrors the ReadEndResult struct in read_batch.h: the trim amounts and the two best barcodes
+    (as barcode indices, -1 if none) at each end of one read.
+    """
+    _fields_ = [('start_trim_amount', c_int),
+                ('end_trim_amount', c_int),
+                ('best_start_barcode', c_int),
+                ('best_start_barcode_score', c_double),
+                ('second_best_start_barcode', c_int),
+                ('second_best_start_barcode_score', c_double),
+                ('best_end_barcode', c_int),
+                ('best_end_barcode_score', c_double),
+                ('second_best_end_barcode', c_int),
+                ('second_best_end_barcode_score', c_double)]
+
+
+C_LIB.addAdapter.argtypes = [c_char_p]  # Adapter sequence
+C_LIB.addAdapter.restype = c_int         # Adapter ID
+
+C_LIB.addScoringScheme.argtypes = [c_int,  # Match score
+                                   c_int,  # Mismatch score
+                                   c_int,  # Gap open score
+                                   c_int]  # Gap extension score
+C_LIB.addScoringScheme.restype = c_int     # Scoring scheme ID
+
+C_LIB.adapterAlignment.argtypes = [c_char_p,                     # Read sequence
+                                   c_int,                        # Read sequence length
+                                   c_int,                        # Adapter ID
+                                   c_int,                        # Scoring scheme ID
+                                   POINTER(AlignmentThreshold),  # Threshold (can be None)
+                                   POINTER(AlignmentResult)]     # Result (filled in)
+C_LIB.adapterAlignment.restype = None
+
+C_LIB.adapterAlignmentBatch.argtypes = [c_char_p,                     # Read sequence
+                                        c_int,                        # Read sequence length
+                                        POINTER(c_int),               # Adapter IDs
+                                        c_int,                        # Adapter count
+                                        c_int,                        # Scoring scheme ID
+                                        POINTER(AlignmentThreshold),  # Thresholds (can be None)
+                                        POINTER(AlignmentResult)]     # Results (one per adapter)
+C_LIB.adapterAlignmentBatch.restype = None
+
+C_LIB.anchoredAdapterAlignmentBatch.argtypes = [c_char_p,                     # Read sequence
+                                                c_int,                        # Read length
+                                                POINTER(c_int),               # Adapter IDs
+                                                c_int,                        # Adapter count
+                                                c_int,                        # Scoring scheme ID
+                                                POINTER(AlignmentThreshold),  # Thresholds
+                                                c_int,                        # Anchor at end
+                                                c_int,                        # Band
+                                                POINTER(AlignmentResult)]     # Results
+C_LIB.anchoredAdapterAlignmentBatch.restype = None
 
-# This function cleans up the heap memory for the C strings returned by the other C functions. It
-# must be called after them.
-C_LIB.freeCString.argtypes = [c_void_p]
-C_LIB.freeCString.restype = None
+C_LIB.findMiddleAdapters.argtypes = [c_char_p,                   # Read sequence
+                                     c_int,                      # Read sequence length
+                                     POINTER(c_int),             # Adapter IDs
+                                     c_int,                      # Adapter count
+                                     c_int,                      # Scoring scheme ID
+                                     c_double,                   # Middle threshold
+                                     POINTER(MiddleAdapterHit),  # Hits (filled in)
+                                     c_int]                      # Room for this many hits
+C_LIB.findMiddleAdapters.restype = c_int                         # Number of hits
 
+C_LIB.trimReadEndsBatch.argtypes = [POINTER(c_char_p),        # Read sequences
+                                    POINTER(c_int),           # Read sequence lengths
+                                    c_int,                    # Read count
+                                    POINTER(ReadEndAdapter),  # Adapter sets
+                                    c_int,                    # Adapter set count
+                                    c_int,                    # Barcode count
+                                    POINTER(ReadEndSettings),  # Settings
+                                    c_int,                    # Thread count
+                                    POINTER(ReadEndResult)]   # Results (one per read)
+C_LIB.trimReadEndsBatch.restype = None
 
-def adapter_alignment(read_sequence, adapter_sequence, scoring_scheme_vals):
+C_LIB.findMiddleAdaptersBatch.argtypes = [POINTER(c_char_p),          # Read sequences
+                                          POINTER(c_int),             # Read sequence lengths
+                                          c_int,                      # Read count
+                                          POINTER(c_int),             # Adapter IDs
+                                          c_int,                      # Adapter count
+                                          c_int,                      # Scoring scheme ID
+                                          c_double,                   # Middle threshold
+                                          c_int,                      # Thread count
+                                          POINTER(MiddleAdapterHit),  # Hits (filled in)
+                                          c_int,                      # Room for hits per read
+                                          POINTER(c_int)]             # Hit counts (one per read)
+C_LIB.findMiddleAdaptersBatch.restype = None
+
+C_LIB.findFastqRecords.argtypes = [c_char_p,        # Buffer of FASTQ text
+                                   c_int,           # Buffer length
+                                   POINTER(c_int),  # Line bounds (filled in, 8 per record)
+                                   c_int,           # Room for this many records
+                                   POINTER(c_int)]  # Bytes used by the records (filled in)
+C_LIB.findFastqRecords.restype = c_int              # Number of records
+
+
+# The C++ side keeps its own copy of each adapter sequence and scoring scheme, so these only need
+# to be sent once. These dictionaries map them to their C++ IDs.
+ADAPTER_IDS = {}
+SCORING_SCHEME_IDS = {}
+REGISTRY_LOCK = threading.Lock()
+
+
+def register_adapter(adapter_sequence):
+    """
+    Returns the C++ ID for the adapter sequence, adding it to the C++ registry if necessary.
+    """
+    try:
+        return ADAPTER_IDS[adapter_sequence]
+    except KeyError:
+        with REGISTRY_LOCK:
+            if adapter_sequence not in ADAPTER_IDS:
+                ADAPTER_IDS[adapter_sequence] = C_LIB.addAdapter(adapter_sequence.encode('utf-8'))
+            return ADAPTER_IDS[adapter_sequence]
+
+
+def register_scoring_scheme(scoring_scheme_vals):
+    """
+    Returns the C++ ID for the scoring scheme (match, mismatch, gap open, gap extend), adding it to
+    the C++ registry if necessary.
+    """
+    scoring_scheme_vals = tuple(scoring_scheme_vals)
+    try:
+        return SCORING_SCHEME_IDS[scoring_scheme_vals]
+    except KeyError:
+        with REGISTRY_LOCK:
+            if scoring_scheme_vals not in SCORING_SCHEME_IDS:
+                SCORING_SCHEME_IDS[scoring_scheme_vals] = \
+                    C_LIB.addScoringScheme(*scoring_scheme_vals)
+            return SCORING_SCHEME_IDS[scoring_scheme_vals]
+
+
+def adapter_alignment(read_sequence, adapter_sequence, scoring_scheme_vals, threshold=None):
+    """
+    Python wrapper for adapterAlignment C++ function. Returns an AlignmentResult. Like all of the
+    read sequences given to these wrappers, read_sequence can be a str or a bytes-like object, or a
+    (sequence, start, end) tuple for part of one (see sequence_pointer). The threshold is
+    an optional (full adapter identity, aligned region identity, min aligned region length) tuple:
+    if the alignment can't reach either identity, only its score is computed and the result looks
+    like a failed alignment. Either identity can be None if it's of no interest.
     """
-    Python wrapper for adapterAlignment C++ function.
+    result = AlignmentResult()
+    C_LIB.adapterAlignment(*sequence_pointer(read_sequence), register_adapter(adapter_sequence),
+                           register_scoring_scheme(scoring_scheme_vals),
+                           alignment_threshold(threshold), byref(result))
+    return result
+
+
+def adapter_alignment_batch(read_sequence, adapter_sequences, scoring_scheme_vals,
+                            thresholds=None):
+    """
+    Python wrapper for adapterAlignmentBatch C++ function. Aligns the read sequence to each of the
+    adapter sequences (which must be a tuple) and returns an array of AlignmentResults in the same
+    order. If given, thresholds is a tuple with one threshold (as for adapter_alignment) for each
+    adapter.
+    """
+    adapter_count = len(adapter_sequences)
+    results = (AlignmentResult * adapter_count)()
+    if adapter_count:
+        C_LIB.adapterAlignmentBatch(*sequence_pointer(read_sequence),
+                                    adapter_id_array(adapter_sequences), adapter_count,
+                                    register_scoring_scheme(scoring_scheme_vals),
+                                    alignment_threshold_array(thresholds), results)
+    return results
+
+
+def anchored_adapter_alignment_batch(read_sequence, adapter_sequences, scoring_scheme_vals,
+                                     thresholds, at_read_end, band):
+    """
+    Python wrapper for anchoredAdapterAlignmentBatch C++ function. The same as
+    adapter_alignment_batch, but the adapters are anchored at the start of the read sequence (or
+    its end if at_read_end is True): only alignments starting within band bases of there are
+    looked for, so the cost doesn't grow with the read sequence's length.
     """
-    match_score = scoring_scheme_vals[0]
-    mismatch_score = scoring_scheme_vals[1]
-    gap_open_score = scoring_scheme_vals[2]
-    gap_extend_score = scoring_scheme_vals[3]
-    ptr = C_LIB.adapterAlignment(read_sequence.encode('utf-8'), adapter_sequence.encode('utf-8'),
-                                 match_score, mismatch_score, gap_open_score, gap_extend_score)
-    result_string = c_string_to_python_string(ptr)
-    return result_string
+    adapter_count = len(adapter_sequences)
+    results = (AlignmentResult * adapter_count)()
+    if adapter_count:
+        C_LIB.anchoredAdapterAlignmentBatch(*sequence_pointer(read_sequence),
+                                            adapter_id_array(adapter_sequences), adapter_count,
+                                            register_scoring_scheme(scoring_scheme_vals),
+                                            alignment_threshold_array(thresholds),
+                                            1 if at_read_end else 0, band, results)
+    return results
+
+
+def find_middle_adapters(read_sequence, adapter_sequences, scoring_scheme_vals, middle_threshold):
+    """
+    Python wrapper for findMiddleAdapters C++ function. Returns a list of MiddleAdapterHits: every
+    hit of the adapter sequences (which must be a tuple) with a full adapter identity of at least
+    middle_threshold, in the order they were found. The hit positions are relative to the start of
+    the read sequence (or of its part, if a part was given).
+    """
+    adapter_count = len(adapter_sequences)
+    if not adapter_count:
+        return []
+    read_sequence, read_length = sequence_pointer(read_sequence)
+    adapter_ids = adapter_id_array(adapter_sequences)
+    scoring_scheme_id = register_scoring_scheme(scoring_scheme_vals)
+
+    # Reads almost never have more than a few hits. If there are more than the array can hold, the
+    # search is simply repeated with a big enough array.
+    max_hits = 16
+    while True:
+        hits = (MiddleAdapterHit * max_hits)()
+        hit_count = C_LIB.findMiddleAdapters(read_sequence, read_length, adapter_ids, adapter_count,
+                                             scoring_scheme_id, middle_threshold, hits, max_hits)
+        if hit_count <= max_hits:
+            return hits[:hit_count]
+        max_hits = hit_count
+
+
+def trim_read_ends_batch(read_sequences, adapters, barcode_count, settings, threads):
+    """
+    Python wrapper for trimReadEndsBatch C++ function. read_sequences is a list of whole read
+    sequences (the C++ function takes their ends), adapters is a C array of ReadEndAdapters and
+    settings is a ReadEndSettings. Returns an array of ReadEndResults, one per read.
+    """
+    read_count = len(read_sequences)
+    results = (ReadEndResult * read_count)()
+    if read_count:
+        sequences, lengths, _ = sequence_pointer_arrays(read_sequences)
+        C_LIB.trimReadEndsBatch(sequences, lengths, read_count, adapters, len(adapters),
+                                barcode_count, byref(settings), threads, results)
+    return results
+
+
+def find_middle_adapters_batch(read_sequences, adapter_sequences, scoring_scheme_vals,
+                               middle_threshold, threads):
+    """
+    Python wrapper for findMiddleAdaptersBatch C++ function. Returns a list with the hits for each
+    read sequence (the same as find_middle_adapters gives for one read).
+    """
+    read_count = len(read_sequences)
+    if not read_count or not adapter_sequences:
+        return [[] for _ in range(read_count)]
+    sequences, lengths, _ = sequence_pointer_arrays(read_sequences)
+    max_hits_per_read = 4
+    hits = (MiddleAdapterHit * (read_count * max_hits_per_read))()
+    hit_counts = (c_int * read_count)()
+    C_LIB.findMiddleAdaptersBatch(sequences, lengths, read_count,
+                                  adapter_id_array(adapter_sequences), len(adapter_sequences),
+                                  register_scoring_scheme(scoring_scheme_vals), middle_threshold,
+                                  threads, hits, max_hits_per_read, hit_counts)
+
+    # The rare reads with more hits than there was room for are searched again on their own.
+    all_hits = []
+    for i, hit_count in enumerate(hit_counts):
+        if hit_count <= max_hits_per_read:
+            first_hit = i * max_hits_per_read
+            all_hits.append(hits[first_hit:first_hit + hit_count])
+        else:
+            all_hits.append(find_middle_adapters(read_sequences[i], adapter_sequences,
+                                                 scoring_scheme_vals, middle_threshold))
+    return all_hits
+
+
+def find_fastq_records(buffer, length, line_bounds):
+    """
+    Python wrapper for findFastqRecords C++ function. The buffer (a bytearray) holds length bytes of
+    a FASTQ file and line_bounds is a C int array with room for eight ints per record. Returns the
+    line bounds of the complete records at the start of the buffer as a flat list, and the number
+    of bytes those records use.
+    """
+    consumed = c_int()
+    record_count = C_LIB.findFastqRecords(c_char_p(buffer_address(buffer)), length, line_bounds,
+                                          len(line_bounds) // 8, byref(consumed))
+    return line_bounds[:8 * record_count], consumed.value
+
+
+class PyBuffer(Structure):
+    """
+    Mirrors Python's own Py_buffer struct, so the address of any bytes-like object's memory can be
+    found with PyObject_GetBuffer.
+    """
+    _fields_ = [('buf', c_void_p),
+                ('obj', c_void_p),
+                ('len', c_ssize_t),
+                ('itemsize', c_ssize_t),
+                ('readonly', c_int),
+                ('ndim', c_int),
+                ('format', c_char_p),
+                ('shape', POINTER(c_ssize_t)),
+                ('strides', POINTER(c_ssize_t)),
+                ('suboffsets', POINTER(c_ssize_t)),
+                ('internal', c_void_p)]
+
+
+pythonapi.PyObject_GetBuffer.argtypes = [py_object, POINTER(PyBuffer), c_int]
+pythonapi.PyObject_GetBuffer.restype = c_int
+pythonapi.PyBuffer_Release.argtypes = [POINTER(PyBuffer)]
+pythonapi.PyBuffer_Release.restype = None
+
+
+def buffer_address(buffer):
+    """
+    Returns the memory address of a bytes-like object's (contiguous) contents.
+    """
+    if isinstance(buffer, bytes):
+        return cast(c_char_p(buffer), c_void_p).value
+    view = PyBuffer()
+    pythonapi.PyObject_GetBuffer(buffer, byref(view), 0)
+    address = view.buf
+    pythonapi.PyBuffer_Release(byref(view))
+    return address
+
+
+def sequence_pointer(sequence):
+    """
+    Returns a pointer to a read sequence and its length, for the C++ functions. The sequence is a
+    str, a bytes-like object (bytes, bytearray, memoryview, mmap, etc.) or a (sequence, start, end)
+    tuple for part of one, where start and end work like a slice. Bytes-like objects are read by
+    the C++ function where they are, without being copied, so a read stored once as bytes can be
+    aligned on any part of it. They must stay alive and unchanged until the C++ function returns.
+    A str has to be encoded into a new bytes object, which is returned in place of the pointer.
+    """
+    if isinstance(sequence, tuple):
+        sequence, start, end = sequence
+    else:
+        start, end = 0, None
+    if isinstance(sequence, str):
+        sequence = sequence[start:end].encode('utf-8')
+        start, end = 0, None
+    start, end, _ = slice(start, end).indices(len(sequence))
+    length = max(end - start, 0)
+    if length == 0:
+        return b'', 0
+    if start == 0 and isinstance(sequence, bytes):
+        return sequence, length
+    return c_char_p(buffer_address(sequence) + start), length
+
+
+def sequence_pointer_arrays(sequences):
+    """
+    Like sequence_pointer, but for many sequences at once. Returns C arrays of the pointers and
+    lengths, plus a list of what sequence_pointer returned, which must be kept until the C++
+    function returns (encoded strs only exist there).
+    """
+    pointers = (c_char_p * len(sequences))()
+    lengths = (c_int * len(sequences))()
+    keep_alive = []
+    for i, sequence in enumerate(sequences):
+        sequence_i, lengths[i] = sequence_pointer(sequence)
+        pointers[i] = sequence_i
+        keep_alive.append(sequence_i)
+    return pointers, lengths, keep_alive
+
+
+def make_alignment_threshold(threshold):
+    full_identity, aligned_identity, min_aligned_length = threshold
+
+    # The C++ side treats an identity over 100% as not being of interest.
+    return AlignmentThreshold(101.0 if full_identity is None else full_identity,
+                              101.0 if aligned_identity is None else aligned_identity,
+                              min_aligned_length)
+
+
+@lru_cache(maxsize=1024)
+def alignment_threshold(threshold):
+    """
+    Converts a threshold tuple to a pointer to an AlignmentThreshold (or None for no threshold).
+    Most calls use the same few thresholds, so the result is cached.
+    """
+    if threshold is None:
+        return None
+    return pointer(make_alignment_threshold(threshold))
+
+
+@lru_cache(maxsize=1024)
+def alignment_threshold_array(thresholds):
+    """
+    Converts a tuple of threshold tuples to a C array of AlignmentThresholds (or None for no
+    thresholds). Most calls use the same few thresholds, so the result is cached.
+    """
+    if thresholds is None:
+        return None
+    return (AlignmentThreshold * len(thresholds))(*[make_alignment_threshold(x)
+                                                    for x in thresholds])
+
+
+@lru_cache(maxsize=None)
+def adapter_id_array(adapter_sequences):
+    """
+    Converts a tuple of adapter sequences to a C array of their IDs. The same adapters are used for
+    every read, so the result is cached.
+    """
+    return (c_int * len(adapter_sequences))(*[register_adapter(x) for x in adapter_sequences])
+
+
+@lru_cache(maxsize=None)
+def read_end_adapter_array(adapter_sets):
+    """
+    Converts a tuple of (start adapter sequence, end adapter sequence or None, barcode index)
+    tuples to a C array of ReadEndAdapters for trim_read_ends_batch. The adapter IDs are only
+    valid in the process which registered them, which is why the adapter sets are described by
+    their sequences until here.
+    """
+    return (ReadEndAdapter * len(adapter_sets))(
+        *[ReadEndAdapter(register_adapter(start_sequence),
+                         -1 if end_sequence is None else register_adapter(end_sequence),
+                         barcode_index)
+          for start_sequence, end_sequence, barcode_index in adapter_sets])
+
+
+def read_end_settings(scoring_scheme_vals, *settings):
+    """
+    Makes the ReadEndSettings for trim_read_ends_batch. The settings after the scoring scheme are
+    the rest of ReadEndSettings' fields, in order.
+    """
+    return ReadEndSettings(register_scoring_scheme(scoring_scheme_vals), *settings)
+
+
+C_LIB.setAlignmentEngine.argtypes = [c_int]  # Engine number
+C_LIB.setAlignmentEngine.restype = c_int     # Engine which will actually be used
+
+ALIGNMENT_ENGINES = ['standard', 'simd', 'myers']
 
 
-def c_string_to_python_string(c_string):
+def set_alignment_engine(engine_name):
     """
-    This function casts a C string to a Python string and then calls a function to delete the C
-    string from the heap.
+    Chooses the engine used for adapter alignments: 'standard' (SeqAn), 'simd' (many adapters
+    aligned at once in vector lanes, for read ends) or 'myers' (a bit-parallel search narrows down
+    where to align in the whole read, for middle adapters). Returns the name of the engine which
+    will actually be used, as the SIMD engine falls back to the standard one if the CPU doesn't
+    support it.
     """
-    python_string = cast(c_string, c_char_p).value.decode()
-    C_LIB.freeCString(c_string)
-    return python_string
+    engine = C_LIB.setAlignmentEngine(ALIGNMENT_ENGINES.index(engine_name))
+    return ALIGNMENT_ENGINES[engine]
@@ -0,0 +1,123 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains the readers which decompress gzipped input files off the main thread, so
+Porechop can parse and align reads while the next part of the file is being inflated.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import io
+import queue
+import shutil
+import subprocess
+import threading
+import zlib
+
+# External decompressors, fastest first. Whichever is found first on the PATH is used.
+DECOMPRESSORS = ['igzip', 'pigz']
+
+# The decompression thread hands over the data in chunks of this many bytes and gets at most this
+# many chunks ahead of the reader.
+CHUNK_SIZE = 1024 * 1024
+QUEUED_CHUNKS = 8
+
+
+def open_gzipped_file(filename):
+    """
+    Returns a binary file object of the decompressed contents of a gzipped file. If igzip or pigz
+    is installed, it does the decompression in its own process, otherwise it's done on a thread.
+    """
+    for decompressor in DECOMPRESSORS:
+        if shutil.which(decompressor):
+            return io.BufferedReader(ExternalGzipReader(decompressor, filename))
+    return io.BufferedReader(ThreadedGzipReader(filename))
+
+
+class ThreadedGzipReader(io.RawIOBase):
+    """
+    Decompresses the file (a filename or a binary file object, like stdin) on a separate thread
+    (zlib releases the GIL while it inflates) which passes the data over through a bounded queue.
+    """
+    def __init__(self, filename):
+        self.chunks = queue.Queue(maxsize=QUEUED_CHUNKS)
+        self.pending = memoryview(b'')
+        self.finished = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.decompress, args=(filename,), daemon=True)
+        self.thread.start()
+
+    def decompress(self, filename):
+        try:
+            with gzip.open(filename, 'rb') as gzipped_file:
+                while not self.stopping.is_set():
+                    chunk = gzipped_file.read(CHUNK_SIZE)
+                    self.chunks.put(chunk)
+                    if not chunk:
+                        break
+        except (OSError, EOFError, zlib.error) as error:
+            self.chunks.put(error)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.pending:
+            if self.finished:
+                return 0
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                self.finished = True
+                raise chunk
+            if not chunk:
+                self.finished = True
+                return 0
+            self.pending = memoryview(chunk)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        # The thread may be waiting for room in the queue, so the queue is emptied until it stops.
+        self.stopping.set()
+        while self.thread.is_alive():
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                self.thread.join(timeout=0.01)
+        super().close()
+
+
+class ExternalGzipReader(io.RawIOBase):
+    """
+    Reads the output of an external decompressor (e.g. pigz -dc) through a pipe.
+    """
+    def __init__(self, decompressor, filename):
+        self.decompressor = decompressor
+        self.process = subprocess.Popen([decompressor, '-dc', filename], stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, bufsize=0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self.process.stdout.readinto(buffer)
+        if not size and self.process.wait() != 0:
+            raise OSError(self.decompressor + ' could not decompress the file')
+        return size
+
+    def close(self):
+        if self.process.poll() is None:  # closed before the end of the file
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        super().close()
@@ -0,0 +1,179 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains the writer which gzips output files in blocks on a thread pool, so reads can
+be compressed as they are saved instead of all at the end.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# The BGZF end-of-file marker: an empty block, which tells readers the file wasn't truncated.
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def compress_gzip_member(data, compression_level):
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_bgzf_block(data, compression_level):
+    """
+    A BGZF block is a gzip member with an extra field ('BC') holding the block's compressed size.
+    """
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2,
+                         len(deflated) + 25)
+    return header + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+class GzipCompressor(object):
+    """
+    Compresses blocks for any number of ParallelGzipWriters on one thread pool (zlib releases the
+    GIL while it deflates). Finished blocks are written to their files in the order they were
+    submitted, which keeps each file's blocks in order. At most two blocks per thread are waiting
+    at once, however many files there are, which limits the memory used.
+    """
+    def __init__(self, threads, compression_level):
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.compression_level = compression_level
+        self.max_pending = 2 * threads
+        self.pending = collections.deque()  # (writer, future) pairs
+
+    def submit(self, writer, data):
+        self.pending.append((writer, self.executor.submit(writer.compress, data,
+                                                          self.compression_level)))
+        while self.pending and (len(self.pending) > self.max_pending or self.pending[0][1].done()):
+            self.write_oldest()
+
+    def write_oldest(self):
+        writer, future = self.pending.popleft()
+        writer.write_compressed(future.result())
+
+    def finish(self, writer):
+        """
+        Waits until all of the writer's blocks (and any submitted before them) have been written.
+        """
+        while any(pending_writer is writer for pending_writer, _ in self.pending):
+            self.write_oldest()
+
+    def shutdown(self):
+        while self.pending:
+            self.write_oldest()
+        self.executor.shutdown()
+
+
+class ParallelGzipWriter(object):
+    """
+    A write-only gzipped file (a filename or a binary file object, like stdout). Full blocks are
+    compressed by a GzipCompressor, which can be shared with other writers. Each block becomes its
+    own gzip member and a file of concatenated gzip members is still a valid gzip file.
+    """
+    block_size = 1024 * 1024
+    compress = staticmethod(compress_gzip_member)
+
+    def __init__(self, file, compressor):
+        self.own_file = isinstance(file, str)
+        self.file = open(file, 'wb') if self.own_file else file
+        self.compressor = compressor
+        self.block = bytearray()
+        self.block_count = 0
+
+    def write(self, text):
+        self.write_bytes(text.encode())
+
+    def write_bytes(self, data):
+        self.block += data
+        while len(self.block) >= self.block_size:
+            self.submit_block(bytes(self.block[:self.block_size]))
+            del self.block[:self.block_size]
+
+    def flush(self):
+        """
+        Hands whatever has been written so far over for compression, without waiting for it. Even
+        an empty file gets one (empty) gzip member, so it can be decompressed.
+        """
+        if self.block or self.block_count == 0:
+            self.submit_block(bytes(self.block))
+            self.block = bytearray()
+
+    def submit_block(self, data):
+        self.block_count += 1
+        self.compressor.submit(self, data)
+
+    def write_compressed(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.flush()
+        self.compressor.finish(self)
+        self.close_file()
+
+    def close_file(self):
+        if self.own_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class BgzfWriter(ParallelGzipWriter):
+    """
+    A ParallelGzipWriter which makes BGZF (blocked gzip, as used by BAM files and bgzip) which is
+    still readable by any gzip tool. Each read's position is saved to an index file as it's written:
+    one line per read with its name, the offset of its BGZF block in the file and its offset in the
+    block's uncompressed data. A reader can seek to the block and start decompressing from there.
+    Without an index filename, no index is made.
+    """
+    block_size = 0xff00  # the block size bgzip uses, which keeps compressed blocks under 64 kB
+    compress = staticmethod(compress_bgzf_block)
+
+    def __init__(self, file, compressor, index_filename=None):
+        super().__init__(file, compressor)
+        self.index_file = open(index_filename, 'wt') if index_filename else None
+        self.written_size = 0       # bytes of uncompressed text written
+        self.compressed_size = 0    # bytes of the BGZF file written
+        self.block_ends = collections.deque()    # uncompressed end of each submitted block
+        self.block_start = 0
+        self.unindexed_reads = collections.deque()  # (name, uncompressed position) pairs
+
+    def index_read(self, read_name):
+        """
+        Records that the next text written starts with the named read.
+        """
+        self.unindexed_reads.append((read_name, self.written_size + len(self.block)))
+
+    def submit_block(self, data):
+        self.written_size += len(data)
+        self.block_ends.append(self.written_size)
+        super().submit_block(data)
+
+    def write_compressed(self, data):
+        # The reads which start in this block can be indexed now that its offset is known.
+        block_end = self.block_ends.popleft()
+        while self.unindexed_reads and self.unindexed_reads[0][1] < block_end:
+            read_name, position = self.unindexed_reads.popleft()
+            self.index_file.write(read_name + '\t' + str(self.compressed_size) + '\t' +
+                                  str(position - self.block_start) + '\n')
+        self.block_start = block_end
+        self.compressed_size += len(data)
+        self.file.write(data)
+
+    def close(self):
+        self.flush()
+        self.compressor.finish(self)
+        self.file.write(BGZF_EOF)
+        self.close_file()
+        if self.index_file is not None:
+            self.index_file.close()
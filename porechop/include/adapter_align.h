@@ -2,20 +2,62 @@
 #define ADAPTER_ALIGN_H
 
 #include <seqan/sequence.h>
+#include <seqan/score.h>
 #include <string>
 #include <vector>
 #include "alignment.h"
+#include "adapter_registry.h"
+#include "simd_align.h"
+#include "myers_align.h"
+#include "qgram_screen.h"
 
 using namespace seqan;
 
-// Functions that are called by the Python script must have C linkage, not C++ linkage.
+// The alignment engines which can be chosen with setAlignmentEngine.
+const int STANDARD_ENGINE = 0;  // SeqAn's global alignment, one adapter at a time.
+const int SIMD_ENGINE = 1;      // Many adapters at once in SIMD vector lanes (see simd_align.h).
+const int MYERS_ENGINE = 2;     // Bit-parallel search to narrow down whole read alignments.
+
+// One middle adapter hit found by findMiddleAdapters. adapterIndex is the adapter's position in
+// the list given to findMiddleAdapters and readEnd is one past the hit's last read position. Like
+// AlignmentResult, its layout must match the Python version.
+struct MiddleAdapterHit {
+    int adapterIndex;
+    int readStart;
+    int readEnd;
+    double fullAdapterPercentIdentity;
+};
+
+// Functions that are called by the Python script must have C linkage, not C++ linkage. Read
+// sequences are given as a pointer and a length, not as null-terminated strings, so the Python
+// script can pass any part of a read's buffer without copying it.
 extern "C" {
-    char * adapterAlignment(char * readSeq, char * adapterSeq,
-                            int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore);
-    void freeCString(char * p);
+    int setAlignmentEngine(int engine);
+    void adapterAlignment(char * readSeq, int readLength, int adapterId, int scoringSchemeId,
+                          AlignmentThreshold * threshold, AlignmentResult * result);
+    void adapterAlignmentBatch(char * readSeq, int readLength, int * adapterIds, int adapterCount,
+                               int scoringSchemeId, AlignmentThreshold * thresholds,
+                               AlignmentResult * results);
+    int findMiddleAdapters(char * readSeq, int readLength, int * adapterIds, int adapterCount,
+                           int scoringSchemeId, double middleThreshold,
+                           MiddleAdapterHit * hits, int maxHits);
 }
 
-char * cppStringToCString(std::string cpp_string);
+Dna5String bufferSequence(char * buffer, int length);
+
+std::vector<Dna5String *> getAdapters(int * adapterIds, int adapterCount);
+
+void alignToAdapters(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                     Score<int, Simple> & scoringScheme, AlignmentThreshold * thresholds,
+                     AlignmentResult * results);
+
+int searchMiddleAdapters(Dna5String & maskedSeq, std::vector<Dna5String *> & adapterSeqs,
+                         Score<int, Simple> & scoringScheme, double middleThreshold,
+                         MiddleAdapterHit * hits, int maxHits);
+
+void alignReadToAdapter(Dna5String & readSeq, Dna5String & adapterSeq,
+                        Score<int, Simple> & scoringScheme, AlignmentThreshold * threshold,
+                        AlignmentResult * result);
 
 
 #endif // ADAPTER_ALIGN_H
@@ -0,0 +1,22 @@
+#ifndef ADAPTER_REGISTRY_H
+#define ADAPTER_REGISTRY_H
+
+#include <seqan/sequence.h>
+#include <seqan/score.h>
+
+using namespace seqan;
+
+// Adapter sequences and scoring schemes don't change during a Porechop run, so the Python script
+// registers each of them once and then refers to them by the returned integer ID. This saves
+// sending and converting the same adapter sequences for every alignment.
+extern "C" {
+    int addAdapter(char * adapterSeq);
+    int addScoringScheme(int matchScore, int mismatchScore, int gapOpenScore,
+                         int gapExtensionScore);
+}
+
+Dna5String & getAdapter(int adapterId);
+Score<int, Simple> & getScoringScheme(int scoringSchemeId);
+
+
+#endif // ADAPTER_REGISTRY_H
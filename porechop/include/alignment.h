@@ -3,18 +3,62 @@
 #define ALIGNMENT_H
 
 
-#include <string>
 #include <seqan/basic.h>
 #include <seqan/align.h>
 
 using namespace seqan;
 
 
+// The alignment functions fill in this struct instead of returning a formatted string. The Python
+// script reads it directly via ctypes (see AlignmentResult in cpp_function_wrappers.py), so its
+// layout must match the one defined there.
+struct AlignmentResult {
+    int readStartPos;
+    int readEndPos;
+    int adapterStartPos;
+    int adapterEndPos;
+    int rawScore;
+    double alignedRegionPercentIdentity;
+    double fullAdapterPercentIdentity;
+};
+
+
+// The identities a caller is interested in. An alignment is only worth a traceback if it could
+// have a full adapter identity of at least fullAdapterPercentIdentity or an aligned region identity
+// of more than alignedRegionPercentIdentity (over at least minAlignedRegionLength bases). Like
+// AlignmentResult, its layout must match the Python version.
+struct AlignmentThreshold {
+    double fullAdapterPercentIdentity;
+    double alignedRegionPercentIdentity;
+    int minAlignedRegionLength;
+};
+
+bool couldPassThreshold(int score, int adapterLength, Score<int, Simple> & scoringScheme,
+                        AlignmentThreshold * threshold);
+void fillScoreOnlyResult(int score, AlignmentResult * result);
+
+
+// Where the read and adapter bases lie in an alignment's columns, which is all ScoredAlignment
+// needs to know about the alignment. Columns are numbered from zero and the first/last columns are
+// -1 if the row has no bases. matchCount is the number of columns where the read and adapter bases
+// are the same.
+struct AlignmentColumns {
+    int readFirst;
+    int readLast;
+    int adapterFirst;
+    int adapterLast;
+    bool readLastHasAdapterBase;
+    bool adapterLastHasReadBase;
+    int matchCount;
+};
+
+
 class ScoredAlignment {
 public:
     ScoredAlignment(Align<Dna5String, ArrayGaps> & alignment,
                     int readLength, int adapterLength, int score);
-    std::string getString();
+    ScoredAlignment(AlignmentColumns & columns, int readLength, int adapterLength, int score);
+    void fillResult(AlignmentResult * result);
 
     int m_readLength;
     int m_adapterLength;
@@ -25,6 +69,9 @@ public:
     int m_rawScore;
     double m_alignedRegionPercentIdentity;
     double m_fullAdapterPercentIdentity;
+
+private:
+    void scoreColumns(AlignmentColumns & columns);
 };
 
 #endif // ALIGNMENT_H
@@ -0,0 +1,31 @@
+#ifndef ANCHORED_ALIGN_H
+#define ANCHORED_ALIGN_H
+
+#include <seqan/sequence.h>
+#include <seqan/score.h>
+#include <vector>
+#include "alignment.h"
+#include "adapter_align.h"
+
+using namespace seqan;
+
+// Anchored alignments are for read end searches, where the adapters of interest sit at the read's
+// terminus (its first base for the start, its last base for the end). Instead of always aligning
+// to the whole read end sequence, only the part next to the terminus which an alignment starting
+// within band bases of the terminus could possibly use is aligned. This makes the cost depend on
+// the band and adapter lengths instead of the read end sequence length. Whenever the whole-sequence
+// alignment would start within the band, the anchored alignment gives exactly the same result.
+
+extern "C" {
+    void anchoredAdapterAlignmentBatch(char * readSeq, int readLength, int * adapterIds,
+                                       int adapterCount, int scoringSchemeId,
+                                       AlignmentThreshold * thresholds, int atReadEnd, int band,
+                                       AlignmentResult * results);
+}
+
+void alignToReadEnd(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                    Score<int, Simple> & scoringScheme, AlignmentThreshold * thresholds,
+                    bool atReadEnd, int band, AlignmentResult * results);
+
+
+#endif // ANCHORED_ALIGN_H
@@ -0,0 +1,18 @@
+#ifndef FASTQ_RECORDS_H
+#define FASTQ_RECORDS_H
+
+// Finds where the FASTQ records are in a buffer of file contents, so the Python script only has to
+// slice them out instead of scanning the text itself. Each record is four lines (header, sequence,
+// spacer and qualities), each ending in a newline. For every complete record at the start of the
+// buffer, the start and end (like a slice) of each of its lines are stored in lineBounds, eight
+// ints per record, without any leading or trailing whitespace (like str.strip on ASCII text). The
+// return value is the number of records found (at most maxRecords) and consumed is set to the
+// number of bytes they take up, so whatever follows can be carried over to the next buffer.
+
+extern "C" {
+    int findFastqRecords(char * buffer, int length, int * lineBounds, int maxRecords,
+                         int * consumed);
+}
+
+
+#endif // FASTQ_RECORDS_H
@@ -0,0 +1,16 @@
+#ifndef MYERS_ALIGN_H
+#define MYERS_ALIGN_H
+
+#include <seqan/sequence.h>
+
+using namespace seqan;
+
+// Uses Myers' bit-parallel edit distance search to find where in the read the adapter matches
+// best, and returns the read region around that location (from windowStart up to but not including
+// windowEnd) which is worth aligning the adapter to. Returns false if the region wouldn't be much
+// smaller than the read itself, in which case the whole read should be aligned.
+bool myersAlignmentWindow(Dna5String & readSeq, Dna5String & adapterSeq,
+                          int & windowStart, int & windowEnd);
+
+
+#endif // MYERS_ALIGN_H
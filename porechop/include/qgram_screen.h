@@ -0,0 +1,24 @@
+#ifndef QGRAM_SCREEN_H
+#define QGRAM_SCREEN_H
+
+#include <seqan/sequence.h>
+#include <vector>
+#include "alignment.h"
+
+using namespace seqan;
+
+// A quick screen which decides, from the q-grams (length q substrings) an adapter shares with a
+// read sequence, whether the adapter could possibly align well enough to pass its threshold. It
+// never rejects an adapter which could pass, so only the others need aligning.
+//
+// An alignment with a full adapter identity of at least t spans at most n / t columns (for an
+// adapter of length n), so at most E = n(1 - t) / t of them aren't matches. Each of those columns
+// breaks at most q of the adapter's n - q + 1 q-grams, so at least n - q + 1 - qE q-grams must
+// appear unbroken in the read (the q-gram lemma). Aligned region identities can be met by just a
+// few bases at the edge of the read, so adapters with an aligned region threshold can't be
+// screened and always pass.
+std::vector<bool> screenAdapters(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                                 AlignmentThreshold * thresholds);
+
+
+#endif // QGRAM_SCREEN_H
@@ -0,0 +1,66 @@
+#ifndef READ_BATCH_H
+#define READ_BATCH_H
+
+#include <seqan/sequence.h>
+#include "adapter_align.h"
+#include "anchored_align.h"
+
+using namespace seqan;
+
+// These functions process a whole chunk of reads in one call, spreading the reads over their own
+// threads so the work isn't limited by Python's global interpreter lock. The reads are given as
+// arrays of sequence pointers and lengths, which point straight into the Python script's buffers.
+// For trimReadEndsBatch, each sequence is a whole read (the read ends are taken from it here) and
+// for findMiddleAdaptersBatch it is the read with its end adapters trimmed off. The structs'
+// layouts must match the Python versions in cpp_function_wrappers.py.
+
+// The settings for trimming adapters from read ends. barcodeSearchThreshold is used as the
+// threshold for barcode alignments (see AlignmentThreshold) and endBand is the band for anchored
+// alignments (see anchored_align.h), or zero to align to the whole read end sequences.
+struct ReadEndSettings {
+    int scoringSchemeId;
+    int endSize;
+    int extraTrimSize;
+    double endThreshold;
+    int minTrimSize;
+    double barcodeSearchThreshold;
+    int endBand;
+};
+
+// An adapter set to look for at the read ends. endAdapterId is -1 if the set has no end adapter and
+// barcodeIndex is -1 if the set's barcode identities aren't needed. Sets with the same barcode
+// share the same barcodeIndex.
+struct ReadEndAdapter {
+    int startAdapterId;
+    int endAdapterId;
+    int barcodeIndex;
+};
+
+// The read end results for one read. The best and second-best barcodes (as barcode indices, or -1
+// if there aren't that many) are given for each end. Barcodes with equal scores are ranked by their
+// index.
+struct ReadEndResult {
+    int startTrimAmount;
+    int endTrimAmount;
+    int bestStartBarcode;
+    double bestStartBarcodeScore;
+    int secondBestStartBarcode;
+    double secondBestStartBarcodeScore;
+    int bestEndBarcode;
+    double bestEndBarcodeScore;
+    int secondBestEndBarcode;
+    double secondBestEndBarcodeScore;
+};
+
+extern "C" {
+    void trimReadEndsBatch(char ** sequences, int * lengths, int readCount,
+                           ReadEndAdapter * adapters, int adapterCount, int barcodeCount,
+                           ReadEndSettings * settings, int threadCount, ReadEndResult * results);
+    void findMiddleAdaptersBatch(char ** sequences, int * lengths, int readCount,
+                                 int * adapterIds, int adapterCount, int scoringSchemeId,
+                                 double middleThreshold, int threadCount,
+                                 MiddleAdapterHit * hits, int maxHitsPerRead, int * hitCounts);
+}
+
+
+#endif // READ_BATCH_H
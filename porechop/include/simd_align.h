@@ -0,0 +1,51 @@
+#ifndef SIMD_ALIGN_H
+#define SIMD_ALIGN_H
+
+#include <seqan/sequence.h>
+#include <seqan/score.h>
+#include <cstdint>
+#include <vector>
+#include "alignment.h"
+
+using namespace seqan;
+
+// Bits stored in the SIMD aligner's trace matrix for each cell. The first three say which
+// directions give the cell's best score, the last two whether the gap scores at the cell came from
+// opening a new gap (as opposed to extending one).
+const int16_t SIMD_TRACE_DIAGONAL = 1;
+const int16_t SIMD_TRACE_VERTICAL = 2;
+const int16_t SIMD_TRACE_HORIZONTAL = 4;
+const int16_t SIMD_TRACE_VERTICAL_OPEN = 8;
+const int16_t SIMD_TRACE_HORIZONTAL_OPEN = 16;
+
+// Low enough that nothing can start from it, but high enough that adding gap penalties to it
+// cannot overflow 16 bits.
+const int16_t SIMD_NEGATIVE_INFINITY = -16384;
+
+struct SimdScores {
+    int16_t match;
+    int16_t mismatch;
+    int16_t gapOpen;
+    int16_t gapExtension;
+};
+
+struct SimdEnd {
+    int score;
+    int row;
+    int column;
+};
+
+// Returns the number of alignments the SIMD aligner does at once on this CPU (8 with SSE4.1, 16
+// with AVX2), or 0 if it can't be used.
+int simdLaneCount();
+
+// Aligns one read sequence to each of the adapters using the SIMD aligner, filling in one result
+// per adapter. If thresholds (one per adapter) are given, adapters which can't pass theirs are only
+// scored. Returns false (without filling in results) if the SIMD aligner can't be used for these
+// sequences, in which case the caller should use the normal aligner.
+bool simdAdapterAlignment(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                          Score<int, Simple> & scoringScheme, AlignmentThreshold * thresholds,
+                          AlignmentResult * results);
+
+
+#endif // SIMD_ALIGN_H
@@ -0,0 +1,128 @@
+// This file holds the vectorised DP kernel used by simd_align.cpp. It deliberately has no include
+// guard: simd_align.cpp includes it once per instruction set, each time inside its own namespace
+// and with the compiler's target set for that instruction set. SIMD_VECTOR_BYTES must be defined
+// before it is included.
+//
+// Each vector lane holds a separate alignment (one read sequence against one adapter sequence).
+// The recurrence is the same as SeqAn's global alignment with free end gaps and affine gap costs:
+//   E(i,j) = max(E(i,j-1) + extend, H(i,j-1) + open)     horizontal gap (gap in the adapter)
+//   F(i,j) = max(F(i-1,j) + extend, H(i-1,j) + open)     vertical gap (gap in the read)
+//   H(i,j) = max(H(i-1,j-1) + s(i,j), E(i,j), F(i,j))
+// with H = 0 along the top row and left column. Rows (i) are adapter positions and columns (j) are
+// read positions.
+
+typedef int16_t Vec __attribute__((vector_size(SIMD_VECTOR_BYTES)));
+const int LANES = SIMD_VECTOR_BYTES / sizeof(int16_t);
+
+static inline Vec loadVec(const int16_t * p) {
+    Vec v;
+    memcpy(&v, p, sizeof(Vec));
+    return v;
+}
+
+static inline void storeVec(int16_t * p, Vec v) {
+    memcpy(p, &v, sizeof(Vec));
+}
+
+static inline Vec splat(int16_t x) {
+    Vec v;
+    for (int k = 0; k < LANES; ++k)
+        v[k] = x;
+    return v;
+}
+
+static inline Vec vecMax(Vec a, Vec b) {
+    return a > b ? a : b;
+}
+
+// Aligns up to LANES read/adapter pairs at once. The sequences are given as base codes interleaved
+// by lane: readCodes[j * LANES + k] is the j-th read base for lane k (likewise for the adapters).
+// Cells beyond a lane's own sequence lengths are computed but never used. Each lane's best end
+// cell (in the last row or last column, as the trailing gaps are free) is returned in ends. If
+// trace isn't null, it must have room for (maxAdapterLength + 1) * (maxReadLength + 1) * LANES
+// values and trace bits are stored for every cell. hRows and fColumn are working space of
+// 2 * (maxReadLength + 1) * LANES and (maxReadLength + 1) * LANES values.
+static void alignLanes(const int16_t * readCodes, const int16_t * adapterCodes,
+                       const int * readLengths, const int * adapterLengths,
+                       int maxReadLength, int maxAdapterLength, const SimdScores & scores,
+                       int16_t * hRows, int16_t * fColumn, int16_t * trace, SimdEnd * ends) {
+    const int rowSize = (maxReadLength + 1) * LANES;
+    const Vec zero = splat(0);
+    const Vec negInf = splat(SIMD_NEGATIVE_INFINITY);
+    const Vec match = splat(scores.match), mismatch = splat(scores.mismatch);
+    const Vec open = splat(scores.gapOpen), extend = splat(scores.gapExtension);
+    const Vec diagBit = splat(SIMD_TRACE_DIAGONAL);
+    const Vec verticalBit = splat(SIMD_TRACE_VERTICAL);
+    const Vec horizontalBit = splat(SIMD_TRACE_HORIZONTAL);
+    const Vec verticalOpenBit = splat(SIMD_TRACE_VERTICAL_OPEN);
+    const Vec horizontalOpenBit = splat(SIMD_TRACE_HORIZONTAL_OPEN);
+
+    // Row 0 is all zero (free leading gaps in the adapter) and no vertical gap can start above it.
+    for (int j = 0; j <= maxReadLength; ++j) {
+        storeVec(hRows + j * LANES, zero);
+        storeVec(fColumn + j * LANES, negInf);
+    }
+
+    // Cells in the last column are candidates for the alignment end, starting with row 0.
+    for (int k = 0; k < LANES; ++k)
+        ends[k] = SimdEnd{0, 0, readLengths[k]};
+
+    for (int i = 1; i <= maxAdapterLength; ++i) {
+        const int16_t * hPrev = hRows + ((i - 1) % 2) * rowSize;
+        int16_t * hCur = hRows + (i % 2) * rowSize;
+        int16_t * traceRow = trace ? trace + i * rowSize : nullptr;
+        const Vec adapterBase = loadVec(adapterCodes + (i - 1) * LANES);
+
+        Vec hLeft = zero;  // Left column is all zero (free leading gaps in the read).
+        Vec hDiag = loadVec(hPrev);
+        Vec e = negInf;
+        storeVec(hCur, zero);
+        for (int j = 1; j <= maxReadLength; ++j) {
+            const Vec readBase = loadVec(readCodes + (j - 1) * LANES);
+            const Vec hUp = loadVec(hPrev + j * LANES);
+
+            Vec diag = hDiag + (adapterBase == readBase ? match : mismatch);
+
+            Vec fOpen = hUp + open;
+            Vec fExtend = loadVec(fColumn + j * LANES) + extend;
+            Vec f = vecMax(fOpen, fExtend);
+
+            Vec eOpen = hLeft + open;
+            Vec eExtend = e + extend;
+            e = vecMax(eOpen, eExtend);
+
+            Vec h = vecMax(diag, vecMax(f, e));
+
+            if (traceRow) {
+                Vec bits = ((diag == h) & diagBit) | ((f == h) & verticalBit) |
+                           ((e == h) & horizontalBit) | ((fOpen > fExtend) & verticalOpenBit) |
+                           ((eOpen > eExtend) & horizontalOpenBit);
+                storeVec(traceRow + j * LANES, bits);
+            }
+            storeVec(fColumn + j * LANES, f);
+            storeVec(hCur + j * LANES, h);
+            hDiag = hUp;
+            hLeft = h;
+        }
+
+        // Check each lane's end candidates in the same order SeqAn does, keeping the first of
+        // equal scores: the last row from left to right, then the last column from top to bottom.
+        for (int k = 0; k < LANES; ++k) {
+            int readLength = readLengths[k], adapterLength = adapterLengths[k];
+            if (i > adapterLength)
+                continue;
+            int lastColumnScore = hCur[readLength * LANES + k];
+            if (lastColumnScore > ends[k].score)
+                ends[k] = SimdEnd{lastColumnScore, i, readLength};
+            if (i == adapterLength) {
+                SimdEnd rowEnd{hCur[k], i, 0};
+                for (int j = 1; j < readLength; ++j) {
+                    if (hCur[j * LANES + k] > rowEnd.score)
+                        rowEnd = SimdEnd{hCur[j * LANES + k], i, j};
+                }
+                if (rowEnd.score >= ends[k].score)
+                    ends[k] = rowEnd;
+            }
+        }
+    }
+}
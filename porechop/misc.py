@@ -16,10 +16,21 @@ not, see <http://www.gnu.org/licenses/>.
 import sys
 import os
 import gzip
+import io
 import re
 import textwrap
 import shutil
 import argparse
+import mmap
+import itertools
+from functools import lru_cache
+from ctypes import c_int
+from .cpp_function_wrappers import find_fastq_records
+from .gzip_reader import open_gzipped_file, ThreadedGzipReader
+from .bam import BAM_MAGIC, iterate_bam, iterate_bam_records, load_bam_header, read_bam_header
+
+# The FASTQ parser reads files in chunks of this many bytes.
+FASTQ_CHUNK_SIZE = 256 * 1024
 
 
 def float_to_str(num, decimals, max_num=0):
@@ -83,7 +94,7 @@ def get_compression_type(filename):
 
 def get_sequence_file_type(filename):
     """
-    Determines whether a file is FASTA or FASTQ.
+    Determines whether a file is FASTA, FASTQ or BAM.
     """
     if not os.path.isfile(filename):
         sys.exit('Error: could not find ' + filename)
@@ -92,44 +103,227 @@ def get_sequence_file_type(filename):
     else:  # plain text
         open_func = open
 
-    with open_func(filename, 'rt') as seq_file:
-        try:
-            first_char = seq_file.read(1)
-        except UnicodeDecodeError:
-            first_char = ''
+    with open_func(filename, 'rb') as seq_file:
+        file_start = seq_file.read(4)
 
-    if first_char == '>':
+    if file_start.startswith(b'>'):
         return 'FASTA'
-    elif first_char == '@':
+    elif file_start.startswith(b'@'):
         return 'FASTQ'
+    elif file_start == BAM_MAGIC:
+        return 'BAM'
     else:
-        raise ValueError('File is neither FASTA or FASTQ')
+        raise ValueError('File is neither FASTA, FASTQ or BAM')
 
 
-def load_fasta_or_fastq(filename):
+def load_fasta_or_fastq(filename, shard=None):
     """
-    Returns a list of tuples (header, seq) for each record in the fasta/fastq file.
+    Returns a list of tuples (header, seq) for each record in the fasta/fastq/bam file (or in its
+    shard, see iterate_fasta_or_fastq).
     """
+    if shard is not None:
+        records, file_type = iterate_fasta_or_fastq(filename, shard)
+        return list(records), file_type
     try:
         file_type = get_sequence_file_type(filename)
         if file_type == 'FASTA':
             return load_fasta(filename), 'FASTA'
+        elif file_type == 'BAM':
+            return list(iterate_bam(filename)), 'BAM'
         else:  # FASTQ
             return load_fastq(filename), 'FASTQ'
     except IndexError:
         sys.exit('\nError: ' + filename + ' could not be parsed - is it formatted correctly?')
+    except (OSError, EOFError):
+        sys.exit('\nError: ' + filename + ' could not be decompressed - is it a valid gzip file?')
+
+
+def iterate_fasta_or_fastq(filename, shard=None):
+    """
+    Like load_fasta_or_fastq, but the records are read from the file as they are iterated over, so
+    the whole file never needs to be in memory.
+
+    With a shard (k, n), only the k-th of n parts of the file is read. For plain text files, that's
+    the records which start in the k-th of n equal byte ranges, so each shard only reads its own
+    part of the file. Compressed files can't be started partway through, so every shard reads the
+    whole file and keeps every n-th record.
+    """
+    file_type = get_sequence_file_type(filename)
+    if shard is not None and file_type != 'BAM' and get_compression_type(filename) == 'plain':
+        start, end = shard_byte_range(filename, file_type, shard)
+        if file_type == 'FASTA':
+            fasta_file = io.TextIOWrapper(io.BufferedReader(FileRange(filename, start, end)))
+            records = iterate_fasta_lines(fasta_file)
+        else:  # FASTQ
+            records = iterate_fastq_chunks(FileRange(filename, start, end))
+        return exit_on_parse_error(records, filename), file_type
+
+    if file_type == 'FASTA':
+        records = iterate_fasta(filename)
+    elif file_type == 'BAM':
+        records = iterate_bam(filename)
+    else:  # FASTQ
+        records = iterate_fastq(filename)
+    if shard is not None:
+        records = itertools.islice(records, shard[0] - 1, None, shard[1])
+    return exit_on_parse_error(records, filename), file_type
+
+
+def shard_byte_range(filename, file_type, shard):
+    """
+    Returns the byte range of the k-th of n shards of a plain text FASTA/FASTQ file. The file is cut
+    into n equal ranges and each cut is moved forward to the start of the next record.
+    """
+    file_size = os.path.getsize(filename)
+    if file_size == 0:
+        return 0, 0
+    shard_num, shard_count = shard
+    start = file_size * (shard_num - 1) // shard_count
+    end = file_size * shard_num // shard_count
+    if file_type == 'FASTA':
+        find_record_start = fasta_record_start
+    else:  # FASTQ
+        find_record_start = fastq_record_start
+    with open(filename, 'rb') as seq_file:
+        with mmap.mmap(seq_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return find_record_start(mapped, start), find_record_start(mapped, end)
+
+
+def fasta_record_start(mapped, position):
+    """
+    Returns the position of the first FASTA record which starts at or after the given position.
+    """
+    if position == 0:
+        return 0
+    header_start = mapped.find(b'\n>', position - 1)
+    return len(mapped) if header_start == -1 else header_start + 1
+
+
+def fastq_record_start(mapped, position):
+    """
+    Returns the position of the first FASTQ record which starts at or after the given position.
+    Quality lines can start with '@' too, so a record's start is a line starting with '@' which is
+    followed two lines later by one starting with '+'. After a quality line, two lines later is a
+    sequence line.
+    """
+    if position == 0:
+        return 0
+    line_start = mapped.find(b'\n', position - 1) + 1
+    while 0 < line_start < len(mapped):
+        next_line_start = mapped.find(b'\n', line_start) + 1
+        third_line_start = mapped.find(b'\n', next_line_start) + 1 if next_line_start else 0
+        if mapped[line_start:line_start + 1] == b'@' and third_line_start and \
+                mapped[third_line_start:third_line_start + 1] == b'+':
+            return line_start
+        line_start = next_line_start
+    return len(mapped)
+
+
+class FileRange(io.RawIOBase):
+    """
+    A binary file object of one byte range of a file.
+    """
+    def __init__(self, filename, start, end):
+        self.file = open(filename, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        with memoryview(buffer) as view:
+            size = self.file.readinto(view[:self.remaining])
+        self.remaining -= size
+        return size
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+@lru_cache(maxsize=None)
+def iterate_stdin():
+    """
+    Like iterate_fasta_or_fastq, but for reads piped in (-i -). The format and compression are
+    worked out from the first bytes. Stdin can only be read once, so every call returns the same
+    iterator, carrying on from wherever the last caller got to.
+    """
+    stdin, file_type, _ = open_stdin()
+    if file_type == 'FASTA':
+        records = iterate_fasta_lines(io.TextIOWrapper(stdin))
+    elif file_type == 'BAM':
+        records = iterate_bam_records(stdin)
+    else:  # FASTQ
+        records = iterate_fastq_chunks(stdin)
+    return exit_on_parse_error(records, 'stdin'), file_type
+
+
+@lru_cache(maxsize=None)
+def open_stdin():
+    """
+    Returns stdin (decompressing it, if it's gzipped), the format of its reads and, for BAM, its
+    header text. BAM's header is read here, so stdin is left at the first read.
+    """
+    stdin = sys.stdin.buffer
+    if stdin.peek(3)[:3] == b'\x1f\x8b\x08':
+        stdin = io.BufferedReader(ThreadedGzipReader(stdin))
+    file_start = stdin.peek(4)[:4]
+    if file_start.startswith(b'>'):
+        return stdin, 'FASTA', ''
+    elif file_start.startswith(b'@'):
+        return stdin, 'FASTQ', ''
+    elif file_start == BAM_MAGIC:
+        try:
+            return stdin, 'BAM', read_bam_header(stdin)
+        except IndexError:
+            sys.exit('\nError: stdin could not be parsed - is it formatted correctly?')
+    else:
+        sys.exit('Error: the reads on stdin are neither FASTA, FASTQ or BAM')
+
+
+def get_bam_header(input_file_or_directory):
+    """
+    Returns the SAM header text of the input, if it's BAM, so it can be carried over to BAM output.
+    """
+    if input_file_or_directory == '-':
+        return open_stdin()[2]
+    if os.path.isfile(input_file_or_directory) and \
+            get_sequence_file_type(input_file_or_directory) == 'BAM':
+        try:
+            return load_bam_header(input_file_or_directory)
+        except IndexError:
+            sys.exit('\nError: ' + input_file_or_directory +
+                     ' could not be parsed - is it formatted correctly?')
+    return ''
+
+
+def exit_on_parse_error(records, filename):
+    try:
+        yield from records
+    except IndexError:
+        sys.exit('\nError: ' + filename + ' could not be parsed - is it formatted correctly?')
+    except (OSError, EOFError):
+        sys.exit('\nError: ' + filename + ' could not be decompressed - is it a valid gzip file?')
 
 
 def load_fasta(fasta_filename):
     """
     Returns a list of tuples (header, seq) for each record in the fasta file.
     """
+    return list(iterate_fasta(fasta_filename))
+
+
+def iterate_fasta(fasta_filename):
     if get_compression_type(fasta_filename) == 'gz':
-        open_func = gzip.open
+        fasta_file = io.TextIOWrapper(open_gzipped_file(fasta_filename))
     else:  # plain text
-        open_func = open
-    fasta_seqs = []
-    with open_func(fasta_filename, 'rt') as fasta_file:
+        fasta_file = open(fasta_filename, 'rt')
+    return iterate_fasta_lines(fasta_file)
+
+
+def iterate_fasta_lines(fasta_file):
+    with fasta_file:
         name = ''
         sequence = ''
         for line in fasta_file:
@@ -138,34 +332,97 @@ def load_fasta(fasta_filename):
                 continue
             if line[0] == '>':  # Header line = start of new contig
                 if name:
-                    fasta_seqs.append((name.split()[0], sequence, name))
+                    yield name.split()[0], sequence, name
                     sequence = ''
                 name = line[1:]
             else:
                 sequence += line
         if name:
-            fasta_seqs.append((name.split()[0], sequence, name))
-    return fasta_seqs
+            yield name.split()[0], sequence, name
 
 
 def load_fastq(fastq_filename):
     """
     Returns a list of tuples (header, seq) for each record in the fastq file.
     """
+    return list(iterate_fastq(fastq_filename))
+
+
+def iterate_fastq(fastq_filename):
+    """
+    C++ code finds where the records' lines are, so this function only slices them out, which is
+    much faster than going through the file a line at a time. The file is read in chunks.
+    """
     if get_compression_type(fastq_filename) == 'gz':
-        open_func = gzip.open
+        return iterate_fastq_chunks(open_gzipped_file(fastq_filename))
     else:  # plain text
-        open_func = open
-    reads = []
-    with open_func(fastq_filename, 'rt') as fastq:
-        for line in fastq:
-            full_name = line.strip()[1:]
-            short_name = full_name.split()[0]
-            sequence = next(fastq).strip()
-            spacer = next(fastq).strip()
-            qualities = next(fastq).strip()
-            reads.append((short_name, sequence, spacer, qualities, full_name))
-    return reads
+        return iterate_fastq_chunks(open(fastq_filename, 'rb', buffering=0))
+
+
+def iterate_fastq_chunks(fastq):
+    """
+    Reads a binary file object in big chunks. Whatever follows a chunk's last complete record is
+    carried over to the next chunk.
+    """
+    with fastq:
+        buffer = bytearray(FASTQ_CHUNK_SIZE)
+        line_bounds = fastq_line_bounds_array(len(buffer))
+        carried = 0
+        at_end = False
+        while not at_end:
+            if carried == len(buffer):  # a record longer than the buffer
+                buffer.extend(bytes(len(buffer)))
+                line_bounds = fastq_line_bounds_array(len(buffer))
+            with memoryview(buffer) as view:
+                size = fastq.readinto(view[carried:])
+            chunk_end = carried + size
+            if not size:
+                if not carried:
+                    break
+                at_end = True  # the last line may not have had a newline
+                buffer[chunk_end:] = b'\n'
+                chunk_end += 1
+            records, consumed = fastq_records(buffer, chunk_end, line_bounds)
+            yield from records
+            carried = chunk_end - consumed
+            buffer[:carried] = buffer[consumed:chunk_end]
+
+        if carried:
+            raise IndexError('incomplete FASTQ record')
+
+
+def fastq_records(buffer, length, line_bounds):
+    """
+    Returns the complete FASTQ records in the first length bytes of a buffer and the number of
+    bytes they use.
+    """
+    bounds, consumed = find_fastq_records(buffer, length, line_bounds)
+    with memoryview(buffer) as view:
+        text = str(view[:consumed], 'utf-8')
+    records = []
+    if len(text) == consumed:  # all ASCII, so the byte positions are also character positions
+        for i in range(0, len(bounds), 8):
+            full_name = text[bounds[i] + 1:bounds[i + 1]]
+            records.append((full_name.split(None, 1)[0], text[bounds[i + 2]:bounds[i + 3]],
+                            text[bounds[i + 4]:bounds[i + 5]], text[bounds[i + 6]:bounds[i + 7]],
+                            full_name))
+        return records, consumed
+
+    # The bounds are byte positions, so the lines are decoded one at a time.
+    for i in range(0, len(bounds), 8):
+        header, sequence, spacer, qualities = \
+            (buffer[bounds[j]:bounds[j + 1]].decode().strip() for j in range(i, i + 8, 2))
+        full_name = header[1:]
+        records.append((full_name.split(None, 1)[0], sequence, spacer, qualities, full_name))
+    return records, consumed
+
+
+def fastq_line_bounds_array(buffer_size):
+    """
+    Makes an array big enough to hold the line bounds of every record which could fit in a buffer
+    (a record is at least four bytes: four newlines).
+    """
+    return (c_int * (8 * (buffer_size // 4 + 1)))()
 
 
 def print_table(table, print_dest, alignments='', max_col_width=30, col_separation=3, indent=2,
@@ -14,8 +14,10 @@ details. You should have received a copy of the GNU General Public License along
 not, see <http://www.gnu.org/licenses/>.
 """
 
-from .cpp_function_wrappers import adapter_alignment
+from .cpp_function_wrappers import adapter_alignment, adapter_alignment_batch, \
+    anchored_adapter_alignment_batch
 from .misc import yellow, red, add_line_breaks_to_sequence, END_FORMATTING, RED, YELLOW
+from .bam import bam_record, remove_tags, PER_BASE_TAGS
 
 
 class NanoporeRead(object):
@@ -25,6 +27,7 @@ class NanoporeRead(object):
 
         self.seq = seq
         self.quals = quals
+        self.has_quals = len(quals) > 0
         if len(quals) < len(seq):
             self.quals += '+' * (len(seq) - len(quals))
 
@@ -48,6 +51,8 @@ class NanoporeRead(object):
 
         self.albacore_barcode_call = None
 
+        self.bam_tags = b''  # the read's tags (in binary form) when it came from a BAM file
+
     def get_seq_with_start_end_adapters_trimmed(self):
         if not self.start_trim_amount and not self.end_trim_amount:
             return self.seq
@@ -56,6 +61,13 @@ class NanoporeRead(object):
         trimmed_seq = self.seq[start_pos:end_pos]
         return trimmed_seq
 
+    def start_end_trimmed_range(self):
+        """
+        Returns the start and end (as slice positions) of the read part which
+        get_seq_with_start_end_adapters_trimmed gives, so it can be used without being copied.
+        """
+        return self.start_trim_amount, len(self.seq) - self.end_trim_amount
+
     def seq_length_with_start_end_adapters_trimmed(self):
         return len(self.get_seq_with_start_end_adapters_trimmed())
 
@@ -88,6 +100,25 @@ class NanoporeRead(object):
         split_read_parts = [x for x in split_read_parts if len(x[0]) >= min_split_read_size]
         return split_read_parts
 
+    def get_split_read_ranges(self, min_split_read_size):
+        """
+        Like get_split_read_parts, but returns the start and end (as slice positions) of each part
+        in the untrimmed read.
+        """
+        trim_start, trim_end = self.start_end_trimmed_range()
+        split_read_ranges = []
+        part_start = trim_start
+        for position in sorted(self.middle_trim_positions):
+            position += trim_start
+            if position >= trim_end:
+                break
+            if position > part_start:
+                split_read_ranges.append((part_start, position))
+            part_start = max(part_start, position + 1)
+        if trim_end > part_start:
+            split_read_ranges.append((part_start, trim_end))
+        return [x for x in split_read_ranges if x[1] - x[0] >= min_split_read_size]
+
     def get_fasta(self, min_split_read_size, discard_middle, untrimmed=False):
         if not self.middle_trim_positions:
             if untrimmed:
@@ -132,32 +163,87 @@ class NanoporeRead(object):
                                       split_read_part[1], '\n'])
             return fastq_str
 
-    def align_adapter_set(self, adapter_set, end_size, scoring_scheme_vals):
+    def get_bam_records(self, min_split_read_size, discard_middle, untrimmed=False):
+        """
+        Returns a (name, record) pair for each of the read's parts which get_fastq would give. The
+        records are binary BAM records, carrying the read's tags and a trim tag saying which part
+        of the read was kept. Tags for each base of the read are only kept if all of it was.
+        """
+        if not self.middle_trim_positions:
+            if untrimmed:
+                read_ranges = [(0, len(self.seq))]
+            else:
+                read_ranges = [self.start_end_trimmed_range()]
+            read_names = [self.name]
+        elif discard_middle:
+            return []
+        else:
+            read_ranges = self.get_split_read_ranges(min_split_read_size)
+            read_names = [add_number_to_read_name(self.name, i + 1)
+                          for i in range(len(read_ranges))]
+        tags = self.bam_tags
+        if tags and read_ranges != [(0, len(self.seq))]:
+            tags = remove_tags(tags, PER_BASE_TAGS)
+        records = []
+        for read_name, (start, end) in zip(read_names, read_ranges):
+            if start >= end:  # Don't return empty sequences
+                return []
+            read_name = read_name.split(None, 1)[0]
+            quals = self.quals[start:end] if self.has_quals else ''
+            records.append((read_name, bam_record(read_name, self.seq[start:end], quals,
+                                                  tags, start, end)))
+        return records
+
+    def align_adapter_sets(self, adapter_sets, end_size, scoring_scheme_vals, end_band=0,
+                           score_floor=0.0):
         """
-        This function aligns the adapter to the reads and updates the best score for the adapter.
+        This function aligns the adapters to the reads and updates the best scores for the adapters.
         This is not to determine where to trim the reads, but rather to figure out which adapter
-        sets are present in the data.
+        sets are present in the data. All of the start adapters are aligned to the read start in one
+        batch (likewise for the end), which lets the SIMD engine align many of them at once. Only
+        alignments which could beat an adapter set's best score so far (and score_floor, for callers
+        which don't need best scores below it) need a full traceback. If end_band is more than zero,
+        the alignments are anchored at the read's ends (see align_adapters).
         """
         read_seq_start = self.seq[:end_size]
-        score, _, _, _ = align_adapter(read_seq_start, adapter_set.start_sequence[1],
-                                       scoring_scheme_vals)
-        adapter_set.best_start_score = max(adapter_set.best_start_score, score)
-        if adapter_set.end_sequence:
-            read_seq_end = self.seq[-end_size:]
-            score, _, _, _ = align_adapter(read_seq_end, adapter_set.end_sequence[1],
-                                           scoring_scheme_vals)
-            adapter_set.best_end_score = max(adapter_set.best_end_score, score)
+        alignments = align_adapters(read_seq_start,
+                                    tuple(x.start_sequence[1] for x in adapter_sets),
+                                    scoring_scheme_vals,
+                                    tuple((max(x.best_start_score, score_floor), None, 0)
+                                          for x in adapter_sets),
+                                    end_band, at_read_end=False)
+        for adapter_set, alignment in zip(adapter_sets, alignments):
+            adapter_set.best_start_score = max(adapter_set.best_start_score, alignment[0])
+        adapter_sets = [x for x in adapter_sets if x.end_sequence]
+        read_seq_end = self.seq[-end_size:]
+        alignments = align_adapters(read_seq_end,
+                                    tuple(x.end_sequence[1] for x in adapter_sets),
+                                    scoring_scheme_vals,
+                                    tuple((max(x.best_end_score, score_floor), None, 0)
+                                          for x in adapter_sets),
+                                    end_band, at_read_end=True)
+        for adapter_set, alignment in zip(adapter_sets, alignments):
+            adapter_set.best_end_score = max(adapter_set.best_end_score, alignment[0])
 
     def find_start_trim(self, adapters, end_size, extra_trim_size, end_threshold,
-                        scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse):
+                        scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse,
+                        barcode_search_threshold=0.0, end_band=0):
         """
         Aligns one or more adapter sequences and possibly adjusts the read's start trim amount based
-        on the result.
+        on the result. Barcode identities below barcode_search_threshold are recorded as zero. If
+        end_band is more than zero, the alignments are anchored at the read's start (see
+        align_adapters).
         """
         read_seq_start = self.seq[:end_size]
-        for adapter in adapters:
-            full_score, partial_score, read_start, read_end = \
-                align_adapter(read_seq_start, adapter.start_sequence[1], scoring_scheme_vals)
+        alignments = align_adapters(read_seq_start,
+                                    tuple(x.start_sequence[1] for x in adapters),
+                                    scoring_scheme_vals,
+                                    end_thresholds(adapters, end_threshold, min_trim_size,
+                                                   check_barcodes, forward_or_reverse,
+                                                   barcode_search_threshold),
+                                    end_band, at_read_end=False)
+        for adapter, alignment in zip(adapters, alignments):
+            full_score, partial_score, read_start, read_end = alignment
             if partial_score > end_threshold and read_end != end_size and \
                     read_end - read_start >= min_trim_size:
                 trim_amount = read_end + extra_trim_size
@@ -169,17 +255,25 @@ class NanoporeRead(object):
                 self.start_barcode_scores[adapter.get_barcode_name()] = full_score
 
     def find_end_trim(self, adapters, end_size, extra_trim_size, end_threshold,
-                      scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse):
+                      scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse,
+                      barcode_search_threshold=0.0, end_band=0):
         """
         Aligns one or more adapter sequences and possibly adjusts the read's end trim amount based
-        on the result.
+        on the result. Barcode identities below barcode_search_threshold are recorded as zero. If
+        end_band is more than zero, the alignments are anchored at the read's end (see
+        align_adapters).
         """
         read_seq_end = self.seq[-end_size:]
-        for adapter in adapters:
-            if not adapter.end_sequence:
-                continue
-            full_score, partial_score, read_start, read_end = \
-                align_adapter(read_seq_end, adapter.end_sequence[1], scoring_scheme_vals)
+        adapters = [x for x in adapters if x.end_sequence]
+        alignments = align_adapters(read_seq_end,
+                                    tuple(x.end_sequence[1] for x in adapters),
+                                    scoring_scheme_vals,
+                                    end_thresholds(adapters, end_threshold, min_trim_size,
+                                                   check_barcodes, forward_or_reverse,
+                                                   barcode_search_threshold),
+                                    end_band, at_read_end=True)
+        for adapter, alignment in zip(adapters, alignments):
+            full_score, partial_score, read_start, read_end = alignment
             if partial_score > end_threshold and read_start != 0 and \
                     read_end - read_start >= min_trim_size:
                 trim_amount = (end_size - read_start) + extra_trim_size
@@ -190,40 +284,51 @@ class NanoporeRead(object):
                     adapter.barcode_direction() == forward_or_reverse:
                 self.end_barcode_scores[adapter.get_barcode_name()] = full_score
 
-    def find_middle_adapters(self, adapters, middle_threshold, extra_middle_trim_good_side,
-                             extra_middle_trim_bad_side, scoring_scheme_vals,
-                             start_sequence_names, end_sequence_names):
+    def set_read_end_results(self, result, barcode_names):
         """
-        Aligns an adapter sequence to the whole read to find places where the read should be split.
+        Takes the results of the C++ read end search (a ReadEndResult) instead of running
+        find_start_trim and find_end_trim. Only the two best barcodes at each end are kept, which is
+        all determine_barcode needs.
         """
-        masked_seq = self.get_seq_with_start_end_adapters_trimmed()
-        for adapter_name, adapter_seq in adapters:
-
-            # We keep aligning adapters as long we get strong hits, so we can find multiple
-            # occurrences in a single read.
-            while True:
-                full_score, _, read_start, read_end = align_adapter(masked_seq, adapter_seq,
-                                                                    scoring_scheme_vals)
-                if full_score >= middle_threshold:
-                    masked_seq = masked_seq[:read_start] + '-' * (read_end - read_start) + \
-                        masked_seq[read_end:]
-                    self.middle_adapter_positions.update(range(read_start, read_end))
-
-                    self.middle_hit_str += '  ' + adapter_name + ' (read coords: ' + \
-                                           str(read_start) + '-' + str(read_end) + ', ' + \
-                                           'identity: ' + '%.1f' % full_score + '%)\n'
-
-                    trim_start = read_start - extra_middle_trim_good_side
-                    if adapter_name in start_sequence_names:
-                        trim_start = read_start - extra_middle_trim_bad_side
-
-                    trim_end = read_end + extra_middle_trim_good_side
-                    if adapter_name in end_sequence_names:
-                        trim_end = read_end + extra_middle_trim_bad_side
-
-                    self.middle_trim_positions.update(range(trim_start, trim_end))
-                else:
-                    break
+        self.start_trim_amount = result.start_trim_amount
+        self.end_trim_amount = result.end_trim_amount
+        for barcode, score in ((result.best_start_barcode, result.best_start_barcode_score),
+                               (result.second_best_start_barcode,
+                                result.second_best_start_barcode_score)):
+            if barcode != -1:
+                self.start_barcode_scores[barcode_names[barcode]] = score
+        for barcode, score in ((result.best_end_barcode, result.best_end_barcode_score),
+                               (result.second_best_end_barcode,
+                                result.second_best_end_barcode_score)):
+            if barcode != -1:
+                self.end_barcode_scores[barcode_names[barcode]] = score
+
+    def add_middle_adapter_hits(self, hits, adapters, extra_middle_trim_good_side,
+                                extra_middle_trim_bad_side, start_sequence_names,
+                                end_sequence_names):
+        """
+        Takes the hits (MiddleAdapterHits) from aligning the adapters to the whole read and works
+        out the places where the read should be split.
+        """
+        for hit in hits:
+            adapter_name = adapters[hit.adapter_index][0]
+            read_start, read_end = hit.read_start, hit.read_end
+            full_score = hit.full_adapter_percent_identity
+            self.middle_adapter_positions.update(range(read_start, read_end))
+
+            self.middle_hit_str += '  ' + adapter_name + ' (read coords: ' + \
+                                   str(read_start) + '-' + str(read_end) + ', ' + \
+                                   'identity: ' + '%.1f' % full_score + '%)\n'
+
+            trim_start = read_start - extra_middle_trim_good_side
+            if adapter_name in start_sequence_names:
+                trim_start = read_start - extra_middle_trim_bad_side
+
+            trim_end = read_end + extra_middle_trim_good_side
+            if adapter_name in end_sequence_names:
+                trim_end = read_end + extra_middle_trim_bad_side
+
+            self.middle_trim_positions.update(range(trim_start, trim_end))
 
     def formatted_start_seq(self, end_size, extra_trim_size):
         """
@@ -303,8 +408,8 @@ class NanoporeRead(object):
 
     def full_start_end_output(self, end_size, extra_trim_size, check_barcodes):
         def get_alignment_string(aln):
-            return aln[0].name + ', full score=' + str(aln[1]) + ', partial score=' + \
-                   str(aln[2]) + ', read position: ' + str(aln[3]) + '-' + str(aln[4])
+            return aln[0].name + ', full score=' + '%.1f' % aln[1] + ', partial score=' + \
+                   '%.1f' % aln[2] + ', read position: ' + str(aln[3]) + '-' + str(aln[4])
         output = self.name + '\n'
         output += '  start: ' + self.formatted_start_seq(end_size, extra_trim_size) + '...\n'
         if self.start_adapter_alignments:
@@ -456,10 +561,52 @@ class NanoporeRead(object):
             self.barcode_call = 'none'
 
 
-def align_adapter(read_seq, adapter_seq, scoring_scheme_vals):
-    alignment_result = adapter_alignment(read_seq, adapter_seq, scoring_scheme_vals)
-    result_parts = alignment_result.split(',')
-    read_start = int(result_parts[0])
+def align_adapter(read_seq, adapter_seq, scoring_scheme_vals, threshold=None):
+    """
+    The optional threshold is a (full identity, aligned region identity, min aligned region length)
+    tuple. Alignments which can't reach it come back with zero scores, as if they had failed.
+    """
+    result = adapter_alignment(read_seq, adapter_seq, scoring_scheme_vals, threshold)
+    return get_alignment_scores(result)
+
+
+def align_adapters(read_seq, adapter_seqs, scoring_scheme_vals, thresholds=None, end_band=0,
+                   at_read_end=False):
+    """
+    Aligns many adapters to the same read sequence using a single C++ call. Returns a list of
+    alignment score tuples (the same as align_adapter) in the adapter order. If given, thresholds
+    has one threshold tuple (see align_adapter) per adapter. If end_band is more than zero, only
+    alignments starting within that many bases of the read sequence's start (or finishing within
+    that many bases of its end, if at_read_end) are looked for.
+    """
+    if end_band > 0:
+        results = anchored_adapter_alignment_batch(read_seq, adapter_seqs, scoring_scheme_vals,
+                                                   thresholds, at_read_end, end_band)
+    else:
+        results = adapter_alignment_batch(read_seq, adapter_seqs, scoring_scheme_vals,
+                                          thresholds)
+    return [get_alignment_scores(x) for x in results]
+
+
+def end_thresholds(adapters, end_threshold, min_trim_size, check_barcodes, forward_or_reverse,
+                   barcode_search_threshold):
+    """
+    Returns the alignment thresholds for a read end search. An alignment matters if it's good
+    enough to trim or if it's a barcode whose identity could affect the barcode call.
+    """
+    thresholds = []
+    for adapter in adapters:
+        if check_barcodes and adapter.is_barcode() and \
+                adapter.barcode_direction() == forward_or_reverse:
+            full_threshold = barcode_search_threshold
+        else:
+            full_threshold = None
+        thresholds.append((full_threshold, end_threshold, min_trim_size))
+    return tuple(thresholds)
+
+
+def get_alignment_scores(result):
+    read_start = result.read_start
 
     # If the read start is -1, that indicates that the alignment failed completely.
     if read_start == -1:
@@ -467,9 +614,9 @@ def align_adapter(read_seq, adapter_seq, scoring_scheme_vals):
         aligned_region_percent_identity = 0.0
         full_adapter_percent_identity = 0.0
     else:
-        read_end = int(result_parts[1]) + 1
-        aligned_region_percent_identity = float(result_parts[5])
-        full_adapter_percent_identity = float(result_parts[6])
+        read_end = result.read_end + 1
+        aligned_region_percent_identity = result.aligned_region_percent_identity
+        full_adapter_percent_identity = result.full_adapter_percent_identity
 
     return full_adapter_percent_identity, aligned_region_percent_identity, read_start, read_end
 
@@ -17,30 +17,54 @@ not, see <http://www.gnu.org/licenses/>.
 import argparse
 import os
 import sys
-import subprocess
 import multiprocessing
-import shutil
 import re
+import itertools
 from multiprocessing.dummy import Pool as ThreadPool
-from collections import defaultdict
-from .misc import load_fasta_or_fastq, print_table, red, bold_underline, MyHelpFormatter, int_to_str
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, deque
+from .misc import load_fasta_or_fastq, iterate_fasta_or_fastq, iterate_stdin, print_table, red, \
+    bold_underline, MyHelpFormatter, int_to_str
 from .adapters import ADAPTERS, make_full_native_barcode_adapter, make_full_rapid_barcode_adapter
 from .nanopore_read import NanoporeRead
+from .read_output import ReadOutput
+from .cpp_function_wrappers import register_adapter, register_scoring_scheme, \
+    set_alignment_engine, trim_read_ends_batch, find_middle_adapters_batch, \
+    read_end_adapter_array, read_end_settings
 from .version import __version__
 
+# The read end and middle adapter searches hand the reads to the C++ code in chunks of this size.
+READ_CHUNK_SIZE = 1000
+
 
 def main():
     args = get_arguments()
-    reads, check_reads, read_type = load_reads(args.input, args.verbosity, args.print_dest,
-                                               args.check_reads)
+    set_aligner(args.aligner, args.verbosity, args.print_dest)
+    if args.batch_size:
+        check_reads, read_type = load_check_reads(args.input, args.verbosity, args.print_dest,
+                                                  args.check_reads, args.threads, args.shard)
+    else:
+        reads, check_reads, read_type = load_reads(args.input, args.verbosity, args.print_dest,
+                                                   args.check_reads, args.threads, args.shard)
 
-    matching_sets = find_matching_adapter_sets(check_reads, args.verbosity, args.end_size,
-                                               args.scoring_scheme_vals, args.print_dest,
-                                               args.adapter_threshold, args.threads, custom_adapters=args.custom_adapters)
+    if args.load_adapter_sets:
+        matching_sets = load_matching_adapter_sets(args.load_adapter_sets, args.verbosity,
+                                                   args.print_dest, args.adapter_threshold,
+                                                   args.custom_adapters)
+    else:
+        matching_sets = find_matching_adapter_sets(check_reads, args.verbosity, args.end_size,
+                                                   args.scoring_scheme_vals, args.print_dest,
+                                                   args.adapter_threshold, args.threads,
+                                                   custom_adapters=args.custom_adapters,
+                                                   end_band=args.end_band,
+                                                   all_scores=bool(args.save_adapter_sets))
+        if args.save_adapter_sets:
+            save_adapter_set_results(args.save_adapter_sets)
     matching_sets = exclude_end_adapters_for_rapid(matching_sets)
     matching_sets = fix_up_1d2_sets(matching_sets)
     display_adapter_set_results(matching_sets, args.verbosity, args.print_dest, custom_adapters=args.custom_adapters)
     matching_sets = add_full_barcode_adapter_sets(matching_sets)
+    register_adapter_sets(matching_sets)
 
     if args.barcode_dir:
         forward_or_reverse_barcodes = choose_barcoding_kit(matching_sets, args.verbosity,
@@ -50,6 +74,20 @@ def main():
     if args.verbosity > 0:
         print('\n', file=args.print_dest)
 
+    # The full output (verbosity 3) comes from the Python search, which doesn't use the workers.
+    if args.processes and matching_sets and args.verbosity < 3:
+        from .process_pool import ReadProcessPool  # needs Python 3.8 (checked in get_arguments)
+        process_pool = ReadProcessPool(args.processes, args.aligner, READ_CHUNK_SIZE)
+    else:
+        process_pool = None
+
+    if args.batch_size:
+        process_reads_in_batches(args, matching_sets, forward_or_reverse_barcodes, read_type,
+                                 check_reads, process_pool)
+        if process_pool is not None:
+            process_pool.close()
+        return
+
     if matching_sets:
         check_barcodes = (args.barcode_dir is not None)
         find_adapters_at_read_ends(reads, matching_sets, args.verbosity, args.end_size,
@@ -57,24 +95,30 @@ def main():
                                    args.scoring_scheme_vals, args.print_dest, args.min_trim_size,
                                    args.threads, check_barcodes, args.barcode_threshold,
                                    args.barcode_diff, args.require_two_barcodes,
-                                   forward_or_reverse_barcodes)
-        display_read_end_trimming_summary(reads, args.verbosity, args.print_dest)
+                                   forward_or_reverse_barcodes, args.end_band,
+                                   process_pool=process_pool)
+        display_read_end_trimming_summary(count_trimmed_reads(reads), args.verbosity,
+                                          args.print_dest)
 
         if not args.no_split:
             find_adapters_in_read_middles(reads, matching_sets, args.verbosity,
                                           args.middle_threshold, args.extra_middle_trim_good_side,
                                           args.extra_middle_trim_bad_side, args.scoring_scheme_vals,
-                                          args.print_dest, args.threads, args.discard_middle)
-            display_read_middle_trimming_summary(reads, args.discard_middle, args.verbosity,
-                                                 args.print_dest)
+                                          args.print_dest, args.threads, args.discard_middle,
+                                          process_pool=process_pool)
+            display_read_middle_trimming_summary(count_trimmed_reads(reads), args.discard_middle,
+                                                 args.verbosity, args.print_dest)
     elif args.verbosity > 0:
         print('No adapters found - output reads are unchanged from input reads\n',
               file=args.print_dest)
+    if process_pool is not None:
+        process_pool.close()
 
     output_reads(reads, args.format, args.output, read_type, args.verbosity,
                  args.discard_middle, args.min_split_read_size, args.print_dest,
                  args.barcode_dir, args.input, args.untrimmed, args.threads,
-                 args.discard_unassigned)
+                 args.discard_unassigned, args.compression_level, args.bgzf, args.shard,
+                 args.chunk_reads, args.chunk_bases)
 
 
 def get_arguments():
@@ -89,22 +133,52 @@ def get_arguments():
                                      formatter_class=MyHelpFormatter, add_help=False)
     main_group = parser.add_argument_group('Main options')
     main_group.add_argument('-i', '--input', required=True,
-                            help='FASTA/FASTQ of input reads or a directory which will be '
-                                 'recursively searched for FASTQ files (required)')
+                            help='FASTA/FASTQ/BAM of input reads, a directory which will be '
+                                 'recursively searched for FASTQ files or - to read from stdin '
+                                 '(required)')
     main_group.add_argument('-o', '--output',
-                            help='Filename for FASTA or FASTQ of trimmed reads (if not set, '
+                            help='Filename for FASTA, FASTQ or BAM of trimmed reads (if not set, '
                                  'trimmed reads will be printed to stdout)')
-    main_group.add_argument('--format', choices=['auto', 'fasta', 'fastq', 'fasta.gz', 'fastq.gz'],
+    main_group.add_argument('--format',
+                            choices=['auto', 'fasta', 'fastq', 'fasta.gz', 'fastq.gz', 'bam'],
                             default='auto',
                             help='Output format for the reads - if auto, the '
                                  'format will be chosen based on the output filename or the input '
                                  'read format')
+    main_group.add_argument('--compression_level', type=int, default=6,
+                            help='Compression level for gzipped or BAM output: 1 = fastest, '
+                                 '9 = smallest files')
+    main_group.add_argument('--bgzf', action='store_true',
+                            help='Save gzipped output in BGZF (blocked gzip, still readable by '
+                                 'any gzip tool), and gzipped or BAM output with an index of '
+                                 'where each read is (the output filename plus .idx)')
     main_group.add_argument('-v', '--verbosity', type=int, default=1,
                             help='Level of progress information: 0 = none, 1 = some, 2 = lots, '
                                  '3 = full - output will go to stdout if reads are saved to '
                                  'a file and stderr if reads are printed to stdout')
     main_group.add_argument('-t', '--threads', type=int, default=default_threads,
-                            help='Number of threads to use for adapter alignment')
+                            help='Number of threads to use for adapter alignment, loading input '
+                                 'directories and output compression')
+    main_group.add_argument('--processes', type=int, default=0,
+                            help='Run the read end and middle adapter searches in this many '
+                                 'worker processes, each using one thread, with the reads passed '
+                                 'to them in shared memory (default: 0 = search in this process '
+                                 'with --threads threads)')
+    main_group.add_argument('--batch_size', type=int, default=0,
+                            help='Stream the reads through trimming, splitting and output this '
+                                 'many at a time, so memory use depends on the batch size instead '
+                                 'of the input size (default: 0 = load all reads at once)')
+    main_group.add_argument('--shard', type=str,
+                            help='Only process the k-th of n parts of the input, given as k/n '
+                                 '(e.g. 3/8), so n Porechop runs can split up one input file or '
+                                 'directory')
+    main_group.add_argument('--chunk_reads', type=int, default=0,
+                            help='Split each output file (or barcode bin) into numbered chunks '
+                                 'of this many reads, each renamed from a temporary name once '
+                                 'complete (default: 0 = no chunks)')
+    main_group.add_argument('--chunk_bases', type=int, default=0,
+                            help='Like --chunk_reads, but start a new chunk when one reaches this '
+                                 'many bases (default: 0 = no chunks)')
 
     barcode_group = parser.add_argument_group('Barcode binning settings',
                                               'Control the binning of reads based on barcodes '
@@ -140,9 +214,24 @@ def get_arguments():
     adapter_search_group.add_argument('--check_reads', type=int, default=10000,
                                       help='This many reads will be aligned to all possible '
                                            'adapters to determine which adapter sets are present')
+    adapter_search_group.add_argument('--save_adapter_sets', type=str,
+                                      help='Save the adapter set results (each set\'s best start '
+                                           'and end %%ID in the check reads) to this file')
+    adapter_search_group.add_argument('--load_adapter_sets', type=str,
+                                      help='Use the adapter set results saved by '
+                                           '--save_adapter_sets instead of aligning the check '
+                                           'reads, e.g. so all shards trim the same adapters')
     adapter_search_group.add_argument('--scoring_scheme', type=str, default='3,-6,-5,-2',
                                       help='Comma-delimited string of alignment scores: match, '
                                            'mismatch, gap open, gap extend')
+    adapter_search_group.add_argument('--aligner', choices=['standard', 'simd', 'myers'],
+                                      default='standard',
+                                      help='Alignment engine for adapter searches: standard = '
+                                           'SeqAn, simd = many adapters aligned at once with SIMD '
+                                           'instructions (same results, faster), myers = '
+                                           'bit-parallel search to find where to align middle '
+                                           'adapters (much faster for long reads, but may miss '
+                                           'weak hits)')
     adapter_search_group.add_argument('--custom_adapters', type=str, default=None,
                                       help='Filepath to complementary custom adapters in csv format: '
                                            'name,name start|end,sequence,barcode (boolean)')
@@ -151,6 +240,11 @@ def get_arguments():
     end_trim_group.add_argument('--end_size', type=int, default=150,
                                 help='The number of base pairs at each end of the read which will '
                                      'be searched for adapter sequences')
+    end_trim_group.add_argument('--end_band', type=int, default=0,
+                                help='Only look for end adapters which start within this many '
+                                     'base pairs of the read start (or finish within this many of '
+                                     'the read end), so a large --end_size doesn\'t slow down the '
+                                     'search (default: 0 = search the whole --end_size)')
     end_trim_group.add_argument('--min_trim_size', type=int, default=4,
                                 help='Adapter alignments smaller than this will be ignored')
     end_trim_group.add_argument('--extra_end_trim', type=int, default=2,
@@ -218,22 +312,78 @@ def get_arguments():
     if args.threads < 1:
         sys.exit('Error: at least one thread required')
 
+    if args.processes < 0:
+        sys.exit('Error: --processes cannot be negative')
+    if args.processes and sys.version_info < (3, 8):
+        sys.exit('Error: --processes requires Python 3.8 or later (for shared memory)')
+
+    if args.end_band < 0:
+        sys.exit('Error: --end_band cannot be negative')
+
+    if args.batch_size < 0:
+        sys.exit('Error: --batch_size cannot be negative')
+
+    if args.compression_level < 1 or args.compression_level > 9:
+        sys.exit('Error: --compression_level must be between 1 and 9')
+
+    if args.bgzf and args.output is None and args.barcode_dir is None:
+        sys.exit('Error: --bgzf requires an output file (-o) or barcode directory (-b)')
+
+    if args.shard is not None:
+        try:
+            shard_num, shard_count = (int(x) for x in args.shard.split('/'))
+        except ValueError:
+            sys.exit('Error: --shard must be given as k/n, e.g. 3/8')
+        if shard_count < 1 or shard_num < 1 or shard_num > shard_count:
+            sys.exit('Error: --shard k/n must have k between 1 and n')
+        if args.input == '-':
+            sys.exit('Error: --shard cannot be used with reads from stdin')
+        args.shard = (shard_num, shard_count)
+
+    if args.chunk_reads < 0 or args.chunk_bases < 0:
+        sys.exit('Error: --chunk_reads and --chunk_bases cannot be negative')
+    if (args.chunk_reads or args.chunk_bases) and args.output is None and args.barcode_dir is None:
+        sys.exit('Error: --chunk_reads and --chunk_bases require an output file (-o) or barcode '
+                 'directory (-b)')
+
+    if args.save_adapter_sets and args.load_adapter_sets:
+        sys.exit('Error: --save_adapter_sets and --load_adapter_sets cannot be used together')
+
     return args
 
 
-def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count):
+def set_aligner(aligner, verbosity, print_dest):
+    """
+    Chooses the C++ alignment engine, warning the user if the requested one isn't available.
+    """
+    engine = set_alignment_engine(aligner)
+    if engine != aligner and verbosity > 0:
+        print('The ' + aligner + ' aligner is not supported on this CPU - using the ' + engine +
+              ' aligner instead\n', file=print_dest)
+
+
+def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count, threads=1,
+               shard=None):
+
+    # If the input is stdin, load all of the reads piped in. The check reads will just be the
+    # first reads.
+    if input_file_or_directory == '-':
+        if verbosity > 0:
+            print('\n' + bold_underline('Loading reads'), flush=True, file=print_dest)
+            print('stdin', flush=True, file=print_dest)
+        records, read_type = iterate_stdin()
+        reads = [make_nanopore_read(x, read_type) for x in records]
+        check_reads = reads[:check_read_count]
 
     # If the input is a file, just load reads from that file. The check reads will just be the
     # first reads from that file.
-    if os.path.isfile(input_file_or_directory):
+    elif os.path.isfile(input_file_or_directory):
         if verbosity > 0:
             print('\n' + bold_underline('Loading reads'), flush=True, file=print_dest)
-            print(input_file_or_directory, flush=True, file=print_dest)
-        reads, read_type = load_fasta_or_fastq(input_file_or_directory)
-        if read_type == 'FASTA':
-            reads = [NanoporeRead(x[2], x[1], '') for x in reads]
-        else:  # FASTQ
-            reads = [NanoporeRead(x[4], x[1], x[3]) for x in reads]
+            print(input_file_or_directory + shard_description(shard), flush=True,
+                  file=print_dest)
+        reads, read_type = load_fasta_or_fastq(input_file_or_directory, shard)
+        reads = [make_nanopore_read(x, read_type) for x in reads]
         check_reads = reads[:check_read_count]
 
     # If the input is a directory, assume it's an Albacore directory and search it recursively for
@@ -241,25 +391,16 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
     elif os.path.isdir(input_file_or_directory):
         if verbosity > 0:
             print('\n' + bold_underline('Searching for FASTQ files'), flush=True, file=print_dest)
-        fastqs = sorted([os.path.join(dir_path, f)
-                         for dir_path, _, filenames in os.walk(input_file_or_directory)
-                         for f in filenames
-                         if f.lower().endswith('.fastq') or f.lower().endswith('.fastq.gz')])
-        if not fastqs:
-            sys.exit('Error: could not find fastq files in ' + input_file_or_directory)
+        fastqs = shard_files(find_fastq_files(input_file_or_directory), shard)
+        if verbosity > 0 and shard is not None:
+            print(shard_description(shard).strip(), flush=True, file=print_dest)
         reads = []
         read_type = 'FASTQ'
         check_reads = []
-        check_reads_per_file = int(round(check_read_count / len(fastqs)))
-        for fastq_file in fastqs:
+        check_reads_per_file = int(round(check_read_count / max(len(fastqs), 1)))
+        for fastq_file, file_reads in load_fastq_files(fastqs, threads):
             if verbosity > 0:
                 print(fastq_file, flush=True, file=print_dest)
-            file_reads, _ = load_fasta_or_fastq(fastq_file)
-            file_reads = [NanoporeRead(x[4], x[1], x[3]) for x in file_reads]
-
-            albacore_barcode = get_albacore_barcode_from_path(fastq_file)
-            for read in file_reads:
-                read.albacore_barcode_call = albacore_barcode
             reads += file_reads
             check_reads += file_reads[:check_reads_per_file]
         if verbosity > 0:
@@ -273,6 +414,164 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
     return reads, check_reads, read_type
 
 
+def load_check_reads(input_file_or_directory, verbosity, print_dest, check_read_count,
+                     threads=1, shard=None):
+    """
+    For streaming (--batch_size), only the check reads are loaded up front. They are the same reads
+    load_reads would choose, and the rest of the input is left for iterate_reads.
+    """
+    if input_file_or_directory == '-':
+        if verbosity > 0:
+            print('\n' + bold_underline('Loading check reads'), flush=True, file=print_dest)
+            print('stdin', flush=True, file=print_dest)
+        records, read_type = iterate_stdin()
+        check_reads = [make_nanopore_read(x, read_type)
+                       for x in itertools.islice(records, max(check_read_count, 0))]
+
+    elif os.path.isfile(input_file_or_directory):
+        if verbosity > 0:
+            print('\n' + bold_underline('Loading check reads'), flush=True, file=print_dest)
+            print(input_file_or_directory + shard_description(shard), flush=True,
+                  file=print_dest)
+        records, read_type = iterate_fasta_or_fastq(input_file_or_directory, shard)
+        check_reads = [make_nanopore_read(x, read_type)
+                       for x in itertools.islice(records, max(check_read_count, 0))]
+        records.close()
+
+    elif os.path.isdir(input_file_or_directory):
+        if verbosity > 0:
+            print('\n' + bold_underline('Searching for FASTQ files'), flush=True, file=print_dest)
+        fastqs = shard_files(find_fastq_files(input_file_or_directory), shard)
+        if verbosity > 0 and shard is not None:
+            print(shard_description(shard).strip(), flush=True, file=print_dest)
+        read_type = 'FASTQ'
+        check_reads = []
+        check_reads_per_file = int(round(check_read_count / max(len(fastqs), 1)))
+        for fastq_file, file_reads in load_fastq_files(fastqs, threads,
+                                                       max(check_reads_per_file, 0)):
+            if verbosity > 0:
+                print(fastq_file, flush=True, file=print_dest)
+            check_reads += file_reads
+        if verbosity > 0:
+            print('', flush=True, file=print_dest)
+
+    else:
+        sys.exit('Error: could not find ' + input_file_or_directory)
+
+    if verbosity > 0:
+        print(int_to_str(len(check_reads)) + ' check reads loaded\n\n', flush=True,
+              file=print_dest)
+    return check_reads, read_type
+
+
+def iterate_reads(input_file_or_directory, threads=1, check_reads=None, shard=None):
+    """
+    Yields all of the input reads, in the same order and with the same Albacore barcode calls as
+    load_reads, but only reads them from the input as they are needed. Stdin can't be read again
+    from its start, so for stdin the check reads (the first reads) are yielded and then the rest.
+    """
+    if input_file_or_directory == '-':
+        yield from check_reads
+        records, read_type = iterate_stdin()
+        for record in records:
+            yield make_nanopore_read(record, read_type)
+    elif os.path.isfile(input_file_or_directory):
+        records, read_type = iterate_fasta_or_fastq(input_file_or_directory, shard)
+        for record in records:
+            yield make_nanopore_read(record, read_type)
+    else:
+        fastqs = shard_files(find_fastq_files(input_file_or_directory), shard)
+        for _, file_reads in load_fastq_files(fastqs, threads):
+            yield from file_reads
+
+
+def iterate_read_batches(input_file_or_directory, batch_size, threads=1, check_reads=None,
+                         shard=None):
+    reads = iterate_reads(input_file_or_directory, threads, check_reads, shard)
+    while True:
+        batch = list(itertools.islice(reads, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def make_nanopore_read(record, read_type):
+    if read_type == 'FASTA':
+        return NanoporeRead(record[2], record[1], '')
+    elif read_type == 'BAM':
+        read = NanoporeRead(record[0], record[1], record[2])
+        read.bam_tags = record[3]
+        return read
+    else:  # FASTQ
+        return NanoporeRead(record[4], record[1], record[3])
+
+
+def load_fastq_files(fastqs, threads, reads_per_file=None):
+    """
+    Yields each FASTQ file's name and reads (only the first reads_per_file of them, if set), in the
+    same order as the files. The files are loaded by a thread pool, so many are read (and
+    decompressed) at once, which helps most when there are many small files on a slow or network
+    filesystem. Only a few files are loaded ahead of the one being yielded.
+    """
+    threads = max(threads, 1)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        loading = deque()
+        for fastq_file in fastqs:
+            loading.append((fastq_file,
+                            executor.submit(load_fastq_file, fastq_file, reads_per_file)))
+            if len(loading) > 2 * threads:
+                fastq_file, file_reads = loading.popleft()
+                yield fastq_file, file_reads.result()
+        while loading:
+            fastq_file, file_reads = loading.popleft()
+            yield fastq_file, file_reads.result()
+
+
+def load_fastq_file(fastq_file, reads_per_file=None):
+    """
+    Loads one FASTQ file from an Albacore directory, labelling its reads with the file's barcode.
+    """
+    albacore_barcode = get_albacore_barcode_from_path(fastq_file)
+    records, _ = iterate_fasta_or_fastq(fastq_file)
+    file_reads = []
+    for record in itertools.islice(records, reads_per_file):
+        read = make_nanopore_read(record, 'FASTQ')
+        read.albacore_barcode_call = albacore_barcode
+        file_reads.append(read)
+    records.close()
+    return file_reads
+
+
+def find_fastq_files(directory):
+    """
+    Recursively searches an (Albacore) directory for FASTQ files.
+    """
+    fastqs = sorted([os.path.join(dir_path, f)
+                     for dir_path, _, filenames in os.walk(directory)
+                     for f in filenames
+                     if f.lower().endswith('.fastq') or f.lower().endswith('.fastq.gz')])
+    if not fastqs:
+        sys.exit('Error: could not find fastq files in ' + directory)
+    return fastqs
+
+
+def shard_files(fastqs, shard):
+    """
+    A directory's k-th of n shards is the k-th of n runs of its (sorted) files.
+    """
+    if shard is None:
+        return fastqs
+    shard_num, shard_count = shard
+    return fastqs[len(fastqs) * (shard_num - 1) // shard_count:
+                  len(fastqs) * shard_num // shard_count]
+
+
+def shard_description(shard):
+    if shard is None:
+        return ''
+    return ' (shard ' + str(shard[0]) + ' of ' + str(shard[1]) + ')'
+
+
 def get_albacore_barcode_from_path(albacore_path):
     if '/unclassified/' in albacore_path:
         return 'none'
@@ -330,9 +629,11 @@ def load_custom_adapters(custom_adapters):
                 end_sequence=(end, sequence_end))
 
 def find_matching_adapter_sets(check_reads, verbosity, end_size, scoring_scheme_vals, print_dest,
-                               adapter_threshold, threads, custom_adapters):
+                               adapter_threshold, threads, custom_adapters, end_band=0,
+                               all_scores=False):
     """
     Aligns all of the adapter sets to the start/end of reads to see which (if any) matches best.
+    If all_scores is True, every set's best scores are found, even those below the threshold.
     """
     read_count = len(check_reads)
     if verbosity > 0:
@@ -340,40 +641,39 @@ def find_matching_adapter_sets(check_reads, verbosity, end_size, scoring_scheme_
         output_progress_line(0, read_count, print_dest)
 
 
-    if not custom_adapters:
-        search_adapters = [a for a in ADAPTERS if '(full sequence)' not in a.name]
-    else:
-        # Append custom_adapters to the default search_adapters.
-        CUSTOM_ADAPTERS = load_custom_adapters(custom_adapters)
-        [ADAPTERS.append(a) for a in CUSTOM_ADAPTERS]
-        search_adapters = [a for a in ADAPTERS if '(full sequence)' not in a.name]
+    search_adapters = get_search_adapters(custom_adapters)
+    register_adapter_sets(search_adapters)
+    register_scoring_scheme(scoring_scheme_vals)
 
-    search_adapter_count = len(search_adapters)
+    # The best scores of sets which don't match are only shown in the verbose output's table and
+    # saved by --save_adapter_sets (a later run may load them with a lower threshold). Otherwise,
+    # scores below the adapter threshold aren't needed, which lets most sets be skipped by the
+    # aligner's q-gram screen.
+    score_floor = adapter_threshold if verbosity == 0 and not all_scores else 0.0
 
     # If single-threaded, do the work in a simple loop.
     if threads == 1:
         for read_num, read in enumerate(check_reads):
-            for adapter_set in search_adapters:
-                read.align_adapter_set(adapter_set, end_size, scoring_scheme_vals)
+            read.align_adapter_sets(search_adapters, end_size, scoring_scheme_vals, end_band,
+                                    score_floor)
             if verbosity > 0:
                 output_progress_line(read_num+1, read_count, print_dest)
 
     # If multi-threaded, use a thread pool.
     else:
-        def align_adapter_set_one_arg(all_args):
-            r, a, b, c = all_args
-            r.align_adapter_set(a, b, c)
+        def align_adapter_sets_one_arg(all_args):
+            r, a, b, c, d, e = all_args
+            r.align_adapter_sets(a, b, c, d, e)
         with ThreadPool(threads) as pool:
             arg_list = []
             for read in check_reads:
-                for adapter_set in search_adapters:
-                    arg_list.append((read, adapter_set, end_size, scoring_scheme_vals))
+                arg_list.append((read, search_adapters, end_size, scoring_scheme_vals, end_band,
+                                 score_floor))
             finished_count = 0
-            for _ in pool.imap(align_adapter_set_one_arg, arg_list):
+            for _ in pool.imap(align_adapter_sets_one_arg, arg_list):
                 finished_count += 1
-                if verbosity > 0 and finished_count % search_adapter_count == 0:
-                    output_progress_line(finished_count // search_adapter_count,
-                                         read_count, print_dest)
+                if verbosity > 0:
+                    output_progress_line(finished_count, read_count, print_dest)
 
     if verbosity > 0:
         output_progress_line(read_count, read_count, print_dest, end_newline=True)
@@ -381,6 +681,66 @@ def find_matching_adapter_sets(check_reads, verbosity, end_size, scoring_scheme_
     return [x for x in search_adapters if x.best_start_or_end_score() >= adapter_threshold]
 
 
+def get_search_adapters(custom_adapters):
+    if custom_adapters:
+        # Append custom_adapters to the default search_adapters.
+        CUSTOM_ADAPTERS = load_custom_adapters(custom_adapters)
+        [ADAPTERS.append(a) for a in CUSTOM_ADAPTERS]
+    return [a for a in ADAPTERS if '(full sequence)' not in a.name]
+
+
+def save_adapter_set_results(filename):
+    """
+    Saves each adapter set's best scores from find_matching_adapter_sets, one tab-delimited line
+    per set: name, best read start %ID and best read end %ID.
+    """
+    with open(filename, 'wt') as results_file:
+        for adapter_set in ADAPTERS:
+            if '(full sequence)' not in adapter_set.name:
+                results_file.write(adapter_set.name + '\t' + repr(adapter_set.best_start_score) +
+                                   '\t' + repr(adapter_set.best_end_score) + '\n')
+
+
+def load_matching_adapter_sets(filename, verbosity, print_dest, adapter_threshold,
+                               custom_adapters):
+    """
+    Gives the same adapter sets as find_matching_adapter_sets did in the run which saved the
+    results file, without aligning any reads.
+    """
+    if verbosity > 0:
+        print(bold_underline('Loading adapter set results'), flush=True, file=print_dest)
+        print(filename, flush=True, file=print_dest)
+    if not os.path.isfile(filename):
+        sys.exit('Error: could not find ' + filename)
+    search_adapters = {a.name: a for a in get_search_adapters(custom_adapters)}
+    with open(filename, 'rt') as results_file:
+        for line in results_file:
+            parts = line.rstrip('\n').split('\t')
+            try:
+                name, start_score, end_score = parts[0], float(parts[1]), float(parts[2])
+            except (IndexError, ValueError):
+                sys.exit('Error: ' + filename + ' is not an adapter set results file')
+            if name not in search_adapters:
+                sys.exit('Error: ' + filename + ' has results for an unknown adapter set: ' +
+                         name)
+            search_adapters[name].best_start_score = start_score
+            search_adapters[name].best_end_score = end_score
+    return [x for x in search_adapters.values()
+            if x.best_start_or_end_score() >= adapter_threshold]
+
+
+def register_adapter_sets(adapter_sets):
+    """
+    Sends the adapter sequences to the C++ adapter registry up front, so alignments can refer to
+    them by ID.
+    """
+    for adapter_set in adapter_sets:
+        if adapter_set.start_sequence:
+            register_adapter(adapter_set.start_sequence[1])
+        if adapter_set.end_sequence:
+            register_adapter(adapter_set.end_sequence[1])
+
+
 def choose_barcoding_kit(adapter_sets, verbosity, print_dest):
     """
     If the user is sorting reads by barcode bin, choose one barcode configuration (rev comp
@@ -483,99 +843,173 @@ def add_full_barcode_adapter_sets(matching_sets):
 def find_adapters_at_read_ends(reads, matching_sets, verbosity, end_size, extra_trim_size,
                                end_threshold, scoring_scheme_vals, print_dest, min_trim_size,
                                threads, check_barcodes, barcode_threshold, barcode_diff,
-                               require_two_barcodes, forward_or_reverse_barcodes):
-    if verbosity > 0:
-        print(bold_underline('Trimming adapters from read ends'),
-              file=print_dest)
-        name_len = max(max(len(x.start_sequence[0]) for x in matching_sets),
-                       max(len(x.end_sequence[0]) if x.end_sequence else 0 for x in matching_sets))
-        for matching_set in matching_sets:
-            print('  ' + matching_set.start_sequence[0].rjust(name_len) + ': ' +
-                  red(matching_set.start_sequence[1]), file=print_dest)
-            if matching_set.end_sequence:
-                print('  ' + matching_set.end_sequence[0].rjust(name_len) + ': ' +
-                      red(matching_set.end_sequence[1]), file=print_dest)
-        print('', file=print_dest)
+                               require_two_barcodes, forward_or_reverse_barcodes, end_band,
+                               in_batches=False, process_pool=None):
+    """
+    If in_batches is True, the reads are one batch of many, so the heading and progress are left to
+    the caller. If a process pool is given, the C++ search runs in its worker processes.
+    """
+    if not in_batches:
+        display_read_end_adapters(matching_sets, verbosity, print_dest)
 
+    # A barcode identity this low can't change a read's barcode call, so those alignments only need
+    # a score. The exception is when the barcode identities are displayed.
+    if verbosity < 2:
+        barcode_search_threshold = barcode_threshold - barcode_diff
+    else:
+        barcode_search_threshold = 0.0
+
+    show_progress = verbosity == 1 and not in_batches
     read_count = len(reads)
-    if verbosity == 1:
+    if show_progress:
         output_progress_line(0, read_count, print_dest)
 
-    # If single-threaded, do the work in a simple loop.
-    if threads == 1:
-        for read_num, read in enumerate(reads):
-            read.find_start_trim(matching_sets, end_size, extra_trim_size, end_threshold,
-                                 scoring_scheme_vals, min_trim_size, check_barcodes,
-                                 forward_or_reverse_barcodes)
-            read.find_end_trim(matching_sets, end_size, extra_trim_size, end_threshold,
-                               scoring_scheme_vals, min_trim_size, check_barcodes,
-                               forward_or_reverse_barcodes)
-            if check_barcodes:
-                read.determine_barcode(barcode_threshold, barcode_diff, require_two_barcodes)
-            if verbosity == 1:
-                output_progress_line(read_num+1, read_count, print_dest)
-            elif verbosity == 2:
-                print(read.formatted_start_and_end_seq(end_size, extra_trim_size, check_barcodes),
-                      file=print_dest)
-            elif verbosity > 2:
+    # The full output shows every alignment, so it needs the Python search which keeps them.
+    if verbosity > 2:
+        # If single-threaded, do the work in a simple loop.
+        if threads == 1:
+            for read in reads:
+                read.find_start_trim(matching_sets, end_size, extra_trim_size, end_threshold,
+                                     scoring_scheme_vals, min_trim_size, check_barcodes,
+                                     forward_or_reverse_barcodes, barcode_search_threshold,
+                                     end_band)
+                read.find_end_trim(matching_sets, end_size, extra_trim_size, end_threshold,
+                                   scoring_scheme_vals, min_trim_size, check_barcodes,
+                                   forward_or_reverse_barcodes, barcode_search_threshold, end_band)
+                if check_barcodes:
+                    read.determine_barcode(barcode_threshold, barcode_diff, require_two_barcodes)
                 print(read.full_start_end_output(end_size, extra_trim_size, check_barcodes),
                       file=print_dest)
 
-    # If multi-threaded, use a thread pool.
-    else:
-        def start_end_trim_one_arg(all_args):
-            r, a, b, c, d, e, f, g, h, i, j, k, v = all_args
-            r.find_start_trim(a, b, c, d, e, f, g, k)
-            r.find_end_trim(a, b, c, d, e, f, g, k)
-            if check_barcodes:
-                r.determine_barcode(h, i, j)
-            if v == 2:
-                return r.formatted_start_and_end_seq(b, c, g)
-            if v > 2:
+        # If multi-threaded, use a thread pool.
+        else:
+            def start_end_trim_one_arg(all_args):
+                r, a, b, c, d, e, f, g, h, i, j, k, t, n = all_args
+                r.find_start_trim(a, b, c, d, e, f, g, k, t, n)
+                r.find_end_trim(a, b, c, d, e, f, g, k, t, n)
+                if check_barcodes:
+                    r.determine_barcode(h, i, j)
                 return r.full_start_end_output(b, c, g)
-            else:
-                return ''
-        with ThreadPool(threads) as pool:
-            arg_list = []
-            for read in reads:
-                arg_list.append((read, matching_sets, end_size, extra_trim_size, end_threshold,
-                                 scoring_scheme_vals, min_trim_size, check_barcodes,
-                                 barcode_threshold, barcode_diff, require_two_barcodes,
-                                 forward_or_reverse_barcodes, verbosity))
-            finished_count = 0
-            for out in pool.imap(start_end_trim_one_arg, arg_list):
-                finished_count += 1
-                if verbosity == 1:
-                    output_progress_line(finished_count, read_count, print_dest)
-                elif verbosity > 1:
+            with ThreadPool(threads) as pool:
+                arg_list = []
+                for read in reads:
+                    arg_list.append((read, matching_sets, end_size, extra_trim_size,
+                                     end_threshold, scoring_scheme_vals, min_trim_size,
+                                     check_barcodes, barcode_threshold, barcode_diff,
+                                     require_two_barcodes, forward_or_reverse_barcodes,
+                                     barcode_search_threshold, end_band))
+                for out in pool.imap(start_end_trim_one_arg, arg_list):
                     print(out, file=print_dest, flush=True)
 
-    if verbosity == 1:
+    # Otherwise the C++ batch search does whole chunks of reads at once on its own threads (or in
+    # the worker processes).
+    else:
+        adapters, barcode_names = read_end_adapters(matching_sets, check_barcodes,
+                                                    forward_or_reverse_barcodes)
+        settings = (tuple(scoring_scheme_vals), end_size, extra_trim_size, end_threshold,
+                    min_trim_size, barcode_search_threshold, end_band)
+        if process_pool is not None:
+            chunk_results = process_pool.trim_read_ends([r.seq for r in reads], adapters,
+                                                        len(barcode_names), settings)
+        else:
+            chunk_results = (trim_read_ends_batch([r.seq for r in reads[i:i + READ_CHUNK_SIZE]],
+                                                  read_end_adapter_array(adapters),
+                                                  len(barcode_names), read_end_settings(*settings),
+                                                  threads)
+                             for i in range(0, read_count, READ_CHUNK_SIZE))
+        for chunk_start, results in zip(range(0, read_count, READ_CHUNK_SIZE), chunk_results):
+            chunk = reads[chunk_start:chunk_start + READ_CHUNK_SIZE]
+            for read, result in zip(chunk, results):
+                read.set_read_end_results(result, barcode_names)
+                if check_barcodes:
+                    read.determine_barcode(barcode_threshold, barcode_diff, require_two_barcodes)
+                if verbosity == 2:
+                    print(read.formatted_start_and_end_seq(end_size, extra_trim_size,
+                                                           check_barcodes), file=print_dest)
+            if show_progress:
+                output_progress_line(chunk_start + len(chunk), read_count, print_dest)
+
+    if show_progress:
         output_progress_line(read_count, read_count, print_dest, end_newline=True)
-    if verbosity > 0:
+    if verbosity > 0 and not in_batches:
         print('', file=print_dest)
 
 
-def display_read_end_trimming_summary(reads, verbosity, print_dest):
+def display_read_end_adapters(matching_sets, verbosity, print_dest):
     if verbosity < 1:
         return
-    start_trim_total = sum(x.start_trim_amount for x in reads)
-    start_trim_count = sum(1 if x.start_trim_amount else 0 for x in reads)
-    end_trim_count = sum(1 if x.end_trim_amount else 0 for x in reads)
-    end_trim_total = sum(x.end_trim_amount for x in reads)
-    print(int_to_str(start_trim_count).rjust(len(int_to_str(len(reads)))) + ' / ' +
-          int_to_str(len(reads)) + ' reads had adapters trimmed from their start (' +
-          int_to_str(start_trim_total) + ' bp removed)', file=print_dest)
-    print(int_to_str(end_trim_count).rjust(len(int_to_str(len(reads)))) + ' / ' +
-          int_to_str(len(reads)) + ' reads had adapters trimmed from their end (' +
-          int_to_str(end_trim_total) + ' bp removed)', file=print_dest)
+    print(bold_underline('Trimming adapters from read ends'),
+          file=print_dest)
+    name_len = max(max(len(x.start_sequence[0]) for x in matching_sets),
+                   max(len(x.end_sequence[0]) if x.end_sequence else 0 for x in matching_sets))
+    for matching_set in matching_sets:
+        print('  ' + matching_set.start_sequence[0].rjust(name_len) + ': ' +
+              red(matching_set.start_sequence[1]), file=print_dest)
+        if matching_set.end_sequence:
+            print('  ' + matching_set.end_sequence[0].rjust(name_len) + ': ' +
+                  red(matching_set.end_sequence[1]), file=print_dest)
+    print('', file=print_dest)
+
+
+def read_end_adapters(matching_sets, check_barcodes, forward_or_reverse_barcodes):
+    """
+    Describes the adapter sets for the C++ read end search, as a tuple of (start adapter sequence,
+    end adapter sequence or None, barcode index) tuples (see read_end_adapter_array). Also returns
+    the list of barcode names which the barcode indices refer to.
+    """
+    adapters = []
+    barcode_names = []
+    for adapter in matching_sets:
+        barcode_index = -1
+        if check_barcodes and adapter.is_barcode() and \
+                adapter.barcode_direction() == forward_or_reverse_barcodes:
+            barcode_name = adapter.get_barcode_name()
+            if barcode_name not in barcode_names:
+                barcode_names.append(barcode_name)
+            barcode_index = barcode_names.index(barcode_name)
+        end_sequence = adapter.end_sequence[1] if adapter.end_sequence else None
+        adapters.append((adapter.start_sequence[1], end_sequence, barcode_index))
+    return tuple(adapters), barcode_names
+
+
+def count_trimmed_reads(reads):
+    """
+    Returns the totals which the trimming summaries show. Totals for separate batches of reads can
+    be added together with Counter.update.
+    """
+    totals = Counter()
+    for read in reads:
+        totals['reads'] += 1
+        totals['start_trim_total'] += read.start_trim_amount
+        totals['start_trim_count'] += 1 if read.start_trim_amount else 0
+        totals['end_trim_total'] += read.end_trim_amount
+        totals['end_trim_count'] += 1 if read.end_trim_amount else 0
+        totals['middle_trim_count'] += 1 if read.middle_adapter_positions else 0
+    return totals
+
+
+def display_read_end_trimming_summary(totals, verbosity, print_dest):
+    if verbosity < 1:
+        return
+    read_count = int_to_str(totals['reads'])
+    print(int_to_str(totals['start_trim_count']).rjust(len(read_count)) + ' / ' +
+          read_count + ' reads had adapters trimmed from their start (' +
+          int_to_str(totals['start_trim_total']) + ' bp removed)', file=print_dest)
+    print(int_to_str(totals['end_trim_count']).rjust(len(read_count)) + ' / ' +
+          read_count + ' reads had adapters trimmed from their end (' +
+          int_to_str(totals['end_trim_total']) + ' bp removed)', file=print_dest)
     print('\n', file=print_dest)
 
 
 def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_threshold,
                                   extra_trim_good_side, extra_trim_bad_side, scoring_scheme_vals,
-                                  print_dest, threads, discard_middle):
-    if verbosity > 0:
+                                  print_dest, threads, discard_middle, in_batches=False,
+                                  process_pool=None):
+    """
+    If in_batches is True, the reads are one batch of many, so the heading and progress are left to
+    the caller. If a process pool is given, the C++ search runs in its worker processes.
+    """
+    if verbosity > 0 and not in_batches:
         verb = 'Discarding' if discard_middle else 'Splitting'
         print(bold_underline(verb + ' reads containing middle adapters'),
               file=print_dest)
@@ -594,183 +1028,116 @@ def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_thresh
         if matching_set.end_sequence:
             end_sequence_names.add(matching_set.end_sequence[0])
 
+    show_progress = verbosity == 1 and not in_batches
     read_count = len(reads)
-    if verbosity == 1:
+    if show_progress:
         output_progress_line(0, read_count, print_dest)
 
-    # If single-threaded, do the work in a simple loop.
-    if threads == 1:
-        for read_num, read in enumerate(reads):
-            read.find_middle_adapters(adapters, middle_threshold, extra_trim_good_side,
-                                      extra_trim_bad_side, scoring_scheme_vals,
-                                      start_sequence_names, end_sequence_names)
-            if verbosity == 1:
-                output_progress_line(read_num+1, read_count, print_dest)
+    # The C++ batch search does whole chunks of reads at once on its own threads (or in the worker
+    # processes).
+    adapter_seqs = tuple(x[1] for x in adapters)
+    if process_pool is not None:
+        chunk_hits = process_pool.find_middle_adapters(
+            [r.get_seq_with_start_end_adapters_trimmed() for r in reads], adapter_seqs,
+            scoring_scheme_vals, middle_threshold)
+    else:
+        # Each read is encoded once and the C++ code reads its trimmed part in place.
+        chunk_hits = (find_middle_adapters_batch([(r.seq.encode('utf-8'),) +
+                                                  r.start_end_trimmed_range()
+                                                  for r in reads[i:i + READ_CHUNK_SIZE]],
+                                                 adapter_seqs, scoring_scheme_vals,
+                                                 middle_threshold, threads)
+                      for i in range(0, read_count, READ_CHUNK_SIZE))
+    for chunk_start, all_hits in zip(range(0, read_count, READ_CHUNK_SIZE), chunk_hits):
+        chunk = reads[chunk_start:chunk_start + READ_CHUNK_SIZE]
+        for read, hits in zip(chunk, all_hits):
+            read.add_middle_adapter_hits(hits, adapters, extra_trim_good_side, extra_trim_bad_side,
+                                         start_sequence_names, end_sequence_names)
             if read.middle_adapter_positions and verbosity > 1:
                 print(read.middle_adapter_results(verbosity), file=print_dest, flush=True)
+        if show_progress:
+            output_progress_line(chunk_start + len(chunk), read_count, print_dest)
 
-    # If multi-threaded, use a thread pool.
-    else:
-        def find_middle_adapters_one_arg(all_args):
-            r, a, b, c, d, e, f, g, v = all_args
-            r.find_middle_adapters(a, b, c, d, e, f, g)
-            return r.middle_adapter_results(v)
-        with ThreadPool(threads) as pool:
-            arg_list = []
-            for read in reads:
-                arg_list.append((read, adapters, middle_threshold, extra_trim_good_side,
-                                 extra_trim_bad_side, scoring_scheme_vals, start_sequence_names,
-                                 end_sequence_names, verbosity))
-            finished_count = 0
-            for out in pool.imap(find_middle_adapters_one_arg, arg_list):
-                finished_count += 1
-                if verbosity == 1:
-                    output_progress_line(finished_count + 1, read_count, print_dest)
-                if verbosity > 1 and out:
-                    print(out, file=print_dest, flush=True)
-
-    if verbosity == 1:
+    if show_progress:
         output_progress_line(read_count, read_count, print_dest, end_newline=True)
         print('', flush=True, file=print_dest)
 
 
-def display_read_middle_trimming_summary(reads, discard_middle, verbosity, print_dest):
+def display_read_middle_trimming_summary(totals, discard_middle, verbosity, print_dest):
     if verbosity < 1:
         return
-    middle_trim_count = sum(1 if x.middle_adapter_positions else 0 for x in reads)
     verb = 'discarded' if discard_middle else 'split'
-    print(int_to_str(middle_trim_count) + ' / ' + int_to_str(len(reads)) + ' reads were ' + verb +
-          ' based on middle adapters\n\n', file=print_dest)
+    print(int_to_str(totals['middle_trim_count']) + ' / ' + int_to_str(totals['reads']) +
+          ' reads were ' + verb + ' based on middle adapters\n\n', file=print_dest)
 
 
 def output_reads(reads, out_format, output, read_type, verbosity, discard_middle,
                  min_split_size, print_dest, barcode_dir, input_filename,
-                 untrimmed, threads, discard_unassigned):
-    if verbosity > 0:
-        trimmed_or_untrimmed = 'untrimmed' if untrimmed else 'trimmed'
-        if barcode_dir is not None:
-            verb = 'Saving '
-            destination = 'barcode-specific files'
-        elif output is None:
-            verb = 'Outputting '
-            destination = 'stdout'
-        else:
-            verb = 'Saving '
-            destination = 'file'
-        print(bold_underline(verb + trimmed_or_untrimmed + ' reads to ' + destination),
-              flush=True, file=print_dest)
-
-    if out_format == 'auto':
-        if output is None:
-            out_format = read_type.lower()
-            if barcode_dir is not None and input_filename.lower().endswith('.gz'):
-                out_format += '.gz'
-        elif '.fasta.gz' in output.lower():
-            out_format = 'fasta.gz'
-        elif '.fastq.gz' in output.lower():
-            out_format = 'fastq.gz'
-        elif '.fasta' in output.lower():
-            out_format = 'fasta'
-        elif '.fastq' in output.lower():
-            out_format = 'fastq'
-        else:
-            out_format = read_type.lower()
-
-    gzipped_out = False
-    gzip_command = 'gzip'
-    if out_format.endswith('.gz') and (barcode_dir is not None or output is not None):
-        gzipped_out = True
-        out_format = out_format[:-3]
-        if shutil.which('pigz'):
-            if verbosity > 0:
-                print('pigz found - using it to compress instead of gzip')
-            gzip_command = 'pigz -p ' + str(threads)
-        else:
-            if verbosity > 0:
-                print('pigz not found - using gzip to compress')
-
-    # Output reads to barcode bins.
-    if barcode_dir is not None:
-        if not os.path.isdir(barcode_dir):
-            os.makedirs(barcode_dir)
-        barcode_files = {}
-        barcode_read_counts, barcode_base_counts = defaultdict(int), defaultdict(int)
-        for read in reads:
-            barcode_name = read.barcode_call
-            if discard_unassigned and barcode_name == 'none':
-                continue
-            if out_format == 'fasta':
-                read_str = read.get_fasta(min_split_size, discard_middle, untrimmed)
-            else:
-                read_str = read.get_fastq(min_split_size, discard_middle, untrimmed)
-            if not read_str:
-                continue
-            if barcode_name not in barcode_files:
-                barcode_files[barcode_name] = \
-                    open(os.path.join(barcode_dir, barcode_name + '.' + out_format), 'wt')
-            barcode_files[barcode_name].write(read_str)
-            barcode_read_counts[barcode_name] += 1
-            if untrimmed:
-                seq_length = len(read.seq)
-            else:
-                seq_length = read.seq_length_with_start_end_adapters_trimmed()
-            barcode_base_counts[barcode_name] += seq_length
-        table = [['Barcode', 'Reads', 'Bases', 'File']]
-
-        for barcode_name in sorted(barcode_files.keys()):
-            barcode_files[barcode_name].close()
-            bin_filename = os.path.join(barcode_dir, barcode_name + '.' + out_format)
-
-            if gzipped_out:
-                if not os.path.isfile(bin_filename):
-                    continue
-                bin_filename_gz = bin_filename + '.gz'
-                if os.path.isfile(bin_filename_gz):
-                    os.remove(bin_filename_gz)
-                try:
-                    subprocess.check_output(gzip_command + ' ' + bin_filename,
-                                            stderr=subprocess.STDOUT, shell=True)
-                except subprocess.CalledProcessError:
-                    pass
-                bin_filename = bin_filename_gz
-
-            table_row = [barcode_name, int_to_str(barcode_read_counts[barcode_name]),
-                         int_to_str(barcode_base_counts[barcode_name]), bin_filename]
-            table.append(table_row)
-
-        if verbosity > 0:
-            print('')
-            print_table(table, print_dest, alignments='LRRL', max_col_width=60, col_separation=2)
-
-    # Output to all reads to stdout.
-    elif output is None:
-        for read in reads:
-            read_str = read.get_fasta(min_split_size, discard_middle) if out_format == 'fasta' \
-                else read.get_fastq(min_split_size, discard_middle)
-            print(read_str, end='')
-        if verbosity > 0:
-            print('Done', flush=True, file=print_dest)
+                 untrimmed, threads, discard_unassigned, compression_level, bgzf, shard=None,
+                 chunk_reads=0, chunk_bases=0):
+    read_output = ReadOutput(out_format, output, read_type, verbosity, discard_middle,
+                             min_split_size, print_dest, barcode_dir, input_filename, untrimmed,
+                             threads, discard_unassigned, compression_level, bgzf, shard,
+                             chunk_reads, chunk_bases)
+    read_output.write(reads)
+    read_output.finish()
+
+
+def process_reads_in_batches(args, matching_sets, forward_or_reverse_barcodes, read_type,
+                             check_reads, process_pool=None):
+    """
+    The streaming (--batch_size) version of the read end trimming, middle splitting and output. The
+    input is read again from its start (except for stdin, see iterate_reads), one batch at a time,
+    and each batch goes through every step and is written out before the next is loaded. Only
+    totals are kept between batches, so memory use depends on the batch size and not on the input
+    size.
+    """
+    verbosity, print_dest = args.verbosity, args.print_dest
+    check_barcodes = (args.barcode_dir is not None)
+    if matching_sets:
+        display_read_end_adapters(matching_sets, verbosity, print_dest)
+    elif verbosity > 0:
+        print('No adapters found - output reads are unchanged from input reads\n',
+              file=print_dest)
 
-    # Output to all reads to file.
-    else:
-        if gzipped_out:
-            out_filename = 'TEMP_' + str(os.getpid()) + '.fastq'
-        else:
-            out_filename = output
-        with open(out_filename, 'wt') as out:
-            for read in reads:
-                read_str = read.get_fasta(min_split_size, discard_middle) if out_format == 'fasta' \
-                    else read.get_fastq(min_split_size, discard_middle)
-                out.write(read_str)
-        if gzipped_out:
-            subprocess.check_output(gzip_command + ' -c ' + out_filename + ' > ' + output,
-                                    stderr=subprocess.STDOUT, shell=True)
-            os.remove(out_filename)
-        if verbosity > 0:
-            print('\nSaved result to ' + os.path.abspath(output), file=print_dest)
+    read_output = ReadOutput(args.format, args.output, read_type, verbosity, args.discard_middle,
+                             args.min_split_read_size, print_dest, args.barcode_dir, args.input,
+                             args.untrimmed, args.threads, args.discard_unassigned,
+                             args.compression_level, args.bgzf, args.shard, args.chunk_reads,
+                             args.chunk_bases)
+    totals = Counter()
+    for reads in iterate_read_batches(args.input, args.batch_size, args.threads, check_reads,
+                                      args.shard):
+        if matching_sets:
+            find_adapters_at_read_ends(reads, matching_sets, verbosity, args.end_size,
+                                       args.extra_end_trim, args.end_threshold,
+                                       args.scoring_scheme_vals, print_dest, args.min_trim_size,
+                                       args.threads, check_barcodes, args.barcode_threshold,
+                                       args.barcode_diff, args.require_two_barcodes,
+                                       forward_or_reverse_barcodes, args.end_band, in_batches=True,
+                                       process_pool=process_pool)
+            if not args.no_split:
+                find_adapters_in_read_middles(reads, matching_sets, verbosity,
+                                              args.middle_threshold,
+                                              args.extra_middle_trim_good_side,
+                                              args.extra_middle_trim_bad_side,
+                                              args.scoring_scheme_vals, print_dest, args.threads,
+                                              args.discard_middle, in_batches=True,
+                                              process_pool=process_pool)
+        totals.update(count_trimmed_reads(reads))
+        read_output.write(reads)
+        if verbosity == 1:
+            print('\r' + int_to_str(totals['reads']) + ' reads processed', end='', flush=True,
+                  file=print_dest)
+    if verbosity == 1:
+        print('\n', file=print_dest)
 
-    if verbosity > 0:
-        print('', flush=True, file=print_dest)
+    if matching_sets:
+        display_read_end_trimming_summary(totals, verbosity, print_dest)
+        if not args.no_split:
+            display_read_middle_trimming_summary(totals, args.discard_middle, verbosity,
+                                                 print_dest)
+    read_output.finish()
 
 
 def output_progress_line(completed, total, print_dest, end_newline=False, step=10):
@@ -0,0 +1,169 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains the process pool used by --processes. The C++ searches release the GIL, but
+applying their results to the reads is Python, so with many cores one process can't keep up. The
+workers are separate processes instead, and the reads aren't pickled to get to them: each block of
+read sequences is put in shared memory once and a worker is only told which reads of which block
+to search. It sends back the C++ results as raw structs, which the main process applies to the
+reads. Shared memory needs Python 3.8 or later, so this module is only imported when --processes
+is used.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import itertools
+from array import array
+from ctypes import sizeof
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from .cpp_function_wrappers import trim_read_ends_batch, find_middle_adapters_batch, \
+    read_end_adapter_array, read_end_settings, set_alignment_engine, ReadEndResult, \
+    MiddleAdapterHit
+
+# Each shared memory block holds this many chunks of reads per worker process.
+CHUNKS_PER_PROCESS = 4
+
+
+class ReadProcessPool(object):
+    """
+    Worker processes for the read end and middle adapter searches. Each chunk of chunk_size reads
+    is one task, and both searches yield one list of results per chunk, in order, as they become
+    available. A block of reads is searched while the one before it is being handed back, so the
+    workers aren't left waiting.
+    """
+    def __init__(self, processes, aligner, chunk_size):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(max_workers=processes, initializer=start_worker,
+                                            initargs=(aligner,))
+
+    def close(self):
+        self.executor.shutdown()
+
+    def trim_read_ends(self, read_sequences, adapter_sets, barcode_count, settings):
+        """
+        The process pool version of trim_read_ends_batch. adapter_sets is described as for
+        read_end_adapter_array and settings as for read_end_settings.
+        """
+        for results in self.map_chunks(trim_read_ends_task, read_sequences, adapter_sets,
+                                       barcode_count, settings):
+            yield (ReadEndResult * (len(results) // sizeof(ReadEndResult))) \
+                .from_buffer_copy(results)
+
+    def find_middle_adapters(self, read_sequences, adapter_sequences, scoring_scheme_vals,
+                             middle_threshold):
+        """
+        The process pool version of find_middle_adapters_batch.
+        """
+        for hit_counts, hits in self.map_chunks(find_middle_adapters_task, read_sequences,
+                                                adapter_sequences, scoring_scheme_vals,
+                                                middle_threshold):
+            hit_counts = array('i', hit_counts)
+            hits = (MiddleAdapterHit * sum(hit_counts)).from_buffer_copy(hits)
+            hit_ends = itertools.accumulate(hit_counts)
+            yield [hits[end - count:end] for count, end in zip(hit_counts, hit_ends)]
+
+    def map_chunks(self, task, read_sequences, *task_args):
+        block_size = self.chunk_size * CHUNKS_PER_PROCESS * self.processes
+        pending = deque()
+        try:
+            for block_start in range(0, len(read_sequences), block_size):
+                block = SharedReadBlock(read_sequences[block_start:block_start + block_size])
+                futures = [self.executor.submit(task, block.descriptor, start,
+                                                min(start + self.chunk_size, block.read_count),
+                                                *task_args)
+                           for start in range(0, block.read_count, self.chunk_size)]
+                pending.append((block, futures))
+                if len(pending) > 1:
+                    yield from finish_block(*pending.popleft())
+            while pending:
+                yield from finish_block(*pending.popleft())
+        finally:
+            for block, futures in pending:
+                for future in futures:
+                    future.cancel()
+                block.free()
+
+
+def finish_block(block, futures):
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        block.free()
+
+
+class SharedReadBlock(object):
+    """
+    A block of read sequences in shared memory: an array of int64 offsets (one per read, plus the
+    end of the last) followed by the sequences, one after the other. Workers attach to it by name.
+    """
+    def __init__(self, read_sequences):
+        self.read_count = len(read_sequences)
+        offsets = array('q', itertools.accumulate((len(x) for x in read_sequences), initial=0))
+        offsets = offsets.tobytes()
+        sequences = ''.join(read_sequences).encode('ascii', 'replace')
+        self.memory = SharedMemory(create=True, size=max(len(offsets) + len(sequences), 1))
+        self.memory.buf[:len(offsets)] = offsets
+        self.memory.buf[len(offsets):len(offsets) + len(sequences)] = sequences
+        self.descriptor = (self.memory.name, self.read_count)
+
+    def free(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+
+class AttachedReadBlock(object):
+    """
+    A worker's view of a SharedReadBlock. sequences gives reads as (buffer, start, end) tuples,
+    which the C++ wrappers read in place.
+    """
+    def __init__(self, descriptor):
+        name, self.read_count = descriptor
+        self.memory = SharedMemory(name=name)
+        self.offsets = self.memory.buf[:8 * (self.read_count + 1)].cast('q')
+
+    def sequences(self, first, last):
+        buffer, sequences_start = self.memory.buf, 8 * (self.read_count + 1)
+        return [(buffer, sequences_start + self.offsets[i], sequences_start + self.offsets[i + 1])
+                for i in range(first, last)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.offsets.release()
+        self.memory.close()
+
+
+def start_worker(aligner):
+    set_alignment_engine(aligner)
+
+
+def trim_read_ends_task(descriptor, first, last, adapter_sets, barcode_count, settings):
+    with AttachedReadBlock(descriptor) as block:
+        results = trim_read_ends_batch(block.sequences(first, last),
+                                       read_end_adapter_array(adapter_sets), barcode_count,
+                                       read_end_settings(*settings), 1)
+        return bytes(results)
+
+
+def find_middle_adapters_task(descriptor, first, last, adapter_sequences, scoring_scheme_vals,
+                              middle_threshold):
+    with AttachedReadBlock(descriptor) as block:
+        all_hits = find_middle_adapters_batch(block.sequences(first, last), adapter_sequences,
+                                              scoring_scheme_vals, middle_threshold, 1)
+    hit_counts = array('i', (len(x) for x in all_hits))
+    hits = (MiddleAdapterHit * sum(hit_counts))(*itertools.chain.from_iterable(all_hits))
+    return hit_counts.tobytes(), bytes(hits)
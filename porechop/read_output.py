@@ -0,0 +1,351 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains the class which saves trimmed reads to a file, to barcode bins or to stdout.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import sys
+from collections import defaultdict
+from .bam import BamWriter, sam_header
+from .gzip_writer import GzipCompressor, ParallelGzipWriter, BgzfWriter
+from .misc import print_table, bold_underline, int_to_str, get_bam_header
+
+# Reads printed to stdout are joined into blocks of about this many characters, each written with
+# one call, which is much faster than printing the reads one at a time.
+STDOUT_BLOCK_SIZE = 1024 * 1024
+
+
+class ReadOutput(object):
+    """
+    Reads can be written in any number of batches (so they never all need to be in memory at once)
+    and the output is only complete once finish has been called.
+    """
+    def __init__(self, out_format, output, read_type, verbosity, discard_middle, min_split_size,
+                 print_dest, barcode_dir, input_filename, untrimmed, threads, discard_unassigned,
+                 compression_level, bgzf, shard=None, chunk_reads=0, chunk_bases=0):
+        self.output = output
+        self.verbosity = verbosity
+        self.discard_middle = discard_middle
+        self.min_split_size = min_split_size
+        self.print_dest = print_dest
+        self.barcode_dir = barcode_dir
+        self.untrimmed = untrimmed
+        self.discard_unassigned = discard_unassigned
+        self.bgzf = bgzf
+        self.shard = shard
+        self.chunk_reads = chunk_reads
+        self.chunk_bases = chunk_bases
+
+        if verbosity > 0:
+            trimmed_or_untrimmed = 'untrimmed' if untrimmed else 'trimmed'
+            if barcode_dir is not None:
+                verb = 'Saving '
+                destination = 'barcode-specific files'
+            elif output is None:
+                verb = 'Outputting '
+                destination = 'stdout'
+            else:
+                verb = 'Saving '
+                destination = 'file'
+            print(bold_underline(verb + trimmed_or_untrimmed + ' reads to ' + destination),
+                  flush=True, file=print_dest)
+
+        if out_format == 'auto':
+            if output is None:
+                out_format = read_type.lower()
+                if barcode_dir is not None and input_filename.lower().endswith('.gz'):
+                    out_format += '.gz'
+            elif '.fasta.gz' in output.lower():
+                out_format = 'fasta.gz'
+            elif '.fastq.gz' in output.lower():
+                out_format = 'fastq.gz'
+            elif '.fasta' in output.lower():
+                out_format = 'fasta'
+            elif '.fastq' in output.lower():
+                out_format = 'fastq'
+            elif output.lower().endswith('.bam'):
+                out_format = 'bam'
+            else:
+                out_format = read_type.lower()
+
+        # Gzipped and BAM output is compressed as it's written, using threads shared by all the
+        # files. BAM output keeps the input BAM's header, if there was one.
+        self.gzipped_out = False
+        if out_format.endswith('.gz') and (barcode_dir is not None or output is not None):
+            self.gzipped_out = True
+            out_format = out_format[:-3]
+        elif bgzf and out_format != 'bam':
+            sys.exit('Error: --bgzf can only be used with gzipped or BAM output')
+        self.out_format = out_format
+        self.gzip_compressor = None
+        if self.gzipped_out or out_format == 'bam':
+            self.gzip_compressor = GzipCompressor(max(threads, 1), compression_level)
+        if out_format == 'bam':
+            self.bam_header = sam_header(get_bam_header(input_filename))
+
+        # Barcode bin files are opened when their first read arrives.
+        if barcode_dir is not None:
+            if not os.path.isdir(barcode_dir):
+                os.makedirs(barcode_dir)
+            self.barcode_files = {}
+            self.barcode_read_counts = defaultdict(int)
+            self.barcode_base_counts = defaultdict(int)
+        elif output is not None:
+            self.out_file = self.open_file(output)
+        else:
+            sys.stdout.flush()
+            if out_format == 'bam':
+                self.out_file = BamWriter(sys.stdout.buffer, self.gzip_compressor, None,
+                                          self.bam_header)
+
+    def write(self, reads):
+        if self.barcode_dir is not None:
+            self.write_to_barcode_bins(reads)
+        elif self.output is None and self.out_format != 'bam':
+            self.write_to_stdout(reads)
+        else:
+            for read in reads:
+                read_out = self.format_read(read)
+                if read_out:
+                    self.write_formatted_read(self.out_file, read_out,
+                                              read.seq_length_with_start_end_adapters_trimmed())
+
+    def open_file(self, filename):
+        if self.chunk_reads or self.chunk_bases:
+            return ChunkedFile(filename, self.open_single_file, self.chunk_reads,
+                               self.chunk_bases)
+        return self.open_single_file(filename)
+
+    def open_single_file(self, filename):
+        if self.out_format == 'bam':
+            return BamWriter(filename, self.gzip_compressor,
+                             filename + '.idx' if self.bgzf else None, self.bam_header)
+        if self.bgzf:
+            return BgzfWriter(filename, self.gzip_compressor, filename + '.idx')
+        if self.gzipped_out:
+            return ParallelGzipWriter(filename, self.gzip_compressor)
+        return open(filename, 'wt')
+
+    def format_read(self, read, untrimmed=False):
+        """
+        Returns the read as text for FASTA/FASTQ or as (name, record) pairs for BAM. It's empty if
+        the read isn't output (e.g. it's split into parts which are all too short).
+        """
+        if self.out_format == 'fasta':
+            return read.get_fasta(self.min_split_size, self.discard_middle, untrimmed)
+        if self.out_format == 'bam':
+            return read.get_bam_records(self.min_split_size, self.discard_middle, untrimmed)
+        return read.get_fastq(self.min_split_size, self.discard_middle, untrimmed)
+
+    def write_formatted_read(self, out_file, read_out, base_count):
+        if self.out_format == 'bam':
+            self.write_bam_records(out_file, read_out)
+            record_count = len(read_out)
+        else:
+            self.write_read_string(out_file, read_out)
+            if self.out_format == 'fasta':
+                record_count = read_out.count('\n>') + 1
+            else:
+                record_count = read_out.count('\n') // 4
+        if self.chunk_reads or self.chunk_bases:
+            out_file.read_written(record_count, base_count)
+
+    def write_read_string(self, out_file, read_str):
+        """
+        BGZF output is written one record at a time (a split read has more than one), so each
+        record can be indexed by its read name.
+        """
+        if not self.bgzf:
+            out_file.write(read_str)
+            return
+        lines = read_str.split('\n')[:-1]
+        if self.out_format == 'fasta':
+            record_starts = [i for i, line in enumerate(lines) if line.startswith('>')]
+        else:
+            record_starts = list(range(0, len(lines), 4))
+        for start, end in zip(record_starts, record_starts[1:] + [len(lines)]):
+            out_file.index_read(lines[start][1:].split(None, 1)[0])
+            out_file.write('\n'.join(lines[start:end]) + '\n')
+
+    def write_bam_records(self, out_file, bam_records):
+        for read_name, bam_record in bam_records:
+            if self.bgzf:
+                out_file.index_read(read_name)
+            out_file.write_bytes(bam_record)
+
+    def write_to_stdout(self, reads):
+        block, block_size = [], 0
+        for read in reads:
+            read_str = self.format_read(read)
+            block.append(read_str)
+            block_size += len(read_str)
+            if block_size >= STDOUT_BLOCK_SIZE:
+                sys.stdout.buffer.write(''.join(block).encode())
+                block, block_size = [], 0
+        if block:
+            sys.stdout.buffer.write(''.join(block).encode())
+
+    def write_to_barcode_bins(self, reads):
+        for read in reads:
+            barcode_name = read.barcode_call
+            if self.discard_unassigned and barcode_name == 'none':
+                continue
+            read_out = self.format_read(read, self.untrimmed)
+            if not read_out:
+                continue
+            if barcode_name not in self.barcode_files:
+                self.barcode_files[barcode_name] = \
+                    self.open_file(self.barcode_bin_filename(barcode_name))
+            if self.untrimmed:
+                seq_length = len(read.seq)
+            else:
+                seq_length = read.seq_length_with_start_end_adapters_trimmed()
+            self.write_formatted_read(self.barcode_files[barcode_name], read_out, seq_length)
+            self.barcode_read_counts[barcode_name] += 1
+            self.barcode_base_counts[barcode_name] += seq_length
+
+    def finish(self):
+        """
+        Closes the output files (compressing them if necessary) and reports where the reads went.
+        """
+        if self.barcode_dir is not None:
+            self.finish_barcode_bins()
+        elif self.output is None:
+            if self.out_format == 'bam':
+                self.out_file.close()
+            sys.stdout.buffer.flush()
+            if self.verbosity > 0:
+                print('Done', flush=True, file=self.print_dest)
+        else:
+            self.out_file.close()
+            if self.verbosity > 0:
+                print('\nSaved result to ' + os.path.abspath(self.output_description(self.output)),
+                      file=self.print_dest)
+
+        if self.gzip_compressor is not None:
+            self.gzip_compressor.shutdown()
+        if self.verbosity > 0:
+            print('', flush=True, file=self.print_dest)
+
+    def barcode_bin_filename(self, barcode_name):
+        """
+        When the input is sharded, each shard's bins are named after the shard (e.g.
+        BC01.shard3of8.fastq.gz), so all of the shards can save their bins to the same directory.
+        """
+        if self.shard is not None:
+            barcode_name += '.shard' + str(self.shard[0]) + 'of' + str(self.shard[1])
+        bin_filename = os.path.join(self.barcode_dir, barcode_name + '.' + self.out_format)
+        if self.gzipped_out:
+            bin_filename += '.gz'
+        return bin_filename
+
+    def output_description(self, filename):
+        if self.chunk_reads or self.chunk_bases:
+            return chunk_filename(filename, '*')
+        return filename
+
+    def finish_barcode_bins(self):
+        table = [['Barcode', 'Reads', 'Bases', 'File']]
+
+        # Every bin's last block is handed over for compression before waiting on any of them, so
+        # the bins are compressed together instead of one after another.
+        for bin_file in self.barcode_files.values():
+            bin_file.flush()
+        for barcode_name in sorted(self.barcode_files.keys()):
+            self.barcode_files[barcode_name].close()
+            table_row = [barcode_name, int_to_str(self.barcode_read_counts[barcode_name]),
+                         int_to_str(self.barcode_base_counts[barcode_name]),
+                         self.output_description(self.barcode_bin_filename(barcode_name))]
+            table.append(table_row)
+
+        if self.verbosity > 0:
+            print('')
+            print_table(table, self.print_dest, alignments='LRRL', max_col_width=60,
+                        col_separation=2)
+
+
+class ChunkedFile(object):
+    """
+    An output file which is split into numbered chunks (e.g. reads.0001.fastq.gz), each of which is
+    finished when it reaches the read or base limit. Chunks are written under a temporary name (the
+    chunk's name plus .tmp) and renamed once they're complete, so other programs can start on a
+    chunk as soon as it appears and never see a partly written one.
+    """
+    def __init__(self, filename, open_file, chunk_reads, chunk_bases):
+        self.filename = filename
+        self.open_file = open_file
+        self.chunk_reads = chunk_reads
+        self.chunk_bases = chunk_bases
+        self.chunk_count = 0
+        self.file = None  # the chunk being written, opened when its first read is written
+
+    def current_file(self):
+        if self.file is None:
+            self.chunk_count += 1
+            self.read_count, self.base_count = 0, 0
+            self.file = self.open_file(self.temp_filename())
+        return self.file
+
+    def temp_filename(self):
+        return chunk_filename(self.filename, self.chunk_count) + '.tmp'
+
+    def write(self, text):
+        self.current_file().write(text)
+
+    def write_bytes(self, data):
+        self.current_file().write_bytes(data)
+
+    def index_read(self, read_name):
+        self.current_file().index_read(read_name)
+
+    def read_written(self, record_count, base_count):
+        """
+        Called after each read (which is more than one record if it was split), so chunks are only
+        ever ended between reads.
+        """
+        self.read_count += record_count
+        self.base_count += base_count
+        if (self.chunk_reads and self.read_count >= self.chunk_reads) or \
+                (self.chunk_bases and self.base_count >= self.chunk_bases):
+            self.close()
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        temp_filename = self.temp_filename()
+        final_filename = chunk_filename(self.filename, self.chunk_count)
+        if os.path.isfile(temp_filename + '.idx'):  # the index is published before its chunk
+            os.replace(temp_filename + '.idx', final_filename + '.idx')
+        os.replace(temp_filename, final_filename)
+
+
+def chunk_filename(filename, chunk_num):
+    """
+    Puts the chunk number before the read format extension: reads.fastq.gz -> reads.0001.fastq.gz
+    """
+    if isinstance(chunk_num, int):
+        chunk_num = '%04d' % chunk_num
+    directory, basename = os.path.split(filename)
+    extension = re.search(r'\.(fastq|fasta|fq|fa|bam)(\.gz)?$', basename, re.IGNORECASE)
+    if extension:
+        basename = basename[:extension.start()] + '.' + chunk_num + basename[extension.start():]
+    else:
+        basename += '.' + chunk_num
+    return os.path.join(directory, basename)
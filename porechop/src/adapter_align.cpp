@@ -8,37 +8,230 @@
 #include <utility>
 
 
-char * adapterAlignment(char * readSeq, char * adapterSeq,
-                        int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore) {
-    std::string output;
+static int alignmentEngine = STANDARD_ENGINE;
 
-    Dna5String sequenceH = readSeq;
-    Dna5String sequenceV = adapterSeq;
-    std::string readName = "";
-    std::string refName = "";
+static void wholeReadAlignment(Dna5String & readSeq, Dna5String & adapterSeq,
+                               Score<int, Simple> & scoringScheme, AlignmentThreshold * threshold,
+                               AlignmentResult * result);
+static void alignCandidates(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                            Score<int, Simple> & scoringScheme, AlignmentThreshold * thresholds,
+                            AlignmentResult * results);
+static void myersWindowAlignment(Dna5String & readSeq, Dna5String & adapterSeq,
+                                 Score<int, Simple> & scoringScheme, AlignmentThreshold * threshold,
+                                 AlignmentResult * result);
+
+
+// Sets the engine used for adapter alignments. The SIMD engine only changes batched alignments
+// (read ends) and the Myers engine only single alignments (searches through the whole read). If the
+// CPU doesn't support SIMD, the standard engine is used instead. Returns the engine which will be
+// used.
+int setAlignmentEngine(int engine) {
+    if (engine == SIMD_ENGINE && simdLaneCount() == 0)
+        engine = STANDARD_ENGINE;
+    alignmentEngine = engine;
+    return alignmentEngine;
+}
+
+
+// The adapter and scoring scheme are given as IDs from the adapter registry. If a threshold is
+// given, alignments which can't pass it are only scored (see couldPassThreshold).
+void adapterAlignment(char * readSeq, int readLength, int adapterId, int scoringSchemeId,
+                      AlignmentThreshold * threshold, AlignmentResult * result) {
+    Dna5String sequenceH = bufferSequence(readSeq, readLength);
+    wholeReadAlignment(sequenceH, getAdapter(adapterId), getScoringScheme(scoringSchemeId),
+                       threshold, result);
+}
+
+
+// Aligns one read sequence (usually the start or end of a read) to many adapters in a single call,
+// so the read sequence only has to be passed and converted once. The results array must have room
+// for adapterCount results and they are given in the same order as the adapters. The thresholds
+// array is either null or has one threshold per adapter.
+void adapterAlignmentBatch(char * readSeq, int readLength, int * adapterIds, int adapterCount,
+                           int scoringSchemeId, AlignmentThreshold * thresholds,
+                           AlignmentResult * results) {
+    Dna5String sequenceH = bufferSequence(readSeq, readLength);
+    std::vector<Dna5String *> adapterSeqs = getAdapters(adapterIds, adapterCount);
+    alignToAdapters(sequenceH, adapterSeqs, getScoringScheme(scoringSchemeId), thresholds,
+                    results);
+}
+
+
+// Finds every hit of the adapters in the read with a full adapter identity of at least
+// middleThreshold (see searchMiddleAdapters). The return value is the number of hits. If that is
+// more than maxHits, only the first maxHits hits are stored.
+int findMiddleAdapters(char * readSeq, int readLength, int * adapterIds, int adapterCount,
+                       int scoringSchemeId, double middleThreshold,
+                       MiddleAdapterHit * hits, int maxHits) {
+    Dna5String maskedSeq = bufferSequence(readSeq, readLength);
+    std::vector<Dna5String *> adapterSeqs = getAdapters(adapterIds, adapterCount);
+    return searchMiddleAdapters(maskedSeq, adapterSeqs, getScoringScheme(scoringSchemeId),
+                                middleThreshold, hits, maxHits);
+}
+
+
+// Converts length characters of a buffer (which needn't be null-terminated) to a sequence.
+Dna5String bufferSequence(char * buffer, int length) {
+    Dna5String sequence;
+    resize(sequence, length);
+    for (int i = 0; i < length; ++i)
+        sequence[i] = buffer[i];
+    return sequence;
+}
+
+
+// Looks up the registered adapters once, so callers which use them many times (possibly on many
+// threads) don't need to go through the registry each time.
+std::vector<Dna5String *> getAdapters(int * adapterIds, int adapterCount) {
+    std::vector<Dna5String *> adapterSeqs;
+    for (int i = 0; i < adapterCount; ++i)
+        adapterSeqs.push_back(&getAdapter(adapterIds[i]));
+    return adapterSeqs;
+}
+
+
+// Adapters which the q-gram screen shows can't pass their threshold get a failed result (with a
+// raw score of zero, as no score was worked out) and only the rest are aligned.
+void alignToAdapters(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                     Score<int, Simple> & scoringScheme, AlignmentThreshold * thresholds,
+                     AlignmentResult * results) {
+    std::vector<bool> candidates = screenAdapters(readSeq, adapterSeqs, thresholds);
+    if (std::find(candidates.begin(), candidates.end(), false) == candidates.end()) {
+        alignCandidates(readSeq, adapterSeqs, scoringScheme, thresholds, results);
+        return;
+    }
+    std::vector<Dna5String *> candidateSeqs;
+    std::vector<AlignmentThreshold> candidateThresholds;
+    for (size_t i = 0; i < adapterSeqs.size(); ++i) {
+        if (candidates[i]) {
+            candidateSeqs.push_back(adapterSeqs[i]);
+            candidateThresholds.push_back(thresholds[i]);
+        }
+        else
+            fillScoreOnlyResult(0, results + i);
+    }
+    if (candidateSeqs.empty())
+        return;
+    std::vector<AlignmentResult> candidateResults(candidateSeqs.size());
+    alignCandidates(readSeq, candidateSeqs, scoringScheme, candidateThresholds.data(),
+                    candidateResults.data());
+    for (size_t i = 0, j = 0; i < adapterSeqs.size(); ++i) {
+        if (candidates[i])
+            results[i] = candidateResults[j++];
+    }
+}
+
+
+static void alignCandidates(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                            Score<int, Simple> & scoringScheme, AlignmentThreshold * thresholds,
+                            AlignmentResult * results) {
+    if (alignmentEngine == SIMD_ENGINE &&
+            simdAdapterAlignment(readSeq, adapterSeqs, scoringScheme, thresholds, results))
+        return;
+    for (size_t i = 0; i < adapterSeqs.size(); ++i)
+        alignReadToAdapter(readSeq, *adapterSeqs[i], scoringScheme,
+                           thresholds ? thresholds + i : 0, results + i);
+}
+
+
+// Each adapter is aligned to the whole read repeatedly: after every hit, the hit region is masked
+// out (by replacing its bases with Ns) and the read is aligned again, until there are no more hits.
+// The masking carries over from one adapter to the next. The hits are stored in the order they are
+// found.
+int searchMiddleAdapters(Dna5String & maskedSeq, std::vector<Dna5String *> & adapterSeqs,
+                         Score<int, Simple> & scoringScheme, double middleThreshold,
+                         MiddleAdapterHit * hits, int maxHits) {
+    AlignmentThreshold threshold{middleThreshold, 101.0, 0};
+    int hitCount = 0;
+    for (size_t i = 0; i < adapterSeqs.size(); ++i) {
+        Dna5String & adapterSeq = *adapterSeqs[i];
+        while (true) {
+            AlignmentResult result;
+            wholeReadAlignment(maskedSeq, adapterSeq, scoringScheme, &threshold, &result);
+            if (result.readStartPos == -1 ||
+                    !(result.fullAdapterPercentIdentity >= middleThreshold))
+                break;
+            int readStart = result.readStartPos, readEnd = result.readEndPos + 1;
+            if (hitCount < maxHits)
+                hits[hitCount] = MiddleAdapterHit{int(i), readStart, readEnd,
+                                                  result.fullAdapterPercentIdentity};
+            ++hitCount;
+
+            // A hit which masks nothing would be found again forever, so that ends the search for
+            // this adapter.
+            if (readEnd <= readStart)
+                break;
+            for (int j = readStart; j < readEnd; ++j)
+                maskedSeq[j] = 'N';
+        }
+    }
+    return hitCount;
+}
+
+
+void alignReadToAdapter(Dna5String & readSeq, Dna5String & adapterSeq,
+                        Score<int, Simple> & scoringScheme, AlignmentThreshold * threshold,
+                        AlignmentResult * result) {
+    AlignConfig<true, true, true, true> alignConfig;
+
+    // The score alone is much cheaper than the full alignment, so that comes first when there's a
+    // threshold to check it against.
+    if (threshold != 0) {
+        int score = globalAlignmentScore(readSeq, adapterSeq, scoringScheme, alignConfig);
+        if (!couldPassThreshold(score, length(adapterSeq), scoringScheme, threshold)) {
+            fillScoreOnlyResult(score, result);
+            return;
+        }
+    }
 
     Align<Dna5String, ArrayGaps> alignment;
     resize(rows(alignment), 2);
-    assignSource(row(alignment, 0), sequenceH);
-    assignSource(row(alignment, 1), sequenceV);
-    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+    setSource(row(alignment, 0), readSeq);
+    setSource(row(alignment, 1), adapterSeq);
 
-    AlignConfig<true, true, true, true> alignConfig;
     int score = globalAlignment(alignment, scoringScheme, alignConfig);
 
     ScoredAlignment scoredAlignment(alignment, length(readSeq), length(adapterSeq), score);
-    return cppStringToCString(scoredAlignment.getString());
+    scoredAlignment.fillResult(result);
 }
 
 
-void freeCString(char * p) {
-    free(p);
+// Aligns an adapter to a whole read, which is where the Myers engine can help.
+static void wholeReadAlignment(Dna5String & readSeq, Dna5String & adapterSeq,
+                               Score<int, Simple> & scoringScheme, AlignmentThreshold * threshold,
+                               AlignmentResult * result) {
+    if (alignmentEngine == MYERS_ENGINE)
+        myersWindowAlignment(readSeq, adapterSeq, scoringScheme, threshold, result);
+    else
+        alignReadToAdapter(readSeq, adapterSeq, scoringScheme, threshold, result);
 }
 
 
-char * cppStringToCString(std::string cpp_string) {
-    char * c_string = (char*)malloc(sizeof(char) * (cpp_string.size() + 1));
-    std::copy(cpp_string.begin(), cpp_string.end(), c_string);
-    c_string[cpp_string.size()] = '\0';
-    return c_string;
+// Used by the Myers engine for single adapter alignments, which are searches through the whole
+// read. A bit-parallel search first finds where the adapter matches best and only the read region
+// around that location is aligned. The adapter's ends are free to hang off the edges of that
+// region, which isn't true inside the read, so if the alignment does that the whole read is aligned
+// instead.
+static void myersWindowAlignment(Dna5String & readSeq, Dna5String & adapterSeq,
+                                 Score<int, Simple> & scoringScheme, AlignmentThreshold * threshold,
+                                 AlignmentResult * result) {
+    int windowStart, windowEnd;
+    if (myersAlignmentWindow(readSeq, adapterSeq, windowStart, windowEnd)) {
+        Dna5String readWindow = infix(readSeq, windowStart, windowEnd);
+        alignReadToAdapter(readWindow, adapterSeq, scoringScheme, threshold, result);
+        if (result->readStartPos == -1)
+            return;
+        int lastAdapterPos = length(adapterSeq) - 1, lastWindowPos = windowEnd - windowStart - 1;
+        bool hangsOffStart = (windowStart > 0 && result->readStartPos == 0 &&
+                              result->adapterStartPos > 0);
+        bool hangsOffEnd = (windowEnd < int(length(readSeq)) &&
+                            result->readEndPos == lastWindowPos &&
+                            result->adapterEndPos < lastAdapterPos);
+        if (!hangsOffStart && !hangsOffEnd) {
+            result->readStartPos += windowStart;
+            result->readEndPos += windowStart;
+            return;
+        }
+    }
+    alignReadToAdapter(readSeq, adapterSeq, scoringScheme, threshold, result);
 }
@@ -0,0 +1,41 @@
+#include "adapter_registry.h"
+
+#include <vector>
+#include <memory>
+#include <mutex>
+
+
+// The registered objects are stored by pointer so references to them stay valid when more are
+// added. Alignments can run on many threads at once, so access to the vectors is locked.
+static std::vector<std::unique_ptr<Dna5String>> registeredAdapters;
+static std::vector<std::unique_ptr<Score<int, Simple>>> registeredScoringSchemes;
+static std::mutex registryMutex;
+
+
+int addAdapter(char * adapterSeq) {
+    std::unique_ptr<Dna5String> adapter(new Dna5String(adapterSeq));
+    std::lock_guard<std::mutex> lock(registryMutex);
+    registeredAdapters.push_back(std::move(adapter));
+    return int(registeredAdapters.size()) - 1;
+}
+
+
+int addScoringScheme(int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore) {
+    std::unique_ptr<Score<int, Simple>> scoringScheme(
+        new Score<int, Simple>(matchScore, mismatchScore, gapExtensionScore, gapOpenScore));
+    std::lock_guard<std::mutex> lock(registryMutex);
+    registeredScoringSchemes.push_back(std::move(scoringScheme));
+    return int(registeredScoringSchemes.size()) - 1;
+}
+
+
+Dna5String & getAdapter(int adapterId) {
+    std::lock_guard<std::mutex> lock(registryMutex);
+    return *registeredAdapters[adapterId];
+}
+
+
+Score<int, Simple> & getScoringScheme(int scoringSchemeId) {
+    std::lock_guard<std::mutex> lock(registryMutex);
+    return *registeredScoringSchemes[scoringSchemeId];
+}
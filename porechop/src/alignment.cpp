@@ -1,121 +1,147 @@
 
 #include "alignment.h"
 
-#include <iostream>
+#include <algorithm>
+#include <cstdlib>
 
 ScoredAlignment::ScoredAlignment(Align<Dna5String, ArrayGaps> & alignment,
                                  int readLength, int adapterLength, int score):
     m_readLength(readLength), m_adapterLength(adapterLength),
-    m_readStartPos(-1), m_adapterStartPos(-1), m_rawScore(score)
+    m_readStartPos(-1), m_readEndPos(-1), m_adapterStartPos(-1), m_adapterEndPos(-1),
+    m_rawScore(score), m_alignedRegionPercentIdentity(0.0), m_fullAdapterPercentIdentity(0.0)
 {
-    // Extract the alignment sequences into C++ strings for constant time random access.
-    std::ostringstream stream1;
-    stream1 << row(alignment, 0);
-    std::string readAlignment =  stream1.str();
-    std::ostringstream stream2;
-    stream2 << row(alignment, 1);
-    std::string adapterAlignment =  stream2.str();
-
-    int alignmentLength = std::max(readAlignment.size(), adapterAlignment.size());
-    if (alignmentLength == 0)
+    if (readLength == 0 || adapterLength == 0)
         return;
+    typedef Gaps<Dna5String, ArrayGaps> TRow;
+    TRow & readRow = row(alignment, 0);
+    TRow & adapterRow = row(alignment, 1);
 
+    // The first and last bases of each row are found from the gap structure, so the (possibly very
+    // long) free end gaps never need to be walked through.
+    AlignmentColumns columns;
+    columns.readFirst = toViewPosition(readRow, 0);
+    columns.readLast = toViewPosition(readRow, readLength - 1);
+    columns.adapterFirst = toViewPosition(adapterRow, 0);
+    columns.adapterLast = toViewPosition(adapterRow, adapterLength - 1);
+    columns.readLastHasAdapterBase = !isGap(adapterRow, columns.readLast);
+    columns.adapterLastHasReadBase = !isGap(readRow, columns.adapterLast);
 
-    // We consider the alignment to have started when we've encountered a base in both
-    // sequences (though not necessarily at the same time).
-    int alignmentStartPos = -1;
-    bool readStarted = false;
-    bool adapterStarted = false;
-    for (int i = 0; i < alignmentLength; ++i) {
-        if (readAlignment[i] != '-')
-            readStarted = true;
-        if (adapterAlignment[i] != '-')
-            adapterStarted = true;
-        if (readStarted && adapterStarted) {
-            alignmentStartPos = i;
-            break;
+    // Matches can only occur where both rows have started and not yet ended, so only those columns
+    // are compared.
+    columns.matchCount = 0;
+    int firstColumn = std::max(columns.readFirst, columns.adapterFirst);
+    int lastColumn = std::min(columns.readLast, columns.adapterLast);
+    if (firstColumn <= lastColumn) {
+        Iterator<TRow, Standard>::Type readIt = iter(readRow, firstColumn, Standard());
+        Iterator<TRow, Standard>::Type adapterIt = iter(adapterRow, firstColumn, Standard());
+        for (int i = firstColumn; i <= lastColumn; ++i, ++readIt, ++adapterIt) {
+            if (!isGap(readIt) && !isGap(adapterIt) && *readIt == *adapterIt)
+                ++columns.matchCount;
         }
     }
+    scoreColumns(columns);
+}
 
-    // We use the same logic to see when the alignment has ended.
-    int alignmentEndPos = -1;
-    bool readEnded = false;
-    bool adapterEnded = false;
-    for (int i = alignmentLength - 1; i >= 0; --i) {
-        if (readAlignment[i] != '-')
-            readEnded = true;
-        if (adapterAlignment[i] != '-')
-            adapterEnded = true;
-        if (readEnded && adapterEnded) {
-            alignmentEndPos = i;
-            break;
-        }
-    }
+// This constructor is for alignments which weren't made by SeqAn (e.g. the SIMD aligner), where the
+// columns were summarised during the traceback.
+ScoredAlignment::ScoredAlignment(AlignmentColumns & columns, int readLength, int adapterLength,
+                                 int score):
+    m_readLength(readLength), m_adapterLength(adapterLength),
+    m_readStartPos(-1), m_readEndPos(-1), m_adapterStartPos(-1), m_adapterEndPos(-1),
+    m_rawScore(score), m_alignedRegionPercentIdentity(0.0), m_fullAdapterPercentIdentity(0.0)
+{
+    scoreColumns(columns);
+}
 
-    if (alignmentStartPos == -1 || alignmentEndPos == -1)
+void ScoredAlignment::scoreColumns(AlignmentColumns & columns) {
+    if (columns.readFirst == -1 || columns.adapterFirst == -1)
         return;
 
-    // We also determine the start and end of the adapter in the alignment.
-    int adapterAlignmentStartPos = -1;
-    for (int i = 0; i < alignmentLength; ++i) {
-        if (adapterAlignment[i] != '-') {
-            adapterAlignmentStartPos = i;
-            break;
-        }
-    }
-    int adapterAlignmentEndPos = -1;
-    for (int i = alignmentLength - 1; i >= 0; --i) {
-        if (adapterAlignment[i] != '-') {
-            adapterAlignmentEndPos = i;
-            break;
-        }
-    }
+    // We consider the alignment to have started when we've encountered a base in both sequences
+    // (though not necessarily at the same time) and use the same logic to see when it has ended.
+    int alignmentStartPos = std::max(columns.readFirst, columns.adapterFirst);
+    int alignmentEndPos = std::min(columns.readLast, columns.adapterLast);
 
     // Now get the percent identity of the alignment using both the full alignment range and the
-    // adapter alignment range.
-    int alignedMatchCount = 0;
-    for (int i = alignmentStartPos; i < alignmentEndPos+1; ++i) {
-        if (adapterAlignment[i] == readAlignment[i])
-            ++alignedMatchCount;
-    }
+    // adapter alignment range. No column outside of either range can be a match.
     int alignedRegionLength = alignmentEndPos - alignmentStartPos + 1;
-    m_alignedRegionPercentIdentity = 100.0 * alignedMatchCount / alignedRegionLength;
+    m_alignedRegionPercentIdentity = 100.0 * columns.matchCount / alignedRegionLength;
+    int fullAdapterLength = columns.adapterLast - columns.adapterFirst + 1;
+    m_fullAdapterPercentIdentity = 100.0 * columns.matchCount / fullAdapterLength;
 
-    int fullAdapterMatchCount = 0;
-    for (int i = adapterAlignmentStartPos; i < adapterAlignmentEndPos+1; ++i) {
-        if (adapterAlignment[i] == readAlignment[i])
-            ++fullAdapterMatchCount;
-    }
-    int fullAdapterLength = adapterAlignmentEndPos - adapterAlignmentStartPos + 1;
-    m_fullAdapterPercentIdentity = 100.0 * fullAdapterMatchCount / fullAdapterLength;
+    // Every column has a base in at least one of the rows. So before one row starts (or after it
+    // ends), each column holds a base of the other row, which lets the positions be counted without
+    // looking at those columns.
+    m_readStartPos = std::max(0, columns.adapterFirst - columns.readFirst);
+    m_adapterStartPos = std::max(0, columns.readFirst - columns.adapterFirst);
+    if (alignmentEndPos == columns.readLast)
+        m_readEndPos = m_readLength - 1;
+    else
+        m_readEndPos = m_readLength - (columns.readLast - columns.adapterLast) -
+                       (columns.adapterLastHasReadBase ? 1 : 0);
+    if (alignmentEndPos == columns.adapterLast)
+        m_adapterEndPos = m_adapterLength - 1;
+    else
+        m_adapterEndPos = m_adapterLength - (columns.adapterLast - columns.readLast) -
+                          (columns.readLastHasAdapterBase ? 1 : 0);
+}
 
-    int readBases = 0, adapterBases = 0;
-    for (int i = 0; i < alignmentLength; ++i) {
-        char base1 = readAlignment[i];
-        char base2 = adapterAlignment[i];
+void ScoredAlignment::fillResult(AlignmentResult * result) {
+    result->readStartPos = m_readStartPos;
+    result->readEndPos = m_readEndPos;
+    result->adapterStartPos = m_adapterStartPos;
+    result->adapterEndPos = m_adapterEndPos;
+    result->rawScore = m_rawScore;
+    result->alignedRegionPercentIdentity = m_alignedRegionPercentIdentity;
+    result->fullAdapterPercentIdentity = m_fullAdapterPercentIdentity;
+}
 
-        if (i == alignmentStartPos) {
-            m_readStartPos = readBases;
-            m_adapterStartPos = adapterBases;
-        }
-        if (i == alignmentEndPos) {
-            m_readEndPos = readBases;
-            m_adapterEndPos = adapterBases;
-        }
 
-        if (base1 != '-')
-            ++readBases;
-        if (base2 != '-')
-            ++adapterBases;
+// Decides from the alignment score alone whether an alignment could pass the threshold, so the
+// traceback can be skipped for the many alignments which can't. Every alignment column in the
+// scored region is either a match (worth the match score) or costs at most c, the largest of the
+// mismatch and gap penalties. So a region of length L with identity t scores at least
+// L * (t * (match + c) - c). The full adapter region is at least as long as the adapter and the
+// aligned region is at least minAlignedRegionLength long, which gives the smallest score each
+// identity needs. A threshold over 100% means the caller isn't interested in that identity and a
+// null threshold means every alignment is wanted.
+bool couldPassThreshold(int score, int adapterLength, Score<int, Simple> & scoringScheme,
+                        AlignmentThreshold * threshold) {
+    if (threshold == 0)
+        return true;
+    double match = scoreMatch(scoringScheme);
+    double c = std::max({std::abs(scoreMismatch(scoringScheme)),
+                         std::abs(scoreGapOpen(scoringScheme)),
+                         std::abs(scoreGapExtend(scoringScheme))});
+    if (match + c <= 0.0)
+        return true;
+
+    // A little slack keeps rounding in the percent identities from pruning a borderline hit.
+    const double slack = 1e-6;
+
+    if (threshold->fullAdapterPercentIdentity <= 100.0) {
+        double perBase = threshold->fullAdapterPercentIdentity / 100.0 * (match + c) - c;
+        if (perBase <= 0.0 || score >= adapterLength * perBase - slack)
+            return true;
     }
+    if (threshold->alignedRegionPercentIdentity <= 100.0) {
+        double perBase = threshold->alignedRegionPercentIdentity / 100.0 * (match + c) - c;
+        int minLength = std::max(threshold->minAlignedRegionLength, 1);
+        if (perBase <= 0.0 || score > minLength * perBase - slack)
+            return true;
+    }
+    return false;
 }
 
-std::string ScoredAlignment::getString() {
-    return std::to_string(m_readStartPos) + "," + 
-           std::to_string(m_readEndPos) + "," + 
-           std::to_string(m_adapterStartPos) + "," + 
-           std::to_string(m_adapterEndPos) + "," + 
-           std::to_string(m_rawScore) + "," +
-           std::to_string(m_alignedRegionPercentIdentity) + "," +
-           std::to_string(m_fullAdapterPercentIdentity);
+
+// Fills in the result for an alignment which was only scored: there are no coordinates or
+// identities, just like an alignment which failed.
+void fillScoreOnlyResult(int score, AlignmentResult * result) {
+    result->readStartPos = -1;
+    result->readEndPos = -1;
+    result->adapterStartPos = -1;
+    result->adapterEndPos = -1;
+    result->rawScore = score;
+    result->alignedRegionPercentIdentity = 0.0;
+    result->fullAdapterPercentIdentity = 0.0;
 }
@@ -0,0 +1,140 @@
+#include "anchored_align.h"
+
+#include <algorithm>
+#include <limits>
+
+
+static int anchoredWindowLength(Dna5String & readSeq, Dna5String & adapterSeq,
+                                Score<int, Simple> & scoringScheme, bool atReadEnd, int band);
+static Dna5String readEndWindow(Dna5String & readSeq, bool atReadEnd, int windowLength);
+static bool hangsOffWindow(AlignmentResult * result, int adapterLength, bool atReadEnd,
+                           int windowLength);
+
+
+// The read sequence and adapters are given as for adapterAlignmentBatch. If atReadEnd is true, the
+// adapters are anchored at the read sequence's last base, otherwise at its first base.
+void anchoredAdapterAlignmentBatch(char * readSeq, int readLength, int * adapterIds,
+                                   int adapterCount, int scoringSchemeId,
+                                   AlignmentThreshold * thresholds, int atReadEnd, int band,
+                                   AlignmentResult * results) {
+    Dna5String sequenceH = bufferSequence(readSeq, readLength);
+    std::vector<Dna5String *> adapterSeqs = getAdapters(adapterIds, adapterCount);
+    alignToReadEnd(sequenceH, adapterSeqs, getScoringScheme(scoringSchemeId), thresholds,
+                   atReadEnd != 0, band, results);
+}
+
+
+// Like alignToAdapters, but the adapters are only aligned to the window next to the read end which
+// the anchored alignments need (the largest of any adapter, so they can all be aligned together).
+// The adapters can hang off the window's inner edge for free, which they couldn't do in the whole
+// sequence, so any alignment which does that is redone with a window twice the size (any window at
+// least as big as needed gives the same anchored result), until it doesn't or the window is the
+// whole sequence. A band of zero (or less) turns anchoring off.
+void alignToReadEnd(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                    Score<int, Simple> & scoringScheme, AlignmentThreshold * thresholds,
+                    bool atReadEnd, int band, AlignmentResult * results) {
+    int readLength = length(readSeq), windowLength = 0;
+    if (band > 0) {
+        for (size_t i = 0; i < adapterSeqs.size() && windowLength < readLength; ++i)
+            windowLength = std::max(windowLength, anchoredWindowLength(readSeq, *adapterSeqs[i],
+                                                                       scoringScheme, atReadEnd,
+                                                                       band));
+    }
+    if (band <= 0 || windowLength >= readLength) {
+        alignToAdapters(readSeq, adapterSeqs, scoringScheme, thresholds, results);
+        return;
+    }
+
+    Dna5String readWindow = readEndWindow(readSeq, atReadEnd, windowLength);
+    alignToAdapters(readWindow, adapterSeqs, scoringScheme, thresholds, results);
+    for (size_t i = 0; i < adapterSeqs.size(); ++i) {
+        AlignmentResult * result = results + i;
+        int adapterWindowLength = windowLength;
+        while (hangsOffWindow(result, length(*adapterSeqs[i]), atReadEnd, adapterWindowLength)) {
+            adapterWindowLength = std::min(2 * adapterWindowLength, readLength);
+            if (adapterWindowLength == readLength) {
+                alignReadToAdapter(readSeq, *adapterSeqs[i], scoringScheme,
+                                   thresholds ? thresholds + i : 0, result);
+                break;
+            }
+            Dna5String biggerWindow = readEndWindow(readSeq, atReadEnd, adapterWindowLength);
+            alignReadToAdapter(biggerWindow, *adapterSeqs[i], scoringScheme,
+                               thresholds ? thresholds + i : 0, result);
+        }
+        if (result->readStartPos != -1 && atReadEnd && adapterWindowLength < readLength) {
+            result->readStartPos += readLength - adapterWindowLength;
+            result->readEndPos += readLength - adapterWindowLength;
+        }
+    }
+}
+
+
+static Dna5String readEndWindow(Dna5String & readSeq, bool atReadEnd, int windowLength) {
+    int readLength = length(readSeq);
+    if (atReadEnd)
+        return infix(readSeq, readLength - windowLength, readLength);
+    return prefix(readSeq, windowLength);
+}
+
+
+// Whether an alignment to a read end window hangs off the window's inner edge: off its start for
+// the read end or off its end for the read start.
+static bool hangsOffWindow(AlignmentResult * result, int adapterLength, bool atReadEnd,
+                           int windowLength) {
+    if (result->readStartPos == -1)
+        return false;
+    if (atReadEnd)
+        return result->readStartPos == 0 && result->adapterStartPos > 0;
+    return result->readEndPos == windowLength - 1 && result->adapterEndPos < adapterLength - 1;
+}
+
+
+// Works out how many bases next to the terminus an anchored alignment needs. This runs the
+// alignment's score-only DP outwards from the terminus (reversing both sequences for the read end),
+// with alignments only allowed to start in the first band columns. After the band, every path
+// through a column can at best gain the match score for each of its remaining adapter bases, so
+// once that can't reach the best complete adapter alignment already seen, no anchored alignment
+// needs the bases beyond the column (an X-drop with the drop worked out from the scores). Returns
+// the read length if the whole read is needed.
+static int anchoredWindowLength(Dna5String & readSeq, Dna5String & adapterSeq,
+                                Score<int, Simple> & scoringScheme, bool atReadEnd, int band) {
+    int readLength = length(readSeq), adapterLength = length(adapterSeq);
+    int match = scoreMatch(scoringScheme), mismatch = scoreMismatch(scoringScheme);
+    int gapOpen = scoreGapOpen(scoringScheme), gapExtend = scoreGapExtend(scoringScheme);
+
+    // The bound relies on gaps never adding to the score.
+    if (band >= readLength || adapterLength == 0 || gapOpen > 0 || gapExtend > 0)
+        return readLength;
+    int bestStep = std::max({match, mismatch, 0});
+
+    const int negativeInfinity = std::numeric_limits<int>::min() / 4;
+    auto readBase = [&](int j) {
+        return atReadEnd ? readSeq[readLength - j] : readSeq[j - 1];
+    };
+    auto adapterBase = [&](int i) {
+        return atReadEnd ? adapterSeq[adapterLength - i] : adapterSeq[i - 1];
+    };
+
+    // h and e hold the previous column until they are overwritten with the current one. The first
+    // column is all zero, as the adapter can start before the read does.
+    std::vector<int> h(adapterLength + 1, 0), e(adapterLength + 1, negativeInfinity);
+    int bestScore = 0;
+    for (int j = 1; j <= readLength; ++j) {
+        int hDiagonal = h[0];
+        h[0] = (j <= band) ? 0 : negativeInfinity;
+        int f = negativeInfinity;
+        int bestPossible = negativeInfinity;
+        for (int i = 1; i <= adapterLength; ++i) {
+            e[i] = std::max(e[i] + gapExtend, h[i] + gapOpen);
+            f = std::max(f + gapExtend, h[i - 1] + gapOpen);
+            int diagonal = hDiagonal + (readBase(j) == adapterBase(i) ? match : mismatch);
+            hDiagonal = h[i];
+            h[i] = std::max({diagonal, e[i], f});
+            bestPossible = std::max(bestPossible, h[i] + (adapterLength - i) * bestStep);
+        }
+        bestScore = std::max(bestScore, h[adapterLength]);
+        if (j > band && bestPossible < bestScore)
+            return j;
+    }
+    return readLength;
+}
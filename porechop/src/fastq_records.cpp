@@ -0,0 +1,43 @@
+#include "fastq_records.h"
+
+#include <cstring>
+
+
+static bool isWhitespace(char c);
+
+
+int findFastqRecords(char * buffer, int length, int * lineBounds, int maxRecords,
+                     int * consumed) {
+    int recordCount = 0, position = 0;
+    int bounds[8];
+    *consumed = 0;
+    while (recordCount < maxRecords) {
+        int line = 0;
+        for (; line < 4; ++line) {
+            char * newline = static_cast<char *>(memchr(buffer + position, '\n',
+                                                        length - position));
+            if (newline == 0)
+                break;
+            int start = position, end = int(newline - buffer);
+            position = end + 1;
+            while (start < end && isWhitespace(buffer[start]))
+                ++start;
+            while (end > start && isWhitespace(buffer[end - 1]))
+                --end;
+            bounds[2 * line] = start;
+            bounds[2 * line + 1] = end;
+        }
+        if (line < 4)
+            break;
+        memcpy(lineBounds + 8 * recordCount, bounds, sizeof(bounds));
+        ++recordCount;
+        *consumed = position;
+    }
+    return recordCount;
+}
+
+
+// The ASCII characters which Python's str.strip removes.
+static bool isWhitespace(char c) {
+    return c == ' ' || (c >= '\t' && c <= '\r') || (c >= '\x1c' && c <= '\x1f');
+}
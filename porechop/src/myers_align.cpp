@@ -0,0 +1,42 @@
+#include "myers_align.h"
+
+#include <seqan/find.h>
+#include <algorithm>
+
+
+bool myersAlignmentWindow(Dna5String & readSeq, Dna5String & adapterSeq,
+                          int & windowStart, int & windowEnd) {
+    int readLength = length(readSeq), adapterLength = length(adapterSeq);
+    if (adapterLength == 0)
+        return false;
+
+    // The region must hold the whole adapter plus any insertions (at most one per edit), and a
+    // margin of one adapter length on each side lets the affine alignment settle somewhere a bit
+    // different from the edit distance one. If even the smallest possible region is more than
+    // half of the read, the search isn't worth it.
+    if (3 * adapterLength * 2 > readLength)
+        return false;
+
+    // The adapter must be matched in full but can end anywhere in the read. The score limit of
+    // minus the adapter length is met everywhere, so every end position is checked and the first
+    // one with the fewest edits is kept.
+    Finder<Dna5String> finder(readSeq);
+    Pattern<Dna5String, MyersUkkonen> pattern(adapterSeq);
+    int bestScore = -adapterLength - 1, bestEnd = -1;
+    while (find(finder, pattern, -adapterLength)) {
+        int score = getScore(pattern);
+        if (score > bestScore) {
+            bestScore = score;
+            bestEnd = position(finder) + 1;
+            if (score == 0)
+                break;
+        }
+    }
+    if (bestEnd == -1)
+        return false;
+
+    int edits = -bestScore;
+    windowStart = std::max(0, bestEnd - adapterLength - edits - adapterLength);
+    windowEnd = std::min(readLength, bestEnd + adapterLength);
+    return (windowEnd - windowStart) * 2 <= readLength;
+}
@@ -0,0 +1,131 @@
+#include "qgram_screen.h"
+
+#include <algorithm>
+#include <cstdint>
+#include <vector>
+
+
+// The q-gram lengths the screen can choose from. Each adapter gets whichever q gives it the most
+// selective screen (see chooseQ).
+const int MIN_Q = 3;
+const int MAX_Q = 8;
+
+static int allowedErrors(int adapterLength, double fullAdapterPercentIdentity);
+static int chooseQ(int adapterLength, int errors, int readLength);
+
+
+// Which q-grams occur in a read sequence, as a bit set over the 4^q possible q-grams (2 bits per
+// base). The sets are only built for the q values which are actually used. Q-grams which contain an
+// N aren't included, as no adapter q-gram can match them exactly.
+class ReadQGrams {
+public:
+    ReadQGrams(Dna5String & readSeq) : m_readSeq(readSeq), m_qGramSets(MAX_Q + 1) {}
+
+    bool contains(int q, uint32_t qGram) {
+        std::vector<uint64_t> & qGramSet = getSet(q);
+        return (qGramSet[qGram >> 6] >> (qGram & 63)) & 1;
+    }
+
+private:
+    std::vector<uint64_t> & getSet(int q) {
+        std::vector<uint64_t> & qGramSet = m_qGramSets[q];
+        if (qGramSet.empty()) {
+            qGramSet.resize(((uint32_t(1) << (2 * q)) + 63) / 64, 0);
+            uint32_t mask = (uint32_t(1) << (2 * q)) - 1, qGram = 0;
+            int run = 0;
+            for (size_t i = 0; i < length(m_readSeq); ++i) {
+                unsigned base = ordValue(m_readSeq[i]);
+                if (base > 3) {
+                    run = 0;
+                    continue;
+                }
+                qGram = ((qGram << 2) | base) & mask;
+                if (++run >= q)
+                    qGramSet[qGram >> 6] |= uint64_t(1) << (qGram & 63);
+            }
+        }
+        return qGramSet;
+    }
+
+    Dna5String & m_readSeq;
+    std::vector<std::vector<uint64_t> > m_qGramSets;
+};
+
+
+std::vector<bool> screenAdapters(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                                 AlignmentThreshold * thresholds) {
+    std::vector<bool> candidates(adapterSeqs.size(), true);
+    if (thresholds == 0)
+        return candidates;
+    ReadQGrams readQGrams(readSeq);
+    for (size_t i = 0; i < adapterSeqs.size(); ++i) {
+        AlignmentThreshold & threshold = thresholds[i];
+        if (threshold.alignedRegionPercentIdentity <= 100.0)
+            continue;
+
+        // A caller which isn't interested in either identity doesn't need the alignment at all.
+        if (threshold.fullAdapterPercentIdentity > 100.0) {
+            candidates[i] = false;
+            continue;
+        }
+        Dna5String & adapterSeq = *adapterSeqs[i];
+        int adapterLength = length(adapterSeq);
+        int errors = allowedErrors(adapterLength, threshold.fullAdapterPercentIdentity);
+        if (errors < 0)
+            continue;
+        int q = chooseQ(adapterLength, errors, length(readSeq));
+        if (q == 0)
+            continue;
+        int needed = adapterLength - q + 1 - q * errors;
+
+        // Adapter q-grams with an N are counted as shared, as an N can match an N in the read.
+        uint32_t mask = (uint32_t(1) << (2 * q)) - 1, qGram = 0;
+        int run = 0, shared = 0;
+        for (int j = 0; j < adapterLength && shared < needed; ++j) {
+            unsigned base = ordValue(adapterSeq[j]);
+            if (base > 3) {
+                run = 0;
+                qGram = 0;
+            }
+            else {
+                qGram = ((qGram << 2) | base) & mask;
+                ++run;
+            }
+            if (j >= q - 1 && (run < q || readQGrams.contains(q, qGram)))
+                ++shared;
+        }
+        candidates[i] = shared >= needed;
+    }
+    return candidates;
+}
+
+
+// The most columns which aren't matches that an alignment meeting the full adapter identity can
+// have, or -1 if there's no limit. A little slack keeps rounding from rejecting a borderline hit.
+static int allowedErrors(int adapterLength, double fullAdapterPercentIdentity) {
+    if (fullAdapterPercentIdentity <= 0.0)
+        return -1;
+    return int(adapterLength * (100.0 - fullAdapterPercentIdentity) / fullAdapterPercentIdentity +
+               1e-6);
+}
+
+
+// Picks the q which leaves the biggest margin between the q-grams an adapter needs to share and
+// the number a random read sequence would share by chance. Returns 0 if no q can screen the adapter.
+static int chooseQ(int adapterLength, int errors, int readLength) {
+    int bestQ = 0;
+    double bestMargin = 0.0;
+    for (int q = MIN_Q; q <= MAX_Q; ++q) {
+        int needed = adapterLength - q + 1 - q * errors;
+        if (needed <= 0)
+            continue;
+        int readQGramCount = std::max(readLength - q + 1, 0);
+        double chance = std::min(1.0, readQGramCount / double(uint32_t(1) << (2 * q)));
+        double margin = needed - (adapterLength - q + 1) * chance;
+        if (bestQ == 0 || margin > bestMargin) {
+            bestQ = q;
+            bestMargin = margin;
+        }
+    }
+    return bestQ;
+}
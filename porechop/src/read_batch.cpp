@@ -0,0 +1,176 @@
+#include "read_batch.h"
+
+#include <algorithm>
+#include <atomic>
+#include <functional>
+#include <thread>
+#include <vector>
+
+
+// Calls work(i) for every i from 0 to itemCount - 1, spread over up to threadCount threads. Items
+// are handed out one at a time, so a few slow reads (e.g. very long ones) don't hold up a thread
+// with lots of others still waiting.
+static void runOnThreads(int itemCount, int threadCount, std::function<void(int)> work) {
+    threadCount = std::max(1, std::min(threadCount, itemCount));
+    std::atomic<int> nextItem(0);
+    auto worker = [&]() {
+        for (int i = nextItem++; i < itemCount; i = nextItem++)
+            work(i);
+    };
+    std::vector<std::thread> threads;
+    for (int t = 1; t < threadCount; ++t)
+        threads.emplace_back(worker);
+    worker();
+    for (auto & thread : threads)
+        thread.join();
+}
+
+
+// Keeps track of the best and second-best barcodes at one read end. Barcodes must be added in
+// index order, and a barcode only beats an earlier one with a strictly higher score.
+struct BarcodeRanking {
+    int best = -1;
+    double bestScore = 0.0;
+    int secondBest = -1;
+    double secondBestScore = 0.0;
+
+    void add(int barcode, double score) {
+        if (best == -1 || score > bestScore) {
+            secondBest = best;
+            secondBestScore = bestScore;
+            best = barcode;
+            bestScore = score;
+        }
+        else if (secondBest == -1 || score > secondBestScore) {
+            secondBest = barcode;
+            secondBestScore = score;
+        }
+    }
+};
+
+
+// Ranks the barcode scores at one read end. A barcode which appears more than once keeps its last
+// score, as only the barcode's final score should be ranked.
+static BarcodeRanking rankBarcodes(std::vector<double> & scores, std::vector<bool> & present) {
+    BarcodeRanking ranking;
+    for (size_t i = 0; i < scores.size(); ++i) {
+        if (present[i])
+            ranking.add(i, scores[i]);
+    }
+    return ranking;
+}
+
+
+// Does the same as NanoporeRead's find_start_trim and find_end_trim (and their barcode scoring) for
+// each read.
+void trimReadEndsBatch(char ** sequences, int * lengths, int readCount,
+                       ReadEndAdapter * adapters, int adapterCount, int barcodeCount,
+                       ReadEndSettings * settings, int threadCount, ReadEndResult * results) {
+    Score<int, Simple> & scoringScheme = getScoringScheme(settings->scoringSchemeId);
+
+    // The adapters and thresholds are the same for every read, so they are prepared once. Only
+    // adapter sets with an end adapter are aligned to the read ends.
+    std::vector<int> startAdapterIds, endAdapterIds, startBarcodes, endBarcodes;
+    std::vector<AlignmentThreshold> startThresholds, endThresholds;
+    for (int i = 0; i < adapterCount; ++i) {
+        double barcodeThreshold = (adapters[i].barcodeIndex == -1) ?
+                                  101.0 : settings->barcodeSearchThreshold;
+        AlignmentThreshold threshold{barcodeThreshold, settings->endThreshold,
+                                     settings->minTrimSize};
+        startAdapterIds.push_back(adapters[i].startAdapterId);
+        startBarcodes.push_back(adapters[i].barcodeIndex);
+        startThresholds.push_back(threshold);
+        if (adapters[i].endAdapterId != -1) {
+            endAdapterIds.push_back(adapters[i].endAdapterId);
+            endBarcodes.push_back(adapters[i].barcodeIndex);
+            endThresholds.push_back(threshold);
+        }
+    }
+    std::vector<Dna5String *> startAdapters = getAdapters(startAdapterIds.data(),
+                                                          startAdapterIds.size());
+    std::vector<Dna5String *> endAdapters = getAdapters(endAdapterIds.data(),
+                                                        endAdapterIds.size());
+
+    runOnThreads(readCount, threadCount, [&](int r) {
+        ReadEndResult & result = results[r];
+        result.startTrimAmount = 0;
+        result.endTrimAmount = 0;
+        std::vector<double> barcodeScores(barcodeCount);
+        std::vector<bool> barcodePresent(barcodeCount);
+
+        // The read ends are taken like Python's seq[:end_size] and seq[-end_size:].
+        int readLength = lengths[r];
+        int startLength = std::min(settings->endSize, readLength);
+        int endLength = (settings->endSize == 0) ? readLength : startLength;
+        Dna5String readStart = bufferSequence(sequences[r], startLength);
+        std::vector<AlignmentResult> alignments(startAdapters.size());
+        alignToReadEnd(readStart, startAdapters, scoringScheme, startThresholds.data(), false,
+                       settings->endBand, alignments.data());
+        for (size_t i = 0; i < alignments.size(); ++i) {
+            AlignmentResult & a = alignments[i];
+            bool aligned = (a.readStartPos != -1);
+            int readEnd = aligned ? a.readEndPos + 1 : 0;
+            double partialScore = aligned ? a.alignedRegionPercentIdentity : 0.0;
+            double fullScore = aligned ? a.fullAdapterPercentIdentity : 0.0;
+            if (partialScore > settings->endThreshold && readEnd != settings->endSize &&
+                    readEnd - a.readStartPos >= settings->minTrimSize)
+                result.startTrimAmount = std::max(result.startTrimAmount,
+                                                  readEnd + settings->extraTrimSize);
+            if (startBarcodes[i] != -1) {
+                barcodeScores[startBarcodes[i]] = fullScore;
+                barcodePresent[startBarcodes[i]] = true;
+            }
+        }
+        BarcodeRanking startRanking = rankBarcodes(barcodeScores, barcodePresent);
+
+        std::fill(barcodePresent.begin(), barcodePresent.end(), false);
+        Dna5String readEndSeq = bufferSequence(sequences[r] + readLength - endLength, endLength);
+        alignments.resize(endAdapters.size());
+        alignToReadEnd(readEndSeq, endAdapters, scoringScheme, endThresholds.data(), true,
+                       settings->endBand, alignments.data());
+        for (size_t i = 0; i < alignments.size(); ++i) {
+            AlignmentResult & a = alignments[i];
+            bool aligned = (a.readStartPos != -1);
+            int readEnd = aligned ? a.readEndPos + 1 : 0;
+            double partialScore = aligned ? a.alignedRegionPercentIdentity : 0.0;
+            double fullScore = aligned ? a.fullAdapterPercentIdentity : 0.0;
+            if (partialScore > settings->endThreshold && a.readStartPos != 0 &&
+                    readEnd - a.readStartPos >= settings->minTrimSize)
+                result.endTrimAmount = std::max(result.endTrimAmount,
+                                                settings->endSize - a.readStartPos +
+                                                settings->extraTrimSize);
+            if (endBarcodes[i] != -1) {
+                barcodeScores[endBarcodes[i]] = fullScore;
+                barcodePresent[endBarcodes[i]] = true;
+            }
+        }
+        BarcodeRanking endRanking = rankBarcodes(barcodeScores, barcodePresent);
+
+        result.bestStartBarcode = startRanking.best;
+        result.bestStartBarcodeScore = startRanking.bestScore;
+        result.secondBestStartBarcode = startRanking.secondBest;
+        result.secondBestStartBarcodeScore = startRanking.secondBestScore;
+        result.bestEndBarcode = endRanking.best;
+        result.bestEndBarcodeScore = endRanking.bestScore;
+        result.secondBestEndBarcode = endRanking.secondBest;
+        result.secondBestEndBarcodeScore = endRanking.secondBestScore;
+    });
+}
+
+
+// Does the same as findMiddleAdapters for each read. Each read has room for maxHitsPerRead hits in
+// the hits array and its number of hits is stored in hitCounts. If that is more than
+// maxHitsPerRead, only the first maxHitsPerRead hits are stored.
+void findMiddleAdaptersBatch(char ** sequences, int * lengths, int readCount,
+                             int * adapterIds, int adapterCount, int scoringSchemeId,
+                             double middleThreshold, int threadCount,
+                             MiddleAdapterHit * hits, int maxHitsPerRead, int * hitCounts) {
+    Score<int, Simple> & scoringScheme = getScoringScheme(scoringSchemeId);
+    std::vector<Dna5String *> adapterSeqs = getAdapters(adapterIds, adapterCount);
+    runOnThreads(readCount, threadCount, [&](int r) {
+        Dna5String maskedSeq = bufferSequence(sequences[r], lengths[r]);
+        hitCounts[r] = searchMiddleAdapters(maskedSeq, adapterSeqs, scoringScheme,
+                                            middleThreshold, hits + size_t(r) * maxHitsPerRead,
+                                            maxHitsPerRead);
+    });
+}
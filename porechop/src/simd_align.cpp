@@ -0,0 +1,283 @@
+#include "simd_align.h"
+
+#include <cstring>
+#include <algorithm>
+
+
+// The kernel is compiled once for each supported instruction set and the best one for the CPU is
+// chosen at run time, so the library still works on CPUs without AVX2.
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define PORECHOP_SIMD_DISPATCH
+
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wpsabi"
+
+#if defined(__clang__)
+#pragma clang attribute push (__attribute__((target("sse4.1"))), apply_to = function)
+#else
+#pragma GCC push_options
+#pragma GCC target("sse4.1")
+#endif
+namespace sse41 {
+#define SIMD_VECTOR_BYTES 16
+#include "simd_align_kernel.h"
+#undef SIMD_VECTOR_BYTES
+}
+#if defined(__clang__)
+#pragma clang attribute pop
+#else
+#pragma GCC pop_options
+#endif
+
+#if defined(__clang__)
+#pragma clang attribute push (__attribute__((target("avx2"))), apply_to = function)
+#else
+#pragma GCC push_options
+#pragma GCC target("avx2")
+#endif
+namespace avx2 {
+#define SIMD_VECTOR_BYTES 32
+#include "simd_align_kernel.h"
+#undef SIMD_VECTOR_BYTES
+}
+#if defined(__clang__)
+#pragma clang attribute pop
+#else
+#pragma GCC pop_options
+#endif
+
+#pragma GCC diagnostic pop
+#endif
+
+
+// The largest number of lanes any of the kernels use.
+const int MAX_SIMD_LANES = 16;
+
+
+int simdLaneCount() {
+#ifdef PORECHOP_SIMD_DISPATCH
+    static int laneCount = -1;
+    if (laneCount == -1) {
+        __builtin_cpu_init();
+        if (__builtin_cpu_supports("avx2"))
+            laneCount = avx2::LANES;
+        else if (__builtin_cpu_supports("sse4.1"))
+            laneCount = sse41::LANES;
+        else
+            laneCount = 0;
+    }
+    return laneCount;
+#else
+    return 0;
+#endif
+}
+
+
+static void alignLanes(int laneCount, const int16_t * readCodes, const int16_t * adapterCodes,
+                       const int * readLengths, const int * adapterLengths,
+                       int maxReadLength, int maxAdapterLength, const SimdScores & scores,
+                       int16_t * hRows, int16_t * fColumn, int16_t * trace, SimdEnd * ends) {
+#ifdef PORECHOP_SIMD_DISPATCH
+    if (laneCount == avx2::LANES)
+        avx2::alignLanes(readCodes, adapterCodes, readLengths, adapterLengths, maxReadLength,
+                         maxAdapterLength, scores, hRows, fColumn, trace, ends);
+    else
+        sse41::alignLanes(readCodes, adapterCodes, readLengths, adapterLengths, maxReadLength,
+                          maxAdapterLength, scores, hRows, fColumn, trace, ends);
+#endif
+}
+
+
+// Follows one lane's trace from its end cell back to the matrix edge and summarises the alignment's
+// columns for ScoredAlignment. Ties are broken the same way as SeqAn: diagonal moves first, then
+// vertical, then horizontal, and extending a gap is preferred to opening one. When the gap open and
+// extension scores are equal, SeqAn switches to its linear gap algorithm, which looks at each cell
+// on its own instead of following a gap until it was opened and doesn't favour gaps at the end
+// cell, so that is mimicked too.
+static AlignmentColumns traceback(const int16_t * trace, int laneCount, int lane, int maxReadLength,
+                                  Dna5String & readSeq, Dna5String & adapterSeq, SimdEnd end,
+                                  bool linearGaps) {
+    const int rowSize = (maxReadLength + 1) * laneCount;
+    int readLength = length(readSeq), adapterLength = length(adapterSeq);
+
+    // The columns are visited backwards, so they are numbered from the alignment's end while
+    // walking and turned around at the end. A run of columns all have the same rows with bases.
+    AlignmentColumns columns{-1, -1, -1, -1, false, false, 0};
+    int columnCount = 0;
+    auto addColumns = [&](int count, bool readBase, bool adapterBase) {
+        if (count <= 0)
+            return;
+        if (readBase) {
+            if (columns.readLast == -1) {
+                columns.readLast = columnCount;
+                columns.readLastHasAdapterBase = adapterBase;
+            }
+            columns.readFirst = columnCount + count - 1;
+        }
+        if (adapterBase) {
+            if (columns.adapterLast == -1) {
+                columns.adapterLast = columnCount;
+                columns.adapterLastHasReadBase = readBase;
+            }
+            columns.adapterFirst = columnCount + count - 1;
+        }
+        columnCount += count;
+    };
+
+    // First come the free trailing gaps after the end cell.
+    addColumns(readLength - end.column, true, false);
+    addColumns(adapterLength - end.row, false, true);
+
+    // At the end cell itself, SeqAn prefers a gap to the diagonal move when they tie.
+    enum State {DIAGONAL, VERTICAL, HORIZONTAL};
+    State state = DIAGONAL;
+    int i = end.row, j = end.column;
+    if (!linearGaps && i > 0 && j > 0) {
+        int16_t bits = trace[i * rowSize + j * laneCount + lane];
+        if (bits & SIMD_TRACE_VERTICAL)
+            state = VERTICAL;
+        else if (bits & SIMD_TRACE_HORIZONTAL)
+            state = HORIZONTAL;
+    }
+    while (i > 0 && j > 0) {
+        int16_t bits = trace[i * rowSize + j * laneCount + lane];
+        if (state == DIAGONAL) {
+            if (bits & SIMD_TRACE_DIAGONAL) {
+                addColumns(1, true, true);
+                if (readSeq[j - 1] == adapterSeq[i - 1])
+                    ++columns.matchCount;
+                --i;
+                --j;
+                continue;
+            }
+            state = (bits & SIMD_TRACE_VERTICAL) ? VERTICAL : HORIZONTAL;
+        }
+        if (state == VERTICAL) {
+            addColumns(1, false, true);
+            if (linearGaps || (bits & SIMD_TRACE_VERTICAL_OPEN))
+                state = DIAGONAL;
+            --i;
+        }
+        else {
+            addColumns(1, true, false);
+            if (linearGaps || (bits & SIMD_TRACE_HORIZONTAL_OPEN))
+                state = DIAGONAL;
+            --j;
+        }
+    }
+
+    // Then the free leading gaps before the start cell.
+    addColumns(j, true, false);
+    addColumns(i, false, true);
+
+    auto turnAround = [&](int & column) {
+        if (column != -1)
+            column = columnCount - 1 - column;
+    };
+    turnAround(columns.readFirst);
+    turnAround(columns.readLast);
+    turnAround(columns.adapterFirst);
+    turnAround(columns.adapterLast);
+    return columns;
+}
+
+
+bool simdAdapterAlignment(Dna5String & readSeq, std::vector<Dna5String *> & adapterSeqs,
+                          Score<int, Simple> & scoringScheme, AlignmentThreshold * thresholds,
+                          AlignmentResult * results) {
+    int laneCount = simdLaneCount();
+    if (laneCount == 0)
+        return false;
+
+    SimdScores scores{int16_t(scoreMatch(scoringScheme)), int16_t(scoreMismatch(scoringScheme)),
+                      int16_t(scoreGapOpen(scoringScheme)),
+                      int16_t(scoreGapExtend(scoringScheme))};
+    // SeqAn has its own conventions for empty sequences, so leave those to the standard aligner.
+    int readLength = length(readSeq);
+    if (readLength == 0)
+        return false;
+    int maxAdapterLength = 0;
+    for (auto adapterSeq : adapterSeqs)
+        maxAdapterLength = std::max(maxAdapterLength, int(length(*adapterSeq)));
+
+    // Scores are kept in 16 bits, so don't use the SIMD aligner if they could overflow.
+    int largestScore = std::max({std::abs(int(scores.match)), std::abs(int(scores.mismatch)),
+                                 std::abs(int(scores.gapOpen)),
+                                 std::abs(int(scores.gapExtension))});
+    if (largestScore * (readLength + maxAdapterLength) >= -SIMD_NEGATIVE_INFINITY / 2)
+        return false;
+
+    // Every lane aligns the same read sequence, so its codes are just repeated across the lanes.
+    // Bases are compared by their Dna5 values, like SeqAn's simple score does.
+    std::vector<int16_t> readCodes(readLength * laneCount);
+    for (int j = 0; j < readLength; ++j)
+        std::fill_n(readCodes.begin() + j * laneCount, laneCount, int16_t(ordValue(readSeq[j])));
+
+    int rowSize = (readLength + 1) * laneCount;
+    std::vector<int16_t> adapterCodes, hRows(2 * rowSize), fColumn(rowSize), trace;
+    int readLengths[MAX_SIMD_LANES], adapterLengths[MAX_SIMD_LANES];
+    SimdEnd ends[MAX_SIMD_LANES];
+
+    // Aligns up to one lane's worth of the adapters (given by their indices), with or without the
+    // trace matrix.
+    auto alignBatch = [&](const int * adapterIndices, int batchSize, bool withTrace) {
+        int batchMaxAdapterLength = 0;
+        for (int k = 0; k < laneCount; ++k) {
+            readLengths[k] = (k < batchSize) ? readLength : 0;
+            adapterLengths[k] = (k < batchSize) ? length(*adapterSeqs[adapterIndices[k]]) : 0;
+            batchMaxAdapterLength = std::max(batchMaxAdapterLength, adapterLengths[k]);
+        }
+        adapterCodes.assign(batchMaxAdapterLength * laneCount, -1);
+        for (int k = 0; k < batchSize; ++k) {
+            Dna5String & adapterSeq = *adapterSeqs[adapterIndices[k]];
+            for (int i = 0; i < adapterLengths[k]; ++i)
+                adapterCodes[i * laneCount + k] = ordValue(adapterSeq[i]);
+        }
+        if (withTrace)
+            trace.resize((batchMaxAdapterLength + 1) * rowSize);
+        alignLanes(laneCount, readCodes.data(), adapterCodes.data(), readLengths, adapterLengths,
+                   readLength, batchMaxAdapterLength, scores, hRows.data(), fColumn.data(),
+                   withTrace ? trace.data() : nullptr, ends);
+    };
+
+    // With thresholds, a first score-only pass finds which adapters could pass them. The others
+    // get a score-only result and only the candidates are aligned again with the trace matrix.
+    std::vector<int> candidates;
+    if (thresholds == 0) {
+        for (size_t i = 0; i < adapterSeqs.size(); ++i)
+            candidates.push_back(i);
+    }
+    else {
+        std::vector<int> allAdapters(adapterSeqs.size());
+        for (size_t i = 0; i < adapterSeqs.size(); ++i)
+            allAdapters[i] = i;
+        for (size_t first = 0; first < allAdapters.size(); first += laneCount) {
+            int batchSize = std::min(int(allAdapters.size() - first), laneCount);
+            alignBatch(allAdapters.data() + first, batchSize, false);
+            for (int k = 0; k < batchSize; ++k) {
+                int a = allAdapters[first + k];
+                if (couldPassThreshold(ends[k].score, length(*adapterSeqs[a]), scoringScheme,
+                                       thresholds + a))
+                    candidates.push_back(a);
+                else
+                    fillScoreOnlyResult(ends[k].score, results + a);
+            }
+        }
+    }
+
+    bool linearGaps = (scores.gapOpen == scores.gapExtension);
+    for (size_t first = 0; first < candidates.size(); first += laneCount) {
+        int batchSize = std::min(int(candidates.size() - first), laneCount);
+        alignBatch(candidates.data() + first, batchSize, true);
+        for (int k = 0; k < batchSize; ++k) {
+            int a = candidates[first + k];
+            Dna5String & adapterSeq = *adapterSeqs[a];
+            AlignmentColumns columns = traceback(trace.data(), laneCount, k, readLength, readSeq,
+                                                 adapterSeq, ends[k], linearGaps);
+            ScoredAlignment scoredAlignment(columns, readLength, length(adapterSeq),
+                                            ends[k].score);
+            scoredAlignment.fillResult(results + a);
+        }
+    }
+    return true;
+}
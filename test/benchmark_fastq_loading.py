@@ -0,0 +1,86 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This script measures how fast Porechop loads FASTQ files, comparing the chunked parser in misc.py
+with a line by line parser (Porechop's original one). It isn't a test, so `python3 -m unittest`
+doesn't run it. To run it, execute `python3 -m test.benchmark_fastq_loading [reads.fastq]` from the
+root Porechop directory. Without a file, it makes up a plain FASTQ of random reads.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import os
+import random
+import sys
+import tempfile
+import time
+import porechop.misc
+from porechop.nanopore_read import NanoporeRead
+
+
+def line_by_line_fastq(fastq_filename):
+    if porechop.misc.get_compression_type(fastq_filename) == 'gz':
+        open_func = gzip.open
+    else:  # plain text
+        open_func = open
+    with open_func(fastq_filename, 'rt') as fastq:
+        for line in fastq:
+            full_name = line.strip()[1:]
+            short_name = full_name.split()[0]
+            sequence = next(fastq).strip()
+            spacer = next(fastq).strip()
+            qualities = next(fastq).strip()
+            yield short_name, sequence, spacer, qualities, full_name
+
+
+def make_fastq(filename, read_count=20000, read_length=5000):
+    random.seed(0)
+    with open(filename, 'wt') as fastq:
+        for i in range(read_count):
+            seq = ''.join(random.choices('ACGT', k=read_length))
+            quals = ''.join(random.choices('#+5?', k=read_length))
+            fastq.write('@read_' + str(i) + ' runid=0 ch=1\n' + seq + '\n+\n' + quals + '\n')
+
+
+def benchmark(name, parser, filename):
+    file_size = os.path.getsize(filename)
+    start_time = time.perf_counter()
+    read_count = 0
+    for record in parser(filename):
+        NanoporeRead(record[4], record[1], record[3])
+        read_count += 1
+    seconds = time.perf_counter() - start_time
+    print(name.ljust(14) + str(read_count).rjust(9) + ' reads  ' + ('%.2f' % seconds).rjust(7) +
+          ' s  ' + ('%.1f' % (file_size / seconds / 1e6)).rjust(7) + ' MB/s')
+    return seconds
+
+
+def main():
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+        temp_dir = None
+    else:
+        temp_dir = tempfile.TemporaryDirectory()
+        filename = os.path.join(temp_dir.name, 'reads.fastq')
+        make_fastq(filename)
+    print(filename + ' (' + '%.1f' % (os.path.getsize(filename) / 1e6) + ' MB)')
+
+    # Each parser runs twice and the second run counts, so both read from a warm file cache.
+    for _ in range(2):
+        line_by_line = benchmark('line by line', line_by_line_fastq, filename)
+        chunked = benchmark('chunked', porechop.misc.iterate_fastq, filename)
+    print('speed-up: ' + '%.2f' % (line_by_line / chunked) + 'x')
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -205,3 +205,97 @@ class TestBarcodes(unittest.TestCase):
         self.assertTrue('BC03         1  6,996' in out)
 
         self.assertTrue('Saving trimmed reads' in out)
+
+    def test_barcodes_simd_aligner(self):
+        """
+        Tests with --aligner simd, which should give the same results as the default aligner.
+        """
+        out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR --aligner simd')
+
+        self.assertEqual(self.count_output_fastq_files(), 4)
+        bc01_trimmed_reads = self.load_trimmed_reads('BC01.fastq')
+        bc02_trimmed_reads = self.load_trimmed_reads('BC02.fastq')
+        bc03_trimmed_reads = self.load_trimmed_reads('BC03.fastq')
+        none_trimmed_reads = self.load_trimmed_reads('none.fastq')
+
+        self.assertEqual(sorted(x[0] for x in bc01_trimmed_reads), ['1', '4'])
+        self.assertEqual(sorted(x[0] for x in bc02_trimmed_reads), ['2', '5'])
+        self.assertEqual(sorted(x[0] for x in bc03_trimmed_reads), ['3'])
+        self.assertEqual(sorted(x[0] for x in none_trimmed_reads), ['6', '8'])
+
+        self.assertEqual(sum(len(x[1]) for x in bc01_trimmed_reads), 8994)
+        self.assertEqual(sum(len(x[1]) for x in bc02_trimmed_reads), 9394)
+        self.assertEqual(sum(len(x[1]) for x in bc03_trimmed_reads), 6996)
+        self.assertEqual(sum(len(x[1]) for x in none_trimmed_reads), 13496)
+
+    def test_barcodes_quiet(self):
+        """
+        Tests with -v 0, where the adapter set search skips sets which can't match. The bins should
+        be the same as with the default verbosity.
+        """
+        out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR -v 0')
+        self.assertEqual(out, '')
+
+        self.assertEqual(self.count_output_fastq_files(), 4)
+        bc01_trimmed_reads = self.load_trimmed_reads('BC01.fastq')
+        bc02_trimmed_reads = self.load_trimmed_reads('BC02.fastq')
+        bc03_trimmed_reads = self.load_trimmed_reads('BC03.fastq')
+        none_trimmed_reads = self.load_trimmed_reads('none.fastq')
+
+        self.assertEqual(sorted(x[0] for x in bc01_trimmed_reads), ['1', '4'])
+        self.assertEqual(sorted(x[0] for x in bc02_trimmed_reads), ['2', '5'])
+        self.assertEqual(sorted(x[0] for x in bc03_trimmed_reads), ['3'])
+        self.assertEqual(sorted(x[0] for x in none_trimmed_reads), ['6', '8'])
+
+        self.assertEqual(sum(len(x[1]) for x in bc01_trimmed_reads), 8994)
+        self.assertEqual(sum(len(x[1]) for x in bc02_trimmed_reads), 9394)
+        self.assertEqual(sum(len(x[1]) for x in bc03_trimmed_reads), 6996)
+        self.assertEqual(sum(len(x[1]) for x in none_trimmed_reads), 13496)
+
+    def test_barcodes_batch_size(self):
+        """
+        Tests with --batch_size, which streams the reads through the bins a few at a time.
+        """
+        out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR --batch_size 3')
+
+        self.assertEqual(self.count_output_fastq_files(), 4)
+        bc01_trimmed_reads = self.load_trimmed_reads('BC01.fastq')
+        bc02_trimmed_reads = self.load_trimmed_reads('BC02.fastq')
+        bc03_trimmed_reads = self.load_trimmed_reads('BC03.fastq')
+        none_trimmed_reads = self.load_trimmed_reads('none.fastq')
+
+        self.assertEqual(sorted(x[0] for x in bc01_trimmed_reads), ['1', '4'])
+        self.assertEqual(sorted(x[0] for x in bc02_trimmed_reads), ['2', '5'])
+        self.assertEqual(sorted(x[0] for x in bc03_trimmed_reads), ['3'])
+        self.assertEqual(sorted(x[0] for x in none_trimmed_reads), ['6', '8'])
+
+        self.assertEqual(sum(len(x[1]) for x in bc01_trimmed_reads), 8994)
+        self.assertEqual(sum(len(x[1]) for x in bc02_trimmed_reads), 9394)
+        self.assertEqual(sum(len(x[1]) for x in bc03_trimmed_reads), 6996)
+        self.assertEqual(sum(len(x[1]) for x in none_trimmed_reads), 13496)
+
+        self.assertTrue('8 reads processed' in out)
+        self.assertTrue('BC02         2   9,394' in out)
+
+    def test_barcodes_processes(self):
+        """
+        Tests with --processes, where worker processes do the adapter searches. The bins should be
+        the same as with the searches done in one process.
+        """
+        out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR --processes 2')
+
+        self.assertEqual(self.count_output_fastq_files(), 4)
+        bc01_trimmed_reads = self.load_trimmed_reads('BC01.fastq')
+        bc02_trimmed_reads = self.load_trimmed_reads('BC02.fastq')
+        bc03_trimmed_reads = self.load_trimmed_reads('BC03.fastq')
+        none_trimmed_reads = self.load_trimmed_reads('none.fastq')
+
+        self.assertEqual(sorted(x[0] for x in bc01_trimmed_reads), ['1', '4'])
+        self.assertEqual(sorted(x[0] for x in bc02_trimmed_reads), ['2', '5'])
+        self.assertEqual(sorted(x[0] for x in bc03_trimmed_reads), ['3'])
+        self.assertEqual(sorted(x[0] for x in none_trimmed_reads), ['6', '8'])
+
+        self.assertEqual(sum(len(x[1]) for x in bc01_trimmed_reads), 8994)
+        self.assertEqual(sum(len(x[1]) for x in bc02_trimmed_reads), 9394)
+        self.assertEqual(sum(len(x[1]) for x in bc03_trimmed_reads), 6996)
+        self.assertEqual(sum(len(x[1]) for x in none_trimmed_reads), 13496)
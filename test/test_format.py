@@ -15,9 +15,13 @@ not, see <http://www.gnu.org/licenses/>.
 """
 
 import unittest
+import gzip
 import os
 import subprocess
 import shutil
+import struct
+import porechop.bam
+import porechop.gzip_writer
 import porechop.misc
 
 
@@ -25,7 +29,7 @@ def get_read_type(filename):
     _, read_type = porechop.misc.load_fasta_or_fastq(filename)
     read_type = read_type.lower()
     compression_type = porechop.misc.get_compression_type(filename)
-    if compression_type == 'plain':
+    if compression_type == 'plain' or read_type == 'bam':  # BAM is always gzipped (as BGZF)
         return read_type
     elif compression_type == 'gz':
         return read_type + '.gz'
@@ -77,6 +81,116 @@ class TestOutputFormat(unittest.TestCase):
         self.run_command('porechop -i IN -o OUT.fAsTq.Gz', 'test_format.fastq')
         self.assertEqual(get_read_type(self.output_file), 'fastq.gz')
 
+    def test_auto_format_fastq_to_fastq_gz_fastest_compression(self):
+        self.run_command('porechop -i IN -o OUT.fastq.gz --compression_level 1',
+                         'test_format.fastq')
+        self.assertEqual(get_read_type(self.output_file), 'fastq.gz')
+
+    def test_bgzf_output_with_index(self):
+        self.run_command('porechop -i IN -o OUT.fastq.gz --bgzf', 'test_format.fastq')
+        self.assertEqual(get_read_type(self.output_file), 'fastq.gz')
+        index_filename = self.output_file + '.idx'
+        try:
+            with open(index_filename, 'rt') as index_file:
+                index = [line.rstrip('\n').split('\t') for line in index_file]
+        finally:
+            os.remove(index_filename)
+        reads, _ = porechop.misc.load_fasta_or_fastq(self.output_file)
+        self.assertEqual([x[0] for x in index], [x[0] for x in reads])
+
+        # Decompressing from a read's block, after skipping its offset in the block, should give
+        # the read's header.
+        with open(self.output_file, 'rb') as bgzf_file:
+            for read_name, block_offset, offset_in_block in index:
+                bgzf_file.seek(int(block_offset))
+                block_reader = gzip.GzipFile(fileobj=bgzf_file)
+                block_reader.read(int(offset_in_block))
+                header = block_reader.readline().decode()
+                self.assertEqual(header.split()[0], '@' + read_name)
+
+    def test_auto_format_fastq_to_bam(self):
+        self.run_command('porechop -i IN -o OUT.bam', 'test_format.fastq')
+        self.assertEqual(get_read_type(self.output_file), 'bam')
+
+    def test_bam_output_matches_fastq_output(self):
+        self.run_command('porechop -i IN -o OUT.fastq', 'test_format.fastq')
+        fastq_reads, _ = porechop.misc.load_fasta_or_fastq(self.output_file)
+        os.remove(self.output_file)
+        self.run_command('porechop -i IN -o OUT.bam', 'test_format.fastq')
+        bam_reads, _ = porechop.misc.load_fasta_or_fastq(self.output_file)
+        self.assertEqual([(x[0], x[1], x[3]) for x in fastq_reads],
+                         [(x[0], x[1], x[2]) for x in bam_reads])
+
+        # Each read has a trim tag (an array of two unsigned ints) with the range of the input read
+        # which was kept.
+        for bam_read in bam_reads:
+            self.assertTrue(bam_read[3].startswith(b'trBI\x02\x00\x00\x00'))
+            trim_start, trim_end = struct.unpack('<II', bam_read[3][8:])
+            self.assertEqual(trim_end - trim_start, len(bam_read[1]))
+
+    def test_bam_input_tags_carried_through(self):
+        self.run_command('porechop -i IN -o OUT.bam', 'test_format.fastq')
+        trimmed_once = self.output_file + '.trimmed_once.bam'
+        os.rename(self.output_file, trimmed_once)
+        try:
+            self.run_command('porechop -i ' + trimmed_once + ' -o OUT.bam', 'test_format.fastq')
+            first_reads, _ = porechop.misc.load_fasta_or_fastq(trimmed_once)
+            second_reads, read_type = porechop.misc.load_fasta_or_fastq(self.output_file)
+        finally:
+            os.remove(trimmed_once)
+        self.assertEqual(read_type, 'BAM')
+        self.assertEqual([x[0] for x in first_reads], [x[0] for x in second_reads])
+
+        # The second run's trim tag replaces the first's, so the reads still have one tag each.
+        for read in second_reads:
+            self.assertEqual(read[3].count(b'trBI'), 1)
+            trim_start, trim_end = struct.unpack('<II', read[3][8:])
+            self.assertEqual(trim_end - trim_start, len(read[1]))
+
+    def test_bam_per_base_tags(self):
+        """
+        Base modification (MM/ML) and move table (mv) tags describe every base of the input read,
+        so they're only kept on reads which come out whole. Other tags are kept on every read.
+        """
+        input_reads, _ = porechop.misc.load_fasta_or_fastq(
+            os.path.join(os.path.dirname(__file__), 'test_one_adapter_set.fastq'))
+        input_reads.append(('no_adapters', input_reads[2][1][1000:3000], '',
+                            input_reads[2][3][1000:3000], 'no_adapters'))
+        tags = (b'MMZC+m,0;\x00' + b'MLBC' + struct.pack('<i', 1) + b'\xc8' +
+                b'mvBc' + struct.pack('<i', 2) + b'\x05\x01' + b'RGZrun1\x00')
+        tagged_bam = 'TEMP_tagged_' + str(os.getpid()) + '.bam'
+        with open(tagged_bam, 'wb') as bam_file:
+            writer = porechop.bam.BamWriter(bam_file, porechop.gzip_writer.GzipCompressor(1, 6),
+                                            None, '')
+            for i, read in enumerate(input_reads):
+                record = bytearray(porechop.bam.bam_record(read[0], read[1], read[3], tags, 0,
+                                                           len(read[1])))
+                if i == 0:  # the first read is flagged as reverse strand
+                    record[18] |= porechop.bam.REVERSE_STRAND
+                writer.write_bytes(bytes(record))
+            writer.close()
+        try:
+            self.run_command('porechop -i ' + tagged_bam + ' -o OUT.bam', 'test_format.fastq')
+            output_reads, _ = porechop.misc.load_fasta_or_fastq(self.output_file)
+        finally:
+            os.remove(tagged_bam)
+
+        input_lengths = {x[0]: len(x[1]) for x in input_reads}
+        whole_reads, cut_reads = 0, 0
+        for name, seq, _, read_tags in output_reads:
+            self.assertTrue(b'RGZrun1\x00' in read_tags)
+            trim_start, trim_end = struct.unpack('<II', read_tags[-8:])
+            if name in input_lengths and name != input_reads[0][0] and \
+                    (trim_start, trim_end) == (0, input_lengths[name]):
+                whole_reads += 1
+                self.assertTrue(read_tags.startswith(tags[:-9]))
+            else:
+                cut_reads += 1
+                for tag_name in (b'MMZ', b'MLB', b'mvB'):
+                    self.assertFalse(tag_name in read_tags)
+        self.assertTrue(whole_reads > 0)
+        self.assertTrue(cut_reads > 0)
+
     # The following tests use the auto format and pipe to output. They determine the output format
     # from the input filename, but won't gzip the reads.
 
@@ -96,6 +210,14 @@ class TestOutputFormat(unittest.TestCase):
         self.run_command('porechop -i IN > OUT', 'test_format.fasta.gz')
         self.assertEqual(get_read_type(self.output_file), 'fasta')
 
+    def test_auto_format_fastq_gz_from_stdin(self):
+        self.run_command('porechop -i - -o OUT.fastq < IN', 'test_format.fastq.gz')
+        self.assertEqual(get_read_type(self.output_file), 'fastq')
+
+    def test_auto_format_fasta_from_stdin_to_pipe(self):
+        self.run_command('porechop -i - < IN > OUT', 'test_format.fasta')
+        self.assertEqual(get_read_type(self.output_file), 'fasta')
+
     # The following tests explicitly set the output format.
 
     def test_explicit_format_fastq_to_fastq(self):
@@ -141,6 +263,21 @@ class TestOutputFormat(unittest.TestCase):
         self.run_command('porechop -i IN -o OUT.fastq.gz --format fasta.gz', 'test_format.fasta')
         self.assertEqual(get_read_type(self.output_file), 'fasta.gz')
 
+    # A gzipped input file which was cut short should give an error message, not a traceback.
+
+    def test_truncated_gz_input(self):
+        test_dir = os.path.dirname(__file__)
+        with open(os.path.join(test_dir, 'test_format.fastq.gz'), 'rb') as gzipped_file:
+            gzipped_data = gzipped_file.read()
+        truncated_filename = 'TEMP_' + str(os.getpid()) + '_truncated.fastq.gz'
+        with open(os.path.join(test_dir, truncated_filename), 'wb') as truncated_file:
+            truncated_file.write(gzipped_data[:len(gzipped_data) // 2])
+        try:
+            _, err = self.run_command('porechop -i IN -o OUT.fastq', truncated_filename)
+        finally:
+            os.remove(os.path.join(test_dir, truncated_filename))
+        self.assertTrue('could not be decompressed' in err)
+
 
 class TestOutputFormatBarcodes(unittest.TestCase):
 
@@ -264,6 +264,106 @@ class TestOneAdapterSet(unittest.TestCase):
         self.run_command('porechop -i INPUT -o OUTPUT.fastq --threads 8')
         self.check_trimmed_reads()
 
+    def test_myers_aligner(self):
+        """
+        The Myers aligner narrows down the middle adapter search, which shouldn't change the
+        results here.
+        """
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --aligner myers')
+        self.check_trimmed_reads()
+
+    def test_end_band(self):
+        """
+        The adapters in these reads are right at the read ends, so anchoring the end alignments
+        shouldn't change the results.
+        """
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --end_band 30')
+        self.check_trimmed_reads()
+
+    def test_batch_size(self):
+        """
+        Streaming the reads in small batches should give the same reads as loading them all.
+        """
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --batch_size 3')
+        self.check_trimmed_reads()
+
+    def test_stdin_batch_size(self):
+        """
+        Reads piped in can't be read twice, so the check reads must be reused for the first batch.
+        """
+        self.run_command('cat INPUT | porechop -i - -o OUTPUT.fastq --batch_size 3')
+        self.check_trimmed_reads()
+
+    def test_shards_with_saved_adapter_sets(self):
+        """
+        Trimming the input in three shards, with the adapter sets found by a run on all of it,
+        should give the same reads as that run.
+        """
+        adapter_sets_file = 'TEMP_' + str(os.getpid()) + '_adapter_sets.tsv'
+        try:
+            self.run_command('porechop -i INPUT -o OUTPUT.fastq --save_adapter_sets ' +
+                             adapter_sets_file)
+            all_reads, _ = self.load_trimmed_reads()
+            shard_reads = []
+            for shard_num in range(1, 4):
+                os.remove(self.output_file)
+                self.run_command('porechop -i INPUT -o OUTPUT.fastq --shard ' + str(shard_num) +
+                                 '/3 --load_adapter_sets ' + adapter_sets_file)
+                shard_reads += self.load_trimmed_reads()[0]
+        finally:
+            os.remove(adapter_sets_file)
+        self.assertTrue(all_reads)
+        self.assertEqual(all_reads, shard_reads)
+
+    def test_saved_adapter_sets_same_at_any_verbosity(self):
+        """
+        The saved adapter set results hold every set's best scores, so they don't depend on how
+        much the run that saved them displayed.
+        """
+        adapter_sets_files = ['TEMP_' + str(os.getpid()) + '_adapter_sets_' + str(v) + '.tsv'
+                              for v in range(2)]
+        try:
+            for verbosity, adapter_sets_file in enumerate(adapter_sets_files):
+                self.run_command('porechop -i INPUT -o OUTPUT.fastq -v ' + str(verbosity) +
+                                 ' --save_adapter_sets ' + adapter_sets_file)
+            with open(adapter_sets_files[0]) as quiet, open(adapter_sets_files[1]) as verbose:
+                self.assertEqual(quiet.read(), verbose.read())
+        finally:
+            for adapter_sets_file in adapter_sets_files:
+                if os.path.isfile(adapter_sets_file):
+                    os.remove(adapter_sets_file)
+
+    def test_chunked_output(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq')
+        all_reads, _ = self.load_trimmed_reads()
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --chunk_reads 5')
+        chunk_files = sorted(x for x in os.listdir('.') if x.startswith(self.output_file[:-6]) and
+                             x != self.output_file)
+        chunk_reads = []
+        try:
+            self.assertEqual(chunk_files, [self.output_file[:-6] + '.0001.fastq',
+                                           self.output_file[:-6] + '.0002.fastq',
+                                           self.output_file[:-6] + '.0003.fastq'])
+            for chunk_file in chunk_files:
+                chunk_reads.append(porechop.misc.load_fasta_or_fastq(chunk_file)[0])
+        finally:
+            for chunk_file in chunk_files:
+                os.remove(chunk_file)
+        self.assertEqual([len(x) for x in chunk_reads], [5, 5, 2])
+        self.assertEqual([(x[4], x[1], x[3]) for x in sum(chunk_reads, [])], all_reads)
+
+    def test_processes(self):
+        """
+        Searching for adapters in worker processes should trim and split the reads the same way,
+        with or without --batch_size.
+        """
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq')
+        all_reads, _ = self.load_trimmed_reads()
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --processes 2')
+        self.assertEqual(self.load_trimmed_reads()[0], all_reads)
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --processes 3 --batch_size 4')
+        self.assertEqual(self.load_trimmed_reads()[0], all_reads)
+
     def test_end_size_1(self):
         self.run_command('porechop -i INPUT -o OUTPUT.fastq --end_size 50')
         self.check_trimmed_reads()